@@ -30,4 +30,13 @@ CLIENT_CONFIG_KEYS = ['uri', 'api_version', 'verify_ssl_certs', 'log_file',
 
 CLIENT_CREDENTIALS_KEYS = ['user', 'password', 'org']
 
+SESSION_TOKEN_KEY = '__vcd_session'
+
+PENDING_TASKS_KEY = '__pending_tasks'
+# The NIC delete task of unlink, which runs before the network is removed.
+NIC_DELETE_TASKS_KEY = '__nic_delete_tasks'
+
 NO_RESOURCE_OK = ['unlink', 'delete', 'stop', 'postdelete', 'prestop']
+
+# Operations that compute the expensive fields of exposed_data again.
+REFRESH_EXPOSED_DATA = ['create', 'configure']
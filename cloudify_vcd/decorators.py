@@ -9,6 +9,7 @@ from pyvcloud.vcd.exceptions import (
     NotFoundException)
 
 from functools import wraps
+from lxml.objectify import ObjectifiedElement
 
 from cloudify.decorators import operation
 from cloudify.exceptions import (
@@ -17,13 +18,22 @@ from cloudify.exceptions import (
 
 from .constants import NO_RESOURCE_OK
 from .utils import (
+    RUNTIME_PROPERTIES,
     expose_props,
     get_last_task,
     retry_or_raise,
     invalid_resource,
     get_resource_data,
+    get_pending_tasks,
+    release_clients,
+    store_pending_tasks,
+    store_session_tokens,
+    validate_exposed_fields,
     check_if_task_successful)
-from vcd_plugin_sdk.exceptions import VCloudSDKException
+from vcd_plugin_sdk.tasks import TaskSet
+from vcd_plugin_sdk.exceptions import (
+    VCloudSDKException,
+    VCloudSDKRetryException)
 
 
 def resource_operation(func):
@@ -33,68 +43,104 @@ def resource_operation(func):
         ctx = kwargs.pop('ctx', None)
         operation_name = ctx.operation.name.split('.')[-1]
         resource_data = get_resource_data(ctx)
+        validate_exposed_fields(resource_data.primary_ctx,
+                                resource_data.primary_class)
         args = resource_data.primary
         if resource_data.secondary:
             args.extend(resource_data.secondary)
-        last_task = get_last_task(
-            resource_data.primary_ctx.instance.runtime_properties.get(
-                '__last_task'))
+        RUNTIME_PROPERTIES.start()
+        try:
+            runtime_properties = \
+                resource_data.primary_ctx.instance.runtime_properties
+            last_task = get_last_task(runtime_properties.get('__last_task'))
+            pending_tasks = get_pending_tasks(runtime_properties,
+                                              operation_name)
 
-        if not resource_data.primary_external:
-            try:
-                ctx.logger.debug('Executing func {func} '
-                                 'with args {args} '
-                                 'kwargs {kwargs}'.format(
-                                     func=func, args=args, kwargs=kwargs))
-                resource, result = func(*args, **kwargs)
-                ctx.logger.debug('Executed func {func} '
-                                 'result {result}'.format(
-                                     func=func, result=result))
-            except (AccessForbiddenException,
-                    InternalServerException,
-                    EntityNotFoundException,
-                    MissingLinkException,
-                    BadRequestException,
-                    VCloudSDKException,
-                    NotFoundException,
-                    AttributeError) as e:
-                ctx.logger.error(
-                    'Failed to execute func {func} '
-                    'with args {args} '
-                    'kwargs {kwargs} '
-                    'Error: {e}'.format(func=func,
-                                        args=args,
-                                        kwargs=kwargs,
-                                        e=str(e)))
-                retry_or_raise(e, resource_data, operation_name)
-            else:
-                last_task = get_last_task(result)
+            if pending_tasks:
+                # A previous attempt started these tasks, so we only need to
+                # check on them, and not execute the operation again.
+                last_task = pending_tasks
+            elif not resource_data.primary_external:
+                try:
+                    ctx.logger.debug('Executing func {func} '
+                                     'with args {args} '
+                                     'kwargs {kwargs}'.format(
+                                         func=func, args=args, kwargs=kwargs))
+                    resource, result = func(*args, **kwargs)
+                    ctx.logger.debug('Executed func {func} '
+                                     'result {result}'.format(
+                                         func=func, result=result))
+                except (AccessForbiddenException,
+                        InternalServerException,
+                        EntityNotFoundException,
+                        MissingLinkException,
+                        BadRequestException,
+                        VCloudSDKException,
+                        NotFoundException,
+                        AttributeError) as e:
+                    ctx.logger.error(
+                        'Failed to execute func {func} '
+                        'with args {args} '
+                        'kwargs {kwargs} '
+                        'Error: {e}'.format(func=func,
+                                            args=args,
+                                            kwargs=kwargs,
+                                            e=str(e)))
+                    retry_or_raise(e, resource_data, operation_name)
+                else:
+                    last_task = get_last_task(result)
 
-        if not resource:
-            args[0] = True  # Tell the function to expect external resource.
-            try:
-                resource, _ = func(*args, **kwargs)
-            except (TypeError, NotFoundException, EntityNotFoundException):
-                ctx.logger.error('Attempted to perform {op} '
-                                 'operation on {r}, '
-                                 'but the resource was not '
-                                 'found.'.format(
-                                     op=operation_name,
-                                     r=resource_data.primary_id))
-                if operation_name not in NO_RESOURCE_OK:
-                    raise NonRecoverableError(
-                        'The expected resource {r} does not exist.'.format(
-                            r=resource_data.primary_id))
-            except AccessForbiddenException as e:
-                if not invalid_resource(e):
-                    raise OperationRetry(e)
+            if not resource:
+                # Tell the function to expect external resource.
+                args[0] = True
+                try:
+                    resource, _ = func(*args, **kwargs)
+                except (TypeError, NotFoundException, EntityNotFoundException):
+                    ctx.logger.error('Attempted to perform {op} '
+                                     'operation on {r}, '
+                                     'but the resource was not '
+                                     'found.'.format(
+                                         op=operation_name,
+                                         r=resource_data.primary_id))
+                    if operation_name not in NO_RESOURCE_OK:
+                        raise NonRecoverableError(
+                            'The expected resource {r} does not exist.'.format(
+                                r=resource_data.primary_id))
+                except AccessForbiddenException as e:
+                    if not invalid_resource(e):
+                        raise OperationRetry(e)
 
-        if not check_if_task_successful(resource, last_task):
-            resource_data.primary_ctx.instance.runtime_properties[
-                '__RETRY_BAD_REQUEST'] = True
-            raise OperationRetry('Pending for operation completion.')
-        expose_props(operation_name,
-                     resource,
-                     _ctx=resource_data.primary_ctx)
+            if isinstance(last_task, ObjectifiedElement) and \
+                    last_task.get('href'):
+                # Poll a single task like a task set, so that the next
+                # attempt polls it again, while it is still running.
+                task_set = TaskSet()
+                task_set.add(last_task)
+                last_task = task_set
+            try:
+                task_successful = check_if_task_successful(
+                    resource, last_task)
+            finally:
+                if isinstance(last_task, TaskSet):
+                    store_pending_tasks(resource_data.primary_ctx,
+                                        last_task,
+                                        operation_name)
+            if not task_successful:
+                runtime_properties['__RETRY_BAD_REQUEST'] = True
+                raise OperationRetry('Pending for operation completion.')
+            expose_props(operation_name,
+                         resource,
+                         _ctx=resource_data.primary_ctx)
+        except VCloudSDKRetryException as e:
+            raise OperationRetry(str(e), retry_after=e.retry_after)
+        finally:
+            try:
+                # Also on retry, so that the next attempt can resume the
+                # session.
+                store_session_tokens(resource_data)
+            finally:
+                release_clients(resource_data)
+                # Every instance is written once, also on retry.
+                RUNTIME_PROPERTIES.flush(ctx)
 
     return operation(func=wrapper, resumable=True)
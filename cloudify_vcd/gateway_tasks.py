@@ -52,16 +52,8 @@ def create_firewall_rules(_,
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc, gateway_config)
     firewall_rules = {
-        'rules': {}
+        'rules': gateway.create_firewall_rules(firewall_config)
     }
-    for firewall_rule_name, firewall_rule_config in firewall_config.items():
-        result = gateway.create_firewall_rule(
-            firewall_rule_name, **firewall_rule_config)
-        firewall_rules['rules'].update(
-            {
-                result['Name']: result
-            }
-        )
     expose_props('create', gateway, firewall_rules, _ctx=firewall_ctx)
     return gateway, None
 
@@ -120,8 +112,7 @@ def create_static_routes(_,
 
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
-    for static_route in static_routes_config:
-        gateway.add_static_route(static_route)
+    gateway.add_static_routes(static_routes_config)
     return gateway, None
 
 
@@ -144,13 +135,10 @@ def delete_static_routes(_,
 
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
-    for static_route in static_routes_config:
-        try:
-            gateway.delete_static_route(static_route)
-        except VCloudSDKException:
-            ctx.logger.error(
-                'Attempted to delete static route {r}, '
-                'but the resource was not found.'.format(r=static_route))
+    for static_route in gateway.delete_static_routes(static_routes_config):
+        ctx.logger.error(
+            'Attempted to delete static route {r}, '
+            'but the resource was not found.'.format(r=static_route))
 
     return gateway, None
 
@@ -175,8 +163,7 @@ def create_dhcp_pools(_,
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
     dhcp_pools = {'pools': {}}
-    for pool_definition in dhcp_pool_config:
-        result = gateway.add_dhcp_pool(pool_definition)
+    for result in gateway.add_dhcp_pools(dhcp_pool_config):
         ctx.logger.info('result {}'.format(result))
         dhcp_pools['pools'].update(
             {
@@ -204,13 +191,10 @@ def delete_dhcp_pools(_,
                       **__________):
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
-    for pool_definition in dhcp_pool_config:
-        try:
-            gateway.delete_dhcp_pool(pool_definition)
-        except VCloudSDKException:
-            ctx.logger.error(
-                'Attempted to delete dhcp pool {p}, '
-                'but the resource was not found.'.format(p=pool_definition))
+    for pool_definition in gateway.delete_dhcp_pools(dhcp_pool_config):
+        ctx.logger.error(
+            'Attempted to delete dhcp pool {p}, '
+            'but the resource was not found.'.format(p=pool_definition))
     return gateway, None
 
 
@@ -234,14 +218,16 @@ def create_nat_rules(_,
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
     nat_rules = {'rules': {}}
-    for nat_rule_def in nat_rule_config:
-        result = gateway.create_nat_rule(nat_rule_def)
+    # Only the rules of this node are reused, so that delete_nat_rules
+    # does not delete the rules of others.
+    rule_ids = nat_rule_ctx.instance.runtime_properties.get('rules', {})
+    for result in gateway.create_nat_rules(nat_rule_config, list(rule_ids)):
         nat_rules['rules'].update(
             {
                 result['ID']: result
             }
         )
-        expose_props('create', gateway, nat_rules, _ctx=nat_rule_ctx)
+    expose_props('create', gateway, nat_rules, _ctx=nat_rule_ctx)
     return gateway, None
 
 
@@ -264,11 +250,8 @@ def delete_nat_rules(_,
     gateway = gateway_class(
         gateway_id, gateway_client, gateway_vdc)
     nat_rules = nat_rule_ctx.instance.runtime_properties.get('rules')
-    for nat_rule_id, _ in nat_rules.items():
-        try:
-            gateway.delete_nat_rule(nat_rule_id)
-        except VCloudSDKException:
-            ctx.logger.error(
-                'Attempted to delete nat rule {r}, '
-                'but the resource was not found.'.format(r=nat_rule_id))
+    for nat_rule_id in gateway.delete_nat_rules(list(nat_rules)):
+        ctx.logger.error(
+            'Attempted to delete nat rule {r}, '
+            'but the resource was not found.'.format(r=nat_rule_id))
     return gateway, None
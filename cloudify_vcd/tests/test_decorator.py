@@ -1,14 +1,17 @@
 import mock
 import pytest
 
-from pyvcloud.vcd.client import E
+from pyvcloud.vcd.client import E, TaskStatus
 from cloudify.exceptions import (OperationRetry, NonRecoverableError)
 from pyvcloud.vcd.exceptions import (
     BadRequestException,
     EntityNotFoundException,
     AccessForbiddenException)
 
+from vcd_plugin_sdk.tasks import TaskSet
+
 from ..decorators import resource_operation
+from ..utils import update_runtime_properties
 from .test_utils import (
     get_mock_relationship_context,
     get_mock_node_instance_context)
@@ -310,3 +313,137 @@ def test_new_relationship_resource_not_found(*_, **__):
     with pytest.raises(NonRecoverableError) as e_info:
         test_func(ctx=_ctx)
         assert 'operation on foo' in e_info
+
+
+@mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
+@mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
+@mock.patch('cloudify_vcd.decorators.check_if_task_successful')
+def test_pending_tasks(check_if_task_successful, *_):
+    """
+    Check that running tasks are polled on the next attempt,
+    instead of executing the operation again.
+    :return:
+    """
+    operation = {'name': 'create', 'retry_number': 0}
+    _ctx = get_mock_node_instance_context(operation=operation)
+    task_set = TaskSet()
+    task_set.add(E.Task(href='foo'))
+    task_set.add(E.Task(href='bar'))
+    calls = []
+
+    @resource_operation
+    def test_func(ext, name, client, vdc, config, obj, __ctx):
+        calls.append(ext)
+        return obj(name, 'bar', client, vdc, {}, config), task_set
+
+    def still_running(_, tasks):
+        assert tasks.pending == ['foo', 'bar']
+        raise OperationRetry('Still running.')
+    check_if_task_successful.side_effect = still_running
+    with pytest.raises(OperationRetry):
+        test_func(ctx=_ctx)
+    assert calls == [False]
+    assert _ctx.instance.runtime_properties['__pending_tasks'] == \
+        {'operation': 'create', 'tasks': ['foo', 'bar']}
+    assert _ctx.instance.runtime_properties['__RETRY_BAD_REQUEST']
+
+    # On the next attempt, the resource is only looked up.
+    _ctx.operation._operation_context['retry_number'] = 1
+    client = mock.Mock()
+    client.get_resource.return_value = E.Task(status='success')
+
+    def finished(_, tasks):
+        return tasks.poll(client) == TaskStatus.SUCCESS
+    check_if_task_successful.side_effect = finished
+    test_func(ctx=_ctx)
+    assert calls == [False, True]
+    assert isinstance(check_if_task_successful.call_args[0][1], TaskSet)
+    assert list(check_if_task_successful.call_args[0][1]) == ['foo', 'bar']
+    assert '__pending_tasks' not in _ctx.instance.runtime_properties
+
+    # Tasks of another operation are not polled, and are forgotten.
+    _ctx.instance.runtime_properties['__pending_tasks'] = {
+        'operation': 'create', 'tasks': ['foo']}
+    _ctx.operation._operation_context['name'] = 'stop'
+    _ctx.operation._operation_context['retry_number'] = 0
+    check_if_task_successful.side_effect = None
+    check_if_task_successful.return_value = True
+    task_set = TaskSet()
+    test_func(ctx=_ctx)
+    assert calls == [False, True, False]
+    assert check_if_task_successful.call_args[0][1] is task_set
+    assert '__pending_tasks' not in _ctx.instance.runtime_properties
+
+
+@mock.patch('vcd_plugin_sdk.resources.base.VCloudResource.refresh')
+@mock.patch('vcd_plugin_sdk.tasks.get_task_status')
+@mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
+@mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
+def test_pending_single_task(_, __, get_task_status, *___):
+    """
+    Check that a single running task is polled on the next attempt,
+    and not only the tasks of a task set.
+    :return:
+    """
+    operation = {'name': 'create', 'retry_number': 0}
+    _ctx = get_mock_node_instance_context(operation=operation)
+    calls = []
+
+    @resource_operation
+    def test_func(ext, name, client, vdc, config, obj, __ctx):
+        calls.append(ext)
+        return obj(name, 'bar', client, vdc, {}, config), \
+            E.Task(href='foo', status='running')
+
+    get_task_status.return_value = (
+        TaskStatus.RUNNING, E.Task(href='foo', status='running'))
+    with pytest.raises(OperationRetry):
+        test_func(ctx=_ctx)
+    assert calls == [False]
+    assert _ctx.instance.runtime_properties['__pending_tasks'] == \
+        {'operation': 'create', 'tasks': ['foo']}
+    assert _ctx.instance.runtime_properties['__RETRY_BAD_REQUEST']
+
+    # The retry polls the task, which failed.
+    _ctx.operation._operation_context['retry_number'] = 1
+    get_task_status.return_value = (
+        TaskStatus.ERROR,
+        E.Task(E.Error(message='failed'), href='foo', status='error'))
+    with pytest.raises(OperationRetry):
+        test_func(ctx=_ctx)
+    assert calls == [False, True]
+    assert get_task_status.call_count == 2
+    assert get_task_status.call_args[0][1] == 'foo'
+    assert '__created' not in _ctx.instance.runtime_properties
+
+
+@mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
+@mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
+@mock.patch('cloudify_vcd.decorators.check_if_task_successful')
+def test_runtime_properties_written_once(check_if_task_successful, *_):
+    """
+    Check that the runtime properties are written once per operation,
+    also when it is retried.
+    :return:
+    """
+    operation = {'name': 'create', 'retry_number': 0}
+    _ctx = get_mock_node_instance_context(operation=operation)
+
+    @resource_operation
+    def test_func(ext, name, client, vdc, config, obj, __ctx):
+        update_runtime_properties(__ctx, {'foo': 'bar'})
+        update_runtime_properties(__ctx, {'baz': 'taco'})
+        return obj(name, 'bar', client, vdc, {}, config), None
+
+    with mock.patch.object(_ctx.instance, 'update') as update:
+        test_func(ctx=_ctx)
+        update.assert_called_once()
+    assert _ctx.instance.runtime_properties['baz'] == 'taco'
+    assert '__created' in _ctx.instance.runtime_properties
+
+    check_if_task_successful.return_value = False
+    with mock.patch.object(_ctx.instance, 'update') as update:
+        with pytest.raises(OperationRetry):
+            test_func(ctx=_ctx)
+        update.assert_called_once()
+    assert _ctx.instance.runtime_properties['__RETRY_BAD_REQUEST']
@@ -6,10 +6,14 @@ from cloudify.exceptions import (
     OperationRetry,
     NonRecoverableError)
 
+from pyvcloud.vcd.client import E
 from pyvcloud.vcd.exceptions import (
+    VcdTaskException,
     BadRequestException,
     EntityNotFoundException)
 
+from vcd_plugin_sdk.exceptions import VCloudSDKRetryException
+
 from .test_utils import (
     get_mock_relationship_context,
     get_mock_node_instance_context)
@@ -56,6 +60,11 @@ from ..vapp_tasks import (
     configure_nic,
     add_nic,
     delete_nic,
+    add_vms,
+    set_bulk_created,
+    delete_vms,
+    set_bulk_deleted,
+    group_vms_by_vapp,
     REL_VM_VAPP,
     REL_NIC_NETWORK
 )
@@ -100,9 +109,10 @@ def test_delete_gateway(*_, **__):
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
-@mock.patch('cloudify_vcd.constants.VCloudGateway.infer_rule')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.create_firewall_rules',
+            return_value={'foo': {'Id': 1, 'Name': 'foo'}})
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_create_firewall_rules(*_, **__):
+def test_create_firewall_rules(_, create_rules, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -150,7 +160,11 @@ def test_create_firewall_rules(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(source=source, target=target)
     create_firewall_rules(ctx=_ctx)
-    assert 'rules' in _ctx.target.instance.runtime_properties
+    # All of the rules are created together.
+    create_rules.assert_called_once_with(
+        target_node.properties['resource_config'])
+    assert _ctx.target.instance.runtime_properties['rules'] == {
+        'foo': {'Id': 1, 'Name': 'foo'}}
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
@@ -215,8 +229,9 @@ def test_delete_firewall_rules(*_, **__):
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.add_static_routes')
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_create_static_routes(*_, **__):
+def test_create_static_routes(_, add_routes, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -258,13 +273,15 @@ def test_create_static_routes(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(source=source, target=target)
     create_static_routes(ctx=_ctx)
-    # TODO: Figure out what we can assert here.
+    add_routes.assert_called_once_with([{'foo': 'bar'}])
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.delete_static_routes',
+            return_value=[])
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_delete_static_routes(*_, **__):
+def test_delete_static_routes(_, delete_routes, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -306,15 +323,16 @@ def test_delete_static_routes(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(
         source=source, target=target)
-    # TODO: Need to figure out how to assert this one.
     delete_static_routes(ctx=_ctx)
+    delete_routes.assert_called_once_with([{'foo': 'bar'}])
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
-@mock.patch('cloudify_vcd.constants.VCloudGateway.get_dhcp_pool_from_ip_range')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.add_dhcp_pools',
+            return_value=[{'ID': 'foo'}])
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_create_dhcp_pools(*_, **__):
+def test_create_dhcp_pools(_, add_pools, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -356,13 +374,15 @@ def test_create_dhcp_pools(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(source=source, target=target)
     create_dhcp_pools(ctx=_ctx)
-    # TODO: Figure out what we can assert here.
+    add_pools.assert_called_once_with([{'foo': 'bar'}])
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.delete_dhcp_pools',
+            return_value=[])
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_delete_dhcp_pools(*_, **__):
+def test_delete_dhcp_pools(_, delete_pools, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -404,17 +424,17 @@ def test_delete_dhcp_pools(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(
         source=source, target=target)
-    # TODO: Need to figure out how to assert this one.
     delete_dhcp_pools(ctx=_ctx)
+    delete_pools.assert_called_once_with([{'foo': 'bar'}])
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_dhcp_pool_from_ip_range')
-@mock.patch('cloudify_vcd.constants.VCloudGateway.create_nat_rule',
-            return_value={'ID': 'foo'})
+@mock.patch('cloudify_vcd.constants.VCloudGateway.create_nat_rules',
+            return_value=[{'ID': 'foo'}, {'ID': 'bar'}])
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_create_nat_rules(*_, **__):
+def test_create_nat_rules(_, create_rules, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -456,13 +476,20 @@ def test_create_nat_rules(*_, **__):
     target = mock.Mock(node=target_node, instance=target_instance)
     _ctx = get_mock_relationship_context(source=source, target=target)
     create_nat_rules(ctx=_ctx)
+    create_rules.assert_called_once_with([{'foo': 'bar'}], [])
+    assert set(_ctx.target.instance.runtime_properties['rules']) == \
+        {'foo', 'bar'}
+    # A retry reuses the rules that this node recorded.
+    create_nat_rules(ctx=_ctx)
+    assert set(create_rules.call_args[0][1]) == {'foo', 'bar'}
 
 
 @mock.patch('cloudify_vcd.constants.VCloudGateway.exposed_data')
 @mock.patch('cloudify_vcd.constants.VCloudGateway.get_gateway')
-@mock.patch('vcd_plugin_sdk.resources.network.NatRule')
+@mock.patch('cloudify_vcd.constants.VCloudGateway.delete_nat_rules',
+            return_value=[])
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
-def test_delete_nat_rules(*_, **__):
+def test_delete_nat_rules(_, delete_rules, *__, **___):
     source_node = mock.Mock(
         id='foo',
         type_hierarchy=[
@@ -505,8 +532,8 @@ def test_delete_nat_rules(*_, **__):
     _ctx = get_mock_relationship_context(
         source=source, target=target)
     _ctx.target.instance.runtime_properties['rules'] = {'foo': 'bar'}
-    # TODO: Need to figure out how to assert this one.
     delete_nat_rules(ctx=_ctx)
+    delete_rules.assert_called_once_with(['foo'])
 
 
 @mock.patch('cloudify_vcd.decorators.get_last_task')
@@ -524,7 +551,7 @@ def test_create_disk(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.Disk']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         create_disk(ctx=_ctx)
     assert _ctx.instance.runtime_properties['resource_id'] == 'foo'
@@ -710,6 +737,7 @@ def test_delete_media(*_, **__):
 @mock.patch('cloudify_vcd.decorators.get_last_task')
 @mock.patch('pyvcloud.vcd.vm.VM.insert_cd_from_catalog')
 @mock.patch('cloudify_vcd.constants.VCloudVM.get_vapp')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('pyvcloud.vcd.vapp.VApp.get_vm')
 @mock.patch('cloudify_vcd.constants.VCloudMedia.exposed_data')
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
@@ -848,6 +876,7 @@ def test_create_network(*_, **__):
     assert '__created' in _ctx.instance.runtime_properties
 
 
+@mock.patch('cloudify_vcd.decorators.get_last_task')
 @mock.patch('cloudify_vcd.constants.VCloudNetwork.exposed_data')
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
 @mock.patch('cloudify_vcd.decorators.check_if_task_successful',
@@ -948,7 +977,7 @@ def test_create_vm(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         create_vm(ctx=_ctx)
     assert _ctx.instance.runtime_properties['resource_id'] == 'foo'
@@ -974,7 +1003,7 @@ def test_create_vm_external(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         create_vm(ctx=_ctx)
     assert _ctx.instance.runtime_properties['resource_id'] == 'foo'
@@ -1073,6 +1102,58 @@ def test_create_vm_raises_retry(*_, **__):
             create_vm(ctx=_ctx)
 
 
+@mock.patch('cloudify_vcd.decorators.get_last_task')
+@mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
+@mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
+@mock.patch('cloudify_vcd.decorators.check_if_task_successful',
+            return_value=True)
+@mock.patch('cloudify_vcd.vapp_tasks.find_resource_id_from_relationship_'
+            'by_type', return_value='foo')
+def test_create_vm_bulk_created(*_, **__):
+    operation = {'name': 'create', 'retry_number': 0}
+    _ctx = get_mock_node_instance_context(properties={
+            'use_external_resource': False,
+            'resource_id': 'foo',
+            'resource_config': {'catalog': 'bar',
+                                'template': 'baz',
+                                'fence_mode': 'isolated'},
+            'client_config': {'foo': 'bar', 'vdc': 'vdc'}},
+            operation=operation)
+    _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
+                                'cloudify.nodes.vcloud.VM']
+    _ctx.instance.runtime_properties['__VM_BULK_CREATED'] = True
+    with mock.patch('cloudify_vcd.constants.VCloudVM.instantiate_vapp') \
+            as instantiate_vapp:
+        create_vm(ctx=_ctx)
+    assert not instantiate_vapp.called
+    assert '__created' in _ctx.instance.runtime_properties
+
+
+def test_add_vms():
+    vm_class = mock.Mock()
+    vm_class.return_value.vapp_object.kwargs = {'power_on': False}
+    task = add_vms(vm_class, 'client', 'vdc', 'foo', {'bar': {}, 'baz': {}})
+    vapp = vm_class.return_value.vapp_object
+    assert task is vapp.add_vms.return_value
+    vapp.add_vms.assert_called_once_with(
+        [vm_class.return_value, vm_class.return_value],
+        deploy=True,
+        power_on=False,
+        accept_all_eulas=None)
+    assert add_vms(vm_class, 'client', 'vdc', 'foo', {}) is None
+
+    runtime_properties = {}
+    task = mock.Mock()
+    task.get.return_value = 'task'
+    set_bulk_created(runtime_properties, 'bar', task)
+    assert runtime_properties == {
+        'resource_id': 'bar',
+        '__VM_BULK_CREATED': True,
+        '__pending_tasks': {'operation': 'create', 'tasks': ['task']},
+        '__RETRY_BAD_REQUEST': True,
+    }
+
+
 @mock.patch('cloudify_vcd.decorators.get_last_task')
 @mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
 @mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
@@ -1090,12 +1171,13 @@ def test_configure_vm(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         configure_vm(ctx=_ctx)
     assert _ctx.instance.runtime_properties['resource_id'] == 'foo'
 
 
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('pyvcloud.vcd.vapp.VApp.get_vm')
 @mock.patch('cloudify_vcd.decorators.get_last_task')
 @mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
@@ -1114,7 +1196,7 @@ def test_start_vm(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         start_vm(ctx=_ctx)
     assert _ctx.instance.runtime_properties['resource_id'] == 'foo'
@@ -1138,7 +1220,7 @@ def test_stop_vm(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         stop_vm(ctx=_ctx)
     # TODO: Figure out what to assert here. :(
@@ -1162,12 +1244,53 @@ def test_delete_vm(*_, **__):
             operation=operation)
     _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
                                 'cloudify.nodes.vcloud.VM']
-    with mock.patch('vcd_plugin_sdk.resources.base.VDC') as vdc:
+    with mock.patch('vcd_plugin_sdk.connection.VDC') as vdc:
         vdc.client.get_api_version = (lambda: '33')
         delete_vm(ctx=_ctx)
     assert '__deleted' in _ctx.instance.runtime_properties
 
 
+@mock.patch('cloudify_vcd.decorators.get_last_task')
+@mock.patch('cloudify_vcd.constants.VCloudVM.exposed_data')
+@mock.patch('cloudify_vcd.utils.VCloudConnect', logger='foo')
+@mock.patch('cloudify_vcd.decorators.check_if_task_successful',
+            return_value=True)
+@mock.patch('cloudify_vcd.vapp_tasks.find_resource_id_from_relationship_'
+            'by_type', return_value='foo')
+def test_delete_vm_bulk_deleted(*_, **__):
+    operation = {'name': 'delete', 'retry_number': 0}
+    _ctx = get_mock_node_instance_context(properties={
+            'use_external_resource': False,
+            'resource_id': 'foo',
+            'resource_config': {'catalog': 'bar', 'template': 'baz'},
+            'client_config': {'foo': 'bar', 'vdc': 'vdc'}},
+            operation=operation)
+    _ctx.node.type_hierarchy = ['cloudify.nodes.Root',
+                                'cloudify.nodes.vcloud.VM']
+    set_bulk_deleted(_ctx.instance.runtime_properties)
+    with mock.patch('cloudify_vcd.constants.VCloudVM.undeploy') as undeploy:
+        delete_vm(ctx=_ctx)
+    assert not undeploy.called
+    assert '__deleted' in _ctx.instance.runtime_properties
+
+
+def test_delete_vms():
+    vapp_class = mock.Mock()
+    vapp = vapp_class.return_value
+    vapp.undeploy_vms.return_value = ['undeploy']
+    task = delete_vms(vapp_class, 'client', 'vdc', 'foo', ['bar', 'baz'])
+    assert task is vapp.delete_vms.return_value
+    vapp.undeploy_vms.assert_called_once_with(['bar', 'baz'])
+    vapp.tasks_successful.assert_called_once_with(['undeploy'])
+    vapp.delete_vms.assert_called_once_with(['bar', 'baz'])
+    assert delete_vms(vapp_class, 'client', 'vdc', 'foo', []) is None
+    assert group_vms_by_vapp(
+        [('foo', 'bar'), ('qux', 'quux'), ('foo', 'baz')]) == {
+        'foo': ['bar', 'baz'],
+        'qux': ['quux'],
+    }
+
+
 def test_configure_nic(*_, **__):
     operation = {'name': 'configure', 'retry_number': 0}
     relationships = [mock.Mock(
@@ -1199,6 +1322,7 @@ def test_configure_nic(*_, **__):
 
 
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('pyvcloud.vcd.vapp.VApp.get_vm')
 @mock.patch('cloudify_vcd.decorators.get_last_task')
 @mock.patch('cloudify_vcd.constants.VCloudVM.get_vapp')
@@ -1350,3 +1474,21 @@ def test_delete_nic(*_, **__):
         source=source, target=target, operation=operation)
     delete_nic(ctx=_ctx)
     # TODO: Figure what we can assert here.
+
+    # The NIC delete task is polled on retry, instead of deleting again.
+    delete_nic_task = E.Task(href='delete_nic')
+    with mock.patch('vcd_plugin_sdk.resources.vapp.VCloudVM.'
+                    'get_nic_from_config', return_value={'index': 1}), \
+            mock.patch('vcd_plugin_sdk.resources.vapp.VCloudVM.'
+                       'delete_nic', return_value=delete_nic_task) as delete, \
+            mock.patch('vcd_plugin_sdk.resources.vapp.VCloudVM.'
+                       'tasks_successful') as tasks_successful:
+        tasks_successful.side_effect = VCloudSDKRetryException('running')
+        with pytest.raises(OperationRetry):
+            delete_nic(ctx=_ctx)
+        assert target_instance.runtime_properties['__nic_delete_tasks'] == \
+            {'operation': 'unlink', 'tasks': ['delete_nic']}
+        tasks_successful.side_effect = VcdTaskException('error', E.Error())
+        with pytest.raises(NonRecoverableError):
+            delete_nic(ctx=_ctx)
+        assert delete.call_count == 1
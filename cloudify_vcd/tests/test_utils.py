@@ -1,11 +1,13 @@
 import mock
 import pytest
+from threading import Thread
 
 from lxml import objectify
 from pyvcloud.vcd.client import E
 from cloudify.state import current_ctx
 from cloudify.manager import DirtyTrackingDict
 from vcd_plugin_sdk.connection import VCloudConnect
+from vcd_plugin_sdk.exceptions import VCloudSDKRetryException
 from cloudify.mocks import MockCloudifyContext
 from vcd_plugin_sdk.resources.vapp import VCloudVM, VCloudvApp
 from cloudify.exceptions import (OperationRetry, NonRecoverableError)
@@ -16,16 +18,20 @@ from pyvcloud.vcd.exceptions import (
 
 from ..utils import (
     get_ctxs,
+    RUNTIME_PROPERTIES,
     ResourceData,
     expose_props,
     get_last_task,
     retry_or_raise,
+    get_exposed_data,
     is_relationship,
     get_resource_id,
     is_node_instance,
     find_rel_by_type,
     get_client_config,
     get_resource_data,
+    load_session_token,
+    store_session_token,
     cleanup_objectify,
     find_rels_by_type,
     get_resource_class,
@@ -225,6 +231,43 @@ def test_get_client_config():
     assert isinstance(client, VCloudConnect)
 
 
+def test_store_and_load_session_token():
+    ctx = get_mock_node_instance_context(properties={
+        'client_config': {
+            'user': 'foo',
+            'password': 'bar',
+            'org': 'baz',
+            'vdc': 'vdc',
+            'store_session_token': True}})
+    connection = mock.Mock()
+    connection.credentials.asdict.return_value = {
+        'user': 'foo', 'password': 'bar', 'org': 'baz'}
+    connection.get_session_token.return_value = {
+        'token': 'taco', 'is_jwt_token': True}
+    store_session_token(ctx, connection)
+    stored = ctx.instance.runtime_properties['__vcd_session']
+    assert 'taco' not in stored['token']
+
+    client, _ = get_client_config(
+        ctx.node.properties, ctx.instance.runtime_properties)
+    assert client.session_token == {'token': 'taco', 'is_jwt_token': True}
+
+    # Other credentials cannot decrypt the token.
+    assert load_session_token(
+        ctx.instance.runtime_properties,
+        {'user': 'foo', 'password': 'qux', 'org': 'baz'}) is None
+
+    # The same token is not stored again.
+    ctx.instance.runtime_properties.dirty = False
+    store_session_token(ctx, connection)
+    assert ctx.instance.runtime_properties['__vcd_session'] == stored
+    assert not ctx.instance.runtime_properties.dirty
+    connection.get_session_token.return_value = {
+        'token': 'bell', 'is_jwt_token': True}
+    store_session_token(ctx, connection)
+    assert ctx.instance.runtime_properties['__vcd_session'] != stored
+
+
 def test_get_ctxs():
     ni_ctx = get_mock_node_instance_context()
     a, b = get_ctxs(ni_ctx)
@@ -282,12 +325,63 @@ def test_update_runtime_properties():
     assert ctx.instance.runtime_properties['taco'] == 'bell'
 
 
+def test_update_runtime_properties_unchanged():
+    ctx = get_mock_node_instance_context(
+        runtime_properties={'taco': 'bell', 'data': {'foo': [1, 2]}})
+    with mock.patch.object(ctx.instance, 'update') as update:
+        update_runtime_properties(ctx, {'data': {'foo': [1, 2]}})
+        update.assert_not_called()
+        assert not ctx.instance.runtime_properties.dirty
+        update_runtime_properties(ctx, {'data': {'foo': [1, 2, 3]},
+                                        'taco': 'bell'})
+        update.assert_called_once()
+    assert ctx.instance.runtime_properties['data'] == {'foo': [1, 2, 3]}
+
+
 def test_update_runtime_properties_relationship():
     ctx = get_mock_relationship_context()
     update_runtime_properties(ctx.target, {'taco': 'bell'})
     assert ctx.target.instance.runtime_properties['taco'] == 'bell'
 
 
+def test_runtime_properties_buffer():
+    ctx = get_mock_node_instance_context()
+    with mock.patch.object(ctx.instance, 'update') as update:
+        update_runtime_properties(ctx, {'taco': 'bell'})
+        assert update.call_count == 1
+        RUNTIME_PROPERTIES.start()
+        update_runtime_properties(ctx, {'taco': 'bell'})
+        cleanup_runtime_properties(ctx)
+        assert update.call_count == 1
+        RUNTIME_PROPERTIES.flush(ctx)
+        assert update.call_count == 2
+        assert not RUNTIME_PROPERTIES.active
+
+
+def test_runtime_properties_buffer_per_thread():
+    ctx = get_mock_node_instance_context()
+    other_ctx = get_mock_node_instance_context()
+    RUNTIME_PROPERTIES.start()
+    try:
+        with mock.patch.object(other_ctx.instance, 'update') as update:
+            thread = Thread(target=RUNTIME_PROPERTIES.save,
+                            args=(other_ctx.instance,))
+            thread.start()
+            thread.join()
+            assert update.call_count == 1
+        with mock.patch.object(ctx.instance, 'update') as update:
+            RUNTIME_PROPERTIES.save(ctx.instance)
+            assert update.call_count == 0
+            thread = Thread(target=RUNTIME_PROPERTIES.flush, args=(other_ctx,))
+            thread.start()
+            thread.join()
+            assert RUNTIME_PROPERTIES.active
+            RUNTIME_PROPERTIES.flush(ctx)
+            assert update.call_count == 1
+    finally:
+        RUNTIME_PROPERTIES.active = False
+
+
 def test_cleanup_runtime_properties():
     ctx = get_mock_node_instance_context()
     ctx.instance.runtime_properties['taco'] = 'bell'
@@ -329,6 +423,16 @@ def test_cleanup_objectify():
     }
     assert cleanup_objectify(data) == expected
 
+    tree = objectify.fromstring(
+        '<root><Link href="foo"/><Vm><Name>bar</Name></Vm></root>')
+    data = {'tree': tree, 'items': [('href', 'foo'), ('a', 'b', 'c')]}
+    assert cleanup_objectify(data) == {
+        'tree': {'Link': '', 'Vm': {'Name': 'bar'}},
+        'items': [{'href': 'foo'}, ['a', 'b', 'c']],
+    }
+    # The data is not modified.
+    assert data['items'] == [('href', 'foo'), ('a', 'b', 'c')]
+
 
 def test_find_rels_by_type():
     relationships = [
@@ -418,6 +522,35 @@ def test_expose_runtime_properties():
     assert ctx.instance.runtime_properties['__deleted']
 
 
+def test_get_exposed_data():
+    _ctx = get_mock_node_instance_context()
+    resource = mock.Mock(
+        EXPOSED_FIELDS=VCloudvApp.EXPOSED_FIELDS,
+        EXPENSIVE_FIELDS=['catalog_items', 'resources'])
+    resource.get_exposed_data.side_effect = \
+        lambda fields: {field: 'new' for field in fields}
+
+    # Without exposed_fields, the resource decides.
+    assert get_exposed_data('create', resource, _ctx) == \
+        resource.exposed_data
+
+    _ctx.node.properties['exposed_fields'] = ['lease', 'catalog_items']
+    assert get_exposed_data('create', resource, _ctx) == \
+        {'lease': 'new', 'catalog_items': 'new'}
+    _ctx.instance.runtime_properties['data'] = \
+        {'lease': 'old', 'catalog_items': 'old'}
+    assert get_exposed_data('start', resource, _ctx) == \
+        {'lease': 'new', 'catalog_items': 'old'}
+    resource.get_exposed_data.assert_called_with(['lease'])
+    assert get_exposed_data('configure', resource, _ctx) == \
+        {'lease': 'new', 'catalog_items': 'new'}
+
+    _ctx.node.properties['exposed_fields'] = ['lease', 'foo']
+    with pytest.raises(NonRecoverableError) as e:
+        get_exposed_data('create', resource, _ctx)
+    assert 'catalog_items' in str(e.value)
+
+
 def test_get_last_task():
 
     task = E.Task(
@@ -473,6 +606,10 @@ def test_retry_or_raise():
             '__RETRY_BAD_REQUEST']
         assert 'is busy, cannot proceed with the operation' in e_info
     del resource.primary_ctx.instance.runtime_properties['__RETRY_BAD_REQUEST']
+    with pytest.raises(OperationRetry) as e_info:
+        retry_or_raise(
+            VCloudSDKRetryException('foo', retry_after=7), resource, 'create')
+    assert e_info.value.retry_after == 7
 
 
 def test_check_if_task_successful():
@@ -504,3 +641,11 @@ def test_check_if_task_successful():
     with pytest.raises(OperationRetry) as e_info:
         check_if_task_successful(resource, task)
         assert 'is busy, cannot proceed with the operation' in e_info
+
+    resource = mock.Mock()
+    resource.task_successful.side_effect = VCloudSDKRetryException(
+        'Task bell is still running.', retry_after=10)
+    with pytest.raises(OperationRetry) as e_info:
+        check_if_task_successful(resource, task)
+    assert e_info.value.retry_after == 10
+    resource.task_successful.assert_called_once_with(task, wait=False)
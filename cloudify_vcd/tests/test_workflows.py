@@ -0,0 +1,208 @@
+import mock
+import pytest
+
+from cloudify.exceptions import NonRecoverableError
+from vcd_plugin_sdk.exceptions import VCloudSDKRetryException
+
+from ..vapp_tasks import REL_VM_VAPP, REL_VM_NETWORK
+from ..workflows import (
+    get_vm,
+    get_waves,
+    group_vms,
+    scale_in,
+    scale_out,
+    get_lanes,
+    run_groups,
+    add_vm_group,
+    delete_vm_group,
+    find_target_instance)
+
+
+def get_mock_vm(vm_id, vdc='vdc', vapp='vapp', external=False):
+    instance = mock.Mock(id=vm_id, runtime_properties={})
+    instance.get_contained_subgraph.return_value = {instance}
+    return {
+        'id': vm_id,
+        'instance': instance,
+        'client': mock.Mock(),
+        'vdc': vdc,
+        'vapp': vapp,
+        'vapp_external': False,
+        'config': {'catalog': 'catalog', 'template': 'template'},
+        'external': external,
+    }
+
+
+def get_mock_relationship(rel_type, runtime_properties):
+    rel = mock.Mock()
+    rel.relationship.type_hierarchy = [
+        'cloudify.relationships.depends_on', rel_type]
+    rel.target_node_instance.runtime_properties = runtime_properties
+    rel.target_node_instance.node.properties = {}
+    return rel
+
+
+def test_find_target_instance():
+    vapp = get_mock_relationship(REL_VM_VAPP, {'resource_id': 'foo'})
+    instance = mock.Mock(relationships=[vapp])
+    assert find_target_instance(instance, REL_VM_VAPP) is \
+        vapp.target_node_instance
+    assert find_target_instance(instance, REL_VM_NETWORK) is None
+
+
+@mock.patch('cloudify_vcd.utils.VCloudConnect')
+def test_get_vm(*_):
+    instance = mock.Mock(id='vm_1', runtime_properties={})
+    instance.node.properties = {
+        'use_external_resource': False,
+        'client_config': {'vdc': 'vdc'},
+        'resource_config': {'catalog': 'catalog', 'template': 'template'},
+    }
+    instance.relationships = [
+        get_mock_relationship(REL_VM_VAPP, {'resource_id': 'foo'}),
+        get_mock_relationship(REL_VM_NETWORK, {'resource_id': 'bar'}),
+    ]
+    vm = get_vm(instance)
+    assert vm['id'] == 'vm_1'
+    assert vm['vdc'] == 'vdc'
+    assert vm['vapp'] == 'foo'
+    assert not vm['vapp_external']
+    assert vm['config'] == {
+        'catalog': 'catalog',
+        'template': 'template',
+        'vm_name': 'vm_1',
+        'network': 'bar',
+    }
+    # The node properties are not modified.
+    assert 'vm_name' not in instance.node.properties['resource_config']
+
+
+def test_get_waves():
+    vms = [get_mock_vm('a{0}'.format(i)) for i in range(5)]
+    vms.extend(get_mock_vm('b{0}'.format(i), vdc='other') for i in range(2))
+    waves = get_waves(vms, 2)
+    assert [len(wave) for wave in waves] == [4, 2, 1]
+    assert {vm['instance'] for vm in vms} == set().union(*waves)
+
+
+def test_group_vms():
+    vms = [get_mock_vm('a'), get_mock_vm('b', vapp='other'), get_mock_vm('c')]
+    assert {k: [vm['id'] for vm in v] for k, v in group_vms(vms).items()} \
+        == {('vdc', 'vapp'): ['a', 'c'], ('vdc', 'other'): ['b']}
+
+
+def test_get_lanes():
+    groups = [[get_mock_vm('a{0}'.format(i))] for i in range(5)]
+    groups.extend([get_mock_vm('b{0}'.format(i), vdc='other')]
+                  for i in range(2))
+    lanes = get_lanes(groups, 2)
+    # At most two groups of each VDC at the same time.
+    assert [[vms[0]['id'] for vms in lane] for lane in lanes] == \
+        [['a0', 'a2', 'a4'], ['a1', 'a3'], ['b0'], ['b1']]
+
+
+def test_run_groups():
+    func = mock.Mock()
+    groups = [[get_mock_vm('a')], [get_mock_vm('b')]]
+    run_groups('ctx', func, groups, 1)
+    func.assert_has_calls([mock.call('ctx', groups[0]),
+                           mock.call('ctx', groups[1])])
+
+
+@mock.patch('cloudify_vcd.workflows.lifecycle')
+@mock.patch('cloudify_vcd.workflows.VCloudvApp')
+@mock.patch('cloudify_vcd.workflows.add_vms')
+@mock.patch('cloudify_vcd.workflows.vapp_exists')
+def test_scale_out(vapp_exists, add_vms, _, lifecycle):
+    vapp_exists.side_effect = lambda vm: vm['vapp'] == 'vapp'
+    add_vms.return_value.get.return_value = 'task'
+    ctx = mock.Mock()
+    graph = mock.Mock(tasks=[])
+    vms = [get_mock_vm('a'),
+           get_mock_vm('b'),
+           get_mock_vm('c', vapp='new'),
+           get_mock_vm('d', vapp='new'),
+           get_mock_vm('e')]
+    # A recompose cannot set the memory of a VM.
+    vms[4]['config']['memory'] = 4096
+    scale_out(ctx, graph, vms, set(), True, 10, 'vm_')
+
+    # The first VM of the new vApp is installed before the others.
+    first_wave = lifecycle.install_node_instances.call_args_list[0][1]
+    assert first_wave['node_instances'] == {
+        vms[2]['instance'], vms[4]['instance']}
+    # There is one recompose for every vApp.
+    assert add_vms.call_count == 2
+    assert set(add_vms.call_args_list[0][0][4]) == {'a', 'b'}
+    assert set(add_vms.call_args_list[1][0][4]) == {'d'}
+    assert vms[0]['instance'].runtime_properties['__VM_BULK_CREATED']
+    assert vms[0]['instance'].runtime_properties['__pending_tasks'] == \
+        {'operation': 'create', 'tasks': ['task']}
+    assert '__VM_BULK_CREATED' not in vms[2]['instance'].runtime_properties
+    assert ctx.update_node_instance.call_count == 3
+    second_wave = lifecycle.install_node_instances.call_args_list[1][1]
+    assert second_wave['node_instances'] == {
+        vms[0]['instance'], vms[1]['instance'], vms[3]['instance']}
+
+
+@mock.patch('cloudify_vcd.workflows.lifecycle')
+@mock.patch('cloudify_vcd.workflows.VCloudvApp')
+@mock.patch('cloudify_vcd.workflows.delete_vms')
+@mock.patch('cloudify_vcd.workflows.undeploy_vms')
+def test_scale_in(undeploy_vms, delete_vms, _, lifecycle):
+    ctx = mock.Mock()
+    graph = mock.Mock(tasks=[])
+    vms = [get_mock_vm('a'),
+           get_mock_vm('b'),
+           get_mock_vm('c', external=True)]
+    scale_in(ctx, graph, vms, set(), True, 1, False, 'vm_')
+    undeploy_vms.assert_called_once()
+    assert undeploy_vms.call_args[0][4] == ['a', 'b']
+    assert vms[0]['instance'].runtime_properties['__VM_BULK_DELETED']
+    assert '__VM_BULK_DELETED' not in vms[2]['instance'].runtime_properties
+    # At most one VM of the VDC at the same time.
+    assert lifecycle.uninstall_node_instances.call_count == 3
+    delete_vms.assert_called_once()
+    assert delete_vms.call_args[0][4] == ['a', 'b']
+
+
+@mock.patch('cloudify_vcd.workflows.VCloudvApp')
+@mock.patch('cloudify_vcd.workflows.delete_vms')
+def test_delete_vm_group(delete_vms, vapp_class):
+    vapp = vapp_class.return_value
+    vapp.get_vm_resources.return_value = ['c']
+    vms = [get_mock_vm('a'), get_mock_vm('b')]
+    delete_vm_group(mock.Mock(), vms)
+    assert delete_vms.call_args[0][4] == ['a', 'b']
+    # The recompose is waited for, and the vApp is left to its other VMs.
+    vapp.tasks_successful.assert_called_once()
+    vapp.delete.assert_not_called()
+
+    # The vApp is deleted with the VM that created it.
+    vms[1]['instance'].runtime_properties['__VM_CREATE_VAPP'] = True
+    delete_vm_group(mock.Mock(), vms)
+    vapp.delete.assert_called_once()
+
+    # And when no VMs are left in it, unless it is external.
+    vms = [get_mock_vm('a'), get_mock_vm('b')]
+    vapp.get_vm_resources.return_value = []
+    delete_vm_group(mock.Mock(), vms)
+    assert vapp.delete.call_count == 2
+    for vm in vms:
+        vm['vapp_external'] = True
+    delete_vm_group(mock.Mock(), vms)
+    assert vapp.delete.call_count == 2
+
+
+@mock.patch('cloudify_vcd.workflows.VCloudvApp')
+@mock.patch('cloudify_vcd.workflows.add_vms')
+def test_add_vm_group_timeout(add_vms, vapp_class):
+    add_vms.return_value.get.return_value = 'task'
+    vapp_class.return_value.tasks_successful.side_effect = \
+        VCloudSDKRetryException('1 of 1 tasks are still running.')
+    vms = [get_mock_vm('a'), get_mock_vm('b')]
+    ctx = mock.Mock()
+    with pytest.raises(NonRecoverableError) as e:
+        add_vm_group(ctx, vms)
+    assert 'a, b' in str(e.value)
+    ctx.update_node_instance.assert_not_called()
@@ -1,11 +1,19 @@
-from copy import deepcopy
+import os
+import logging
+import base64
+from threading import local
+from hashlib import pbkdf2_hmac
 
+from cryptography.fernet import Fernet, InvalidToken
+
+from pyvcloud.vcd.client import TaskStatus
 from pyvcloud.vcd.utils import task_to_dict
 from lxml.objectify import (
     IntElement,
     BoolElement,
     StringElement,
-    ObjectifiedElement)
+    ObjectifiedElement,
+    ObjectifiedDataElement)
 from pyvcloud.vcd.exceptions import (
     VcdTaskException,
     NotFoundException,
@@ -24,12 +32,17 @@ from cloudify.exceptions import (
 
 from cloudify_common_sdk.utils import get_client_config as _get_client_config
 
-from vcd_plugin_sdk.connection import VCloudConnect
+from vcd_plugin_sdk.connection import VCloudConnect, SESSION_POOL
+from vcd_plugin_sdk.tasks import TaskSet
+from vcd_plugin_sdk.exceptions import VCloudSDKRetryException
 from .constants import (
     CLIENT_CONFIG_KEYS,
     CLIENT_CREDENTIALS_KEYS,
+    SESSION_TOKEN_KEY,
+    PENDING_TASKS_KEY,
     TYPE_MATRIX,
-    NO_RESOURCE_OK)
+    NO_RESOURCE_OK,
+    REFRESH_EXPOSED_DATA)
 
 
 class ResourceData(object):
@@ -86,6 +99,10 @@ class ResourceData(object):
     def primary_vdc(self):
         return self._resources[0].get('vdc')
 
+    @property
+    def clients(self):
+        return [(r.get('ctx'), r.get('client')) for r in self._resources]
+
     @property
     def primary_resource(self):
         return self.primary_class(self.primary_id,
@@ -118,6 +135,49 @@ class ResourceData(object):
                 self._resources[index].get('ctx')]
 
 
+class RuntimePropertiesBuffer(local):
+    """ While a resource_operation runs, runtime property changes are only
+    written when it exits, once for every instance, and not after every
+    change. Outside of one, they are written right away.
+    The agent runs operations in threads, so every thread has its own state.
+    """
+
+    def __init__(self):
+        self.active = False
+
+    def start(self):
+        self.active = True
+
+    def save(self, instance):
+        """ Write the runtime properties of an instance, or mark them to be
+        written when the operation exits.
+
+        :param instance: ctx.instance, ctx.source.instance or
+            ctx.target.instance.
+        """
+        instance.runtime_properties.dirty = True
+        if not self.active:
+            instance.update()
+
+    def flush(self, _ctx):
+        """ Write the runtime properties of the instances of the operation,
+        those that changed, and stop buffering.
+
+        :param _ctx: the ctx of the operation.
+        """
+        self.active = False
+        if is_relationship(_ctx):
+            instances = [_ctx.source.instance, _ctx.target.instance]
+        else:
+            instances = [_ctx.instance]
+        for instance in instances:
+            # This only writes dirty runtime properties.
+            instance.update()
+
+
+RUNTIME_PROPERTIES = RuntimePropertiesBuffer()
+
+
 def is_relationship(_ctx=None):
     _ctx = _ctx or ctx
     return _ctx.type == RELATIONSHIP_INSTANCE
@@ -147,8 +207,12 @@ def get_resource_id(node, instance, instance_id=None):
     return instance.get('resource_id', node.get('resource_id', instance_id))
 
 
-def get_client_config(node):
-    client_config = _get_client_config()
+def get_client_config(node,
+                      runtime_properties=None,
+                      client_config=None,
+                      logger=None,
+                      blocking_retries=False):
+    client_config = client_config or _get_client_config()
     vdc = client_config.get('vdc')
 
     def _get_config():
@@ -165,7 +229,90 @@ def get_client_config(node):
         d.update(client_config.get('credentials_kwargs', dict()))
         return d
 
-    return VCloudConnect(ctx.logger, _get_config(), _get_creds()), vdc
+    credentials = _get_creds()
+    session_token = None
+    if runtime_properties is not None and \
+            client_config.get('store_session_token'):
+        session_token = load_session_token(runtime_properties, credentials)
+
+    # Operations running in the same agent process share their vCD sessions.
+    # Rather than hold the worker while vCD catches up, we retry the operation.
+    # Workflows have no operation to retry, so they wait instead.
+    return VCloudConnect(logger or ctx.logger,
+                         _get_config(),
+                         credentials,
+                         session_pool=SESSION_POOL,
+                         session_token=session_token,
+                         blocking_retries=blocking_retries), vdc
+
+
+def session_token_enabled():
+    return _get_client_config().get('store_session_token', False)
+
+
+def get_session_token_cipher(credentials, salt):
+    """The stored session token is encrypted with a key derived from the
+    vCD credentials, so it is useless to anyone who does not know them.
+    """
+    secret = '{user}@{org}:{password}'.format(
+        user=credentials.get('user'),
+        org=credentials.get('org'),
+        password=credentials.get('password')).encode('utf-8')
+    key = pbkdf2_hmac('sha256', secret, salt, 10000)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def load_session_token(runtime_properties, credentials):
+    stored_token = runtime_properties.get(SESSION_TOKEN_KEY)
+    if not stored_token:
+        return
+    try:
+        cipher = get_session_token_cipher(
+            credentials, base64.b64decode(stored_token['salt']))
+        token = cipher.decrypt(stored_token['token'].encode('utf-8'))
+    except (InvalidToken, KeyError, TypeError, ValueError):
+        ctx.logger.debug('Ignoring invalid stored vCD session token.')
+        return
+    return {'token': token.decode('utf-8'),
+            'is_jwt_token': stored_token.get('is_jwt_token', False)}
+
+
+def store_session_token(_ctx, connection):
+    """Save the session token of the connection in the runtime properties,
+    so that the next retry of the operation does not have to log in again.
+    """
+    runtime_properties = _ctx.instance.runtime_properties
+    if '__deleted' in runtime_properties:
+        return
+    session_token = connection.get_session_token()
+    credentials = connection.credentials.asdict()
+    if not session_token or session_token == load_session_token(
+            runtime_properties, credentials):
+        # A new salt would change the runtime properties for nothing.
+        return
+    salt = os.urandom(16)
+    cipher = get_session_token_cipher(credentials, salt)
+    runtime_properties[SESSION_TOKEN_KEY] = {
+        'salt': base64.b64encode(salt).decode('utf-8'),
+        'token': cipher.encrypt(
+            session_token['token'].encode('utf-8')).decode('utf-8'),
+        'is_jwt_token': session_token['is_jwt_token'],
+    }
+
+
+def store_session_tokens(resource_data):
+    if not session_token_enabled():
+        return
+    for _ctx, connection in resource_data.clients:
+        if connection:
+            store_session_token(_ctx, connection)
+
+
+def release_clients(resource_data):
+    """Give the pooled vCD sessions of the operation back to the pool."""
+    for _, connection in resource_data.clients:
+        if connection:
+            connection.logout()
 
 
 def get_ctxs(_ctx):
@@ -223,7 +370,8 @@ def get_resource_data(__ctx):
         primary.node.properties,
         primary.instance.runtime_properties)
     primary_client_config, primary_vdc = get_client_config(
-        primary.node.properties)
+        primary.node.properties,
+        runtime_properties=primary.instance.runtime_properties)
     primary_resource_config = get_resource_config(
         primary.node.properties, primary.instance.runtime_properties)
     classes = get_resource_class(primary.node.type_hierarchy)
@@ -245,7 +393,8 @@ def get_resource_data(__ctx):
             secondary.node.properties,
             secondary.instance.runtime_properties)
         secondary_client_config, secondary_vdc = get_client_config(
-            secondary.node.properties)
+            secondary.node.properties,
+            runtime_properties=secondary.instance.runtime_properties)
         secondary_resource_config = get_resource_config(
             secondary.node.properties, secondary.instance.runtime_properties)
         if len(classes) == 1:
@@ -270,21 +419,41 @@ def update_runtime_properties(current_ctx, props):
 
     if is_relationship():
         if current_ctx.instance.id == ctx.source.instance.id:
-            ctx.source.instance.runtime_properties.update(props)
-            ctx.source.instance.runtime_properties.dirty = True
-            ctx.source.instance.update()
+            update_changed_properties(ctx.source.instance, props)
         elif current_ctx.instance.id == ctx.target.instance.id:
-            ctx.target.instance.runtime_properties.update(props)
-            ctx.target.instance.runtime_properties.dirty = True
-            ctx.target.instance.update()
+            update_changed_properties(ctx.target.instance, props)
         else:
             ctx.logger.error(
                 'Error updating instance {_id} props {props}.'.format(
                     _id=current_ctx.instance.id, props=props))
     elif is_node_instance():
-        ctx.instance.runtime_properties.update(props)
-        ctx.instance.runtime_properties.dirty = True
-        ctx.instance.update()
+        update_changed_properties(ctx.instance, props)
+
+
+def get_changed_properties(runtime_properties, props):
+    """ Compare props with the runtime properties, which are what the
+    manager has, and the changes of the current operation.
+
+    :param runtime_properties: the runtime properties of an instance.
+    :param props: the new runtime properties, without objectify elements.
+    :return: dict of the props whose values are new or changed.
+    """
+    return {key: value for key, value in props.items()
+            if key not in runtime_properties or
+            runtime_properties[key] != value}
+
+
+def update_changed_properties(instance, props):
+    """ Update the runtime properties of an instance with the props that
+    changed. If none did, the instance is not written at all.
+    """
+    changed = get_changed_properties(instance.runtime_properties, props)
+    if not changed:
+        ctx.logger.debug('Runtime properties of {_id} are unchanged.'.format(
+            _id=instance.id))
+        return
+    instance.runtime_properties.update(changed)
+    RUNTIME_PROPERTIES.save(instance)
 
 
 def cleanup_runtime_properties(current_ctx):
@@ -294,13 +463,11 @@ def cleanup_runtime_properties(current_ctx):
         if current_ctx.instance.id == ctx.source.instance.id:
             for key in list(ctx.source.instance.runtime_properties.keys()):
                 del ctx.source.instance.runtime_properties[key]
-            ctx.source.instance.runtime_properties.dirty = True
-            ctx.source.instance.update()
+            RUNTIME_PROPERTIES.save(ctx.source.instance)
         elif current_ctx.instance.id == ctx.target.instance.id:
             for key in list(ctx.target.instance.runtime_properties.keys()):
                 del ctx.target.instance.runtime_properties[key]
-            ctx.target.instance.runtime_properties.dirty = True
-            ctx.target.instance.update()
+            RUNTIME_PROPERTIES.save(ctx.target.instance)
         else:
             ctx.logger.error(
                 'Error deleting instance {_id} props.'.format(
@@ -308,66 +475,52 @@ def cleanup_runtime_properties(current_ctx):
     elif is_node_instance():
         for key in list(ctx.instance.runtime_properties.keys()):
             del ctx.instance.runtime_properties[key]
-        ctx.instance.runtime_properties.dirty = True
-        ctx.instance.update()
+        RUNTIME_PROPERTIES.save(ctx.instance)
 
 
 def cleanup_objectify(data):
-    # For dev purposes, lets log all this:
-    # TODO: Remove eventually, or find a cleaner way to get as much
-    # info as we can. Because I envision this being a problematic
-    # bit of code.
-    ctx.logger.debug('Logging data {} {}'.format(data, type(data)))
-    ctx.logger.debug('Text: {}'.format(getattr(data, 'text', None)))
-    ctx.logger.debug('Pyval: {}'.format(getattr(data, 'pyval', None)))
-    if hasattr(data, 'items'):
-        ctx.logger.debug('Items: {}'.format(data.items()))
-    try:
-        if hasattr(data, 'child'):
-            ctx.logger.debug('Child: {} {}'.format(
-                data.child, type(data.child)))
-        if hasattr(data, 'iterchildren'):
-            ctx.logger.debug('iterchildren: {} {}'.format(
-                data.iterchildren(),
-                [type(child) for child in data.iterchildren()]
-            ))
-    except (AttributeError, TypeError):
-        pass
-
-    data = deepcopy(data)
+    """Convert vCD objects, such as lxml objectify trees and the items
+    of their attributes, to values that can be stored in runtime
+    properties. The data is not modified.
+    """
+    if ctx.logger.isEnabledFor(logging.DEBUG):
+        ctx.logger.debug('Cleaning up {t}: {d}'.format(t=type(data), d=data))
+    return _cleanup_objectify(data)
+
 
+def _cleanup_objectify(data):
     if isinstance(data, (str, int, bool)):
         return data
     elif isinstance(data, (BoolElement, StringElement, IntElement)):
         return data.text
-    if isinstance(data, tuple):
+    elif isinstance(data, ObjectifiedElement):
+        return _cleanup_objectified_element(data)
+    elif isinstance(data, tuple):
         if len(data) == 2:
             return {str(data[0]): data[1]}
-        else:
-            return list(data)
+        return list(data)
     elif isinstance(data, dict):
-        new_data = {}
-        for k, v in data.items():
-            new_data[str(k)] = cleanup_objectify(v)
-        return new_data
+        return {str(k): _cleanup_objectify(v) for k, v in data.items()}
     elif isinstance(data, list):
-        for n in range(0, len(data)):
-            data[n] = cleanup_objectify(data[n])
-        return data
-    elif isinstance(data, ObjectifiedElement):
-        if hasattr(data, 'iterchildren'):
-            new_data = {}
-            for child in data.iterchildren():
-                if hasattr(child, 'pyval'):
-                    new_data[child.tag] = cleanup_objectify(child.pyval)
-                else:
-                    new_data[child.tag] = cleanup_objectify(child)
-            return new_data
-        elif not hasattr(data, 'child') and data.text:
-            return data.text
+        return [_cleanup_objectify(item) for item in data]
     return data
 
 
+def _cleanup_objectified_element(element):
+    # Elements with values become their python values,
+    # and elements with children become dicts of their children.
+    new_data = {}
+    for child in element.iterchildren():
+        if isinstance(child, ObjectifiedDataElement):
+            # The python value of a data element needs no cleanup.
+            new_data[child.tag] = child.pyval
+        elif hasattr(child, 'pyval'):
+            new_data[child.tag] = _cleanup_objectify(child.pyval)
+        else:
+            new_data[child.tag] = _cleanup_objectify(child)
+    return new_data
+
+
 def find_rels_by_type(node_instance, rel_type):
     '''
         Finds all specified relationships of the Cloudify
@@ -442,7 +595,7 @@ def expose_props(operation_name, resource=None, new_props=None, _ctx=None):
         try:
             new_props.update({
                 'resource_id': resource.name,
-                'data': resource.exposed_data,
+                'data': get_exposed_data(operation_name, resource, _ctx),
                 'tasks': resource.tasks,
             })
         except EntityNotFoundException:
@@ -455,6 +608,51 @@ def expose_props(operation_name, resource=None, new_props=None, _ctx=None):
     update_runtime_properties(_ctx, new_props)
 
 
+def validate_exposed_fields(_ctx, resource_class):
+    """ Check the exposed_fields node property before the operation runs,
+    so that a typo does not fail it after the resource was changed.
+
+    :param _ctx: the current ctx or the primary ctx of a relationship.
+    :param resource_class: the class or object of the resource.
+    :return: the selected fields, or None.
+    """
+    fields = _ctx.node.properties.get('exposed_fields')
+    allowed = getattr(resource_class, 'EXPOSED_FIELDS', None)
+    if fields is None or allowed is None:
+        return fields
+    invalid = [field for field in fields if field not in allowed]
+    if invalid:
+        raise NonRecoverableError(
+            'The exposed_fields {invalid} are not supported. '
+            'Allowed fields are {allowed}.'.format(
+                invalid=invalid, allowed=list(allowed)))
+    return fields
+
+
+def get_exposed_data(operation_name, resource, _ctx):
+    """ Compute the data of the resource that is stored in the runtime
+    properties. If the node selects exposed_fields, we compute only those,
+    and the expensive ones only in REFRESH_EXPOSED_DATA operations.
+
+    :param operation_name: ctx.operation.name.split('.')[-1]
+    :param resource: the resource object
+    :param _ctx: the current ctx or the primary ctx of a relationship.
+    :return: dict
+    """
+    fields = validate_exposed_fields(_ctx, resource)
+    if fields is None or not hasattr(resource, 'get_exposed_data'):
+        return resource.exposed_data
+    previous = _ctx.instance.runtime_properties.get('data') or {}
+    data = {}
+    if operation_name not in REFRESH_EXPOSED_DATA:
+        for field in resource.EXPENSIVE_FIELDS:
+            if field in fields and field in previous:
+                data[field] = previous[field]
+    data.update(resource.get_exposed_data(
+        [field for field in fields if field not in data]))
+    return data
+
+
 def get_last_task(task):
     try:
         return task_to_dict(task.Tasks.Task[0])
@@ -552,12 +750,14 @@ def retry_or_raise(e, r, operation_name):
     :return:
     """
     # TODO: Determine if MissingLinkException is retry or ignore.
-    if isinstance(e, (TypeError,
-                      AttributeError,
-                      NotFoundException,
-                      EntityNotFoundException,
-                      InternalServerException,
-                      AccessForbiddenException)):
+    if isinstance(e, VCloudSDKRetryException):
+        raise OperationRetry(str(e), retry_after=e.retry_after)
+    elif isinstance(e, (TypeError,
+                        AttributeError,
+                        NotFoundException,
+                        EntityNotFoundException,
+                        InternalServerException,
+                        AccessForbiddenException)):
         if operation_name not in NO_RESOURCE_OK:
             raise NonRecoverableError(
                 'The expected resource {r} does not exist. {e}'.format(
@@ -568,15 +768,21 @@ def retry_or_raise(e, r, operation_name):
                 op=operation_name, r=r.primary_id))
     elif vcd_busy_exception(e) or vcd_unclear_exception(e) or uninitialized:
         r.primary_ctx.instance.runtime_properties['__RETRY_BAD_REQUEST'] = True
-        r.primary_ctx.instance.update()
+        RUNTIME_PROPERTIES.save(r.primary_ctx.instance)
         raise OperationRetry(str(e))
 
 
 def check_if_task_successful(_resource, task):
-    if isinstance(task, ObjectifiedElement):
-        ctx.logger.debug('Task: {task}'.format(task=task.items()))
+    if isinstance(task, (ObjectifiedElement, TaskSet)):
         try:
-            return _resource.task_successful(task)
+            # Rather than wait for a running task, we retry the operation.
+            if isinstance(task, TaskSet):
+                ctx.logger.debug('Tasks: {tasks}'.format(tasks=list(task)))
+                return _resource.tasks_successful(task, wait=False)
+            ctx.logger.debug('Task: {task}'.format(task=task.items()))
+            return _resource.task_successful(task, wait=False)
+        except VCloudSDKRetryException as e:
+            raise OperationRetry(str(e), retry_after=e.retry_after)
         except VcdTaskException as e:
             if cannot_deploy(e) or task_on_failure(e):
                 raise NonRecoverableError(str(e))
@@ -585,6 +791,55 @@ def check_if_task_successful(_resource, task):
     return True
 
 
+def get_pending_tasks(runtime_properties,
+                      operation_name,
+                      key=PENDING_TASKS_KEY):
+    """ Get the tasks that a previous attempt of the operation started,
+    and which were still running. Tasks that another operation started
+    are forgotten, because that operation was abandoned or failed.
+
+    :param runtime_properties: ctx.instance.runtime_properties
+    :param operation_name: the name of the current operation.
+    :param key: the runtime property of the tasks.
+    :return: TaskSet or None
+    """
+    pending_tasks = runtime_properties.get(key)
+    if not pending_tasks:
+        return
+    elif isinstance(pending_tasks, dict) and \
+            pending_tasks.get('operation') == operation_name and \
+            pending_tasks.get('tasks'):
+        return TaskSet(pending_tasks['tasks'])
+    del runtime_properties[key]
+
+
+def set_pending_tasks(runtime_properties,
+                      operation_name,
+                      hrefs,
+                      key=PENDING_TASKS_KEY):
+    runtime_properties[key] = {'operation': operation_name, 'tasks': hrefs}
+    runtime_properties['__RETRY_BAD_REQUEST'] = True
+
+
+def store_pending_tasks(_ctx, task_set, operation_name, key=PENDING_TASKS_KEY):
+    """ Remember the tasks that are still running, so that the next attempt
+    of the operation polls them, instead of executing the operation again.
+
+    :param _ctx: the current ctx or the primary ctx of a relationship.
+    :param task_set: TaskSet
+    :param operation_name: the name of the current operation.
+    :param key: the runtime property of the tasks.
+    :return:
+    """
+    runtime_properties = _ctx.instance.runtime_properties
+    if task_set.status == TaskStatus.RUNNING:
+        set_pending_tasks(
+            runtime_properties, operation_name, task_set.pending, key)
+    elif key in runtime_properties:
+        # Even a pop of a missing key makes the runtime properties dirty.
+        del runtime_properties[key]
+
+
 def expose_ip_property(nics):
     ip_addresses = ctx.instance.runtime_properties.get('ip_addresses', [])
     for nic in nics:
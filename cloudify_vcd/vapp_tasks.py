@@ -1,13 +1,16 @@
-from pyvcloud.vcd.client import TaskStatus
 from pyvcloud.vcd.exceptions import (
     BadRequestException,
     MissingLinkException,
+    VcdTaskException,
     InvalidStateException,
     OperationNotSupportedException)
 
 from cloudify import ctx
 from cloudify.exceptions import OperationRetry, NonRecoverableError
 
+from vcd_plugin_sdk.tasks import TaskSet
+from vcd_plugin_sdk.exceptions import VCloudSDKRetryException
+from .constants import NIC_DELETE_TASKS_KEY
 from .decorators import resource_operation
 from .network_tasks import get_network_type
 from .utils import (
@@ -17,7 +20,10 @@ from .utils import (
     no_powered_on_vms,
     vcd_unresolved_vm,
     vcd_already_exists,
+    get_pending_tasks,
+    set_pending_tasks,
     expose_ip_property,
+    store_pending_tasks,
     find_resource_id_from_relationship_by_type)
 
 REL_VAPP_NETWORK = 'cloudify.relationships.vcloud.vapp_connected_to_network'
@@ -242,7 +248,9 @@ def create_vm(vm_external,
         vapp_kwargs=vm_config
     )
 
-    if vm_external:
+    if vm_external or vm_ctx.instance.runtime_properties.get(
+            '__VM_BULK_CREATED'):
+        # Bulk created VMs were already added to the vApp by add_vms.
         return vm, None
 
     # We want to make sure that the network has successfully provisioned.
@@ -376,7 +384,8 @@ def stop_vm(vm_external,
         vapp_kwargs=vm_config
     )
 
-    if vm_external:
+    if vm_external or vm_ctx.instance.runtime_properties.get(
+            '__VM_BULK_DELETED'):
         return vm, None
     try:
         last_task = vm.power_off()
@@ -425,7 +434,9 @@ def delete_vm(vm_external,
         vapp_kwargs=vm_config
     )
 
-    if vm_external:
+    if vm_external or vm_ctx.instance.runtime_properties.get(
+            '__VM_BULK_DELETED'):
+        # Bulk deleted VMs were already deleted by delete_vms.
         return vm, None
     try:
         last_task = vm.undeploy()
@@ -439,10 +450,127 @@ def delete_vm(vm_external,
     if vm_ctx.instance.runtime_properties.get('__VM_CREATE_VAPP'):
         vm.delete()
         last_task = vm.vapp_object.delete()
+    elif vm_ctx.instance.runtime_properties.get('__VM_BULK_CREATED'):
+        # The vApp is shared with the other VMs that were added with it.
+        last_task = vm.delete()
 
     return vm, last_task
 
 
+def add_vms(vm_class, vm_client, vm_vdc, vapp_name, vm_configs):
+    """
+    Add the VMs of several node instances to an existing vApp with a single
+    recompose task, instead of instantiating each of them separately.
+    Every node instance is then mapped to its VM with set_bulk_created,
+    and its create operation only waits for the shared task.
+
+    :param vm_class: the VM class, e.g. VCloudVM.
+    :param vm_client: the VCloudConnect object.
+    :param vm_vdc: the name of the VDC.
+    :param vapp_name: the name of the vApp that contains the VMs.
+    :param vm_configs: dict of VM resource ID to its resource config.
+    :return: the recompose task.
+    """
+
+    vms = [vm_class(vm_id,
+                    vapp_name,
+                    vm_client,
+                    vdc_name=vm_vdc,
+                    kwargs={},
+                    vapp_kwargs=vm_config)
+           for vm_id, vm_config in vm_configs.items()]
+    if not vms:
+        return
+    config = vms[0].vapp_object.kwargs
+    return vms[0].vapp_object.add_vms(
+        vms,
+        deploy=config.get('deploy', True),
+        power_on=config.get('power_on', True),
+        accept_all_eulas=config.get('accept_all_eulas'))
+
+
+def set_bulk_created(runtime_properties, vm_id, task):
+    """
+    Map a node instance to a VM that add_vms created.
+
+    :param runtime_properties: the runtime properties of the VM instance.
+    :param vm_id: the resource ID of the VM.
+    :param task: the recompose task that add_vms returned.
+    :return:
+    """
+
+    runtime_properties['resource_id'] = vm_id
+    runtime_properties['__VM_BULK_CREATED'] = True
+    # The create operation of the VM polls the task.
+    set_pending_tasks(runtime_properties, 'create', [task.get('href')])
+
+
+def delete_vms(vapp_class, vapp_client, vapp_vdc, vapp_name, vm_ids):
+    """
+    Undeploy and delete several VMs of one vApp. The VMs are undeployed at
+    the same time, and then deleted with a single recompose task.
+    Every node instance is then marked with set_bulk_deleted,
+    so that its stop and delete operations do nothing.
+
+    :param vapp_class: the vApp class, e.g. VCloudvApp.
+    :param vapp_client: the VCloudConnect object.
+    :param vapp_vdc: the name of the VDC.
+    :param vapp_name: the name of the vApp that contains the VMs.
+    :param vm_ids: the resource IDs of the VMs.
+    :return: the recompose task.
+    """
+
+    if not vm_ids:
+        return
+    vapp = undeploy_vms(vapp_class, vapp_client, vapp_vdc, vapp_name, vm_ids)
+    return vapp.delete_vms(vm_ids)
+
+
+def undeploy_vms(vapp_class, vapp_client, vapp_vdc, vapp_name, vm_ids):
+    """
+    Undeploy several VMs of one vApp at the same time, and wait for them.
+
+    :param vapp_class: the vApp class, e.g. VCloudvApp.
+    :param vapp_client: the VCloudConnect object.
+    :param vapp_vdc: the name of the VDC.
+    :param vapp_name: the name of the vApp that contains the VMs.
+    :param vm_ids: the resource IDs of the VMs.
+    :return: the vApp object.
+    """
+
+    vapp = vapp_class(vapp_name, vapp_client, vapp_vdc)
+    undeploy_tasks = vapp.undeploy_vms(vm_ids)
+    if len(undeploy_tasks):
+        vapp.tasks_successful(undeploy_tasks)
+    return vapp
+
+
+def group_vms_by_vapp(vms):
+    """
+    Group the VMs of a scale-in by their vApp, so that each vApp gets one
+    call to delete_vms.
+
+    :param vms: iterable of tuples of vApp name and VM resource ID.
+    :return: dict of vApp name to a list of VM resource IDs.
+    """
+
+    groups = {}
+    for vapp_name, vm_id in vms:
+        groups.setdefault(vapp_name, []).append(vm_id)
+    return groups
+
+
+def set_bulk_deleted(runtime_properties):
+    """
+    Mark a node instance whose VM delete_vms deleted.
+
+    :param runtime_properties: the runtime properties of the VM instance.
+    :return:
+    """
+
+    runtime_properties['__VM_BULK_DELETED'] = True
+
+
 @resource_operation
 def configure_nic(_,
                   __,
@@ -665,17 +793,32 @@ def delete_nic(_,
         kwargs={},
         vapp_kwargs=vm_config
     )
-    nic = vm.get_nic_from_config(nic_config)
-
-    if nic:
-        # I wish we had another operation in order to split these. :(
-        delete_nic_task = vm.delete_nic(nic['index'])
-        result = vm.client.get_task_monitor().wait_for_success(
-            delete_nic_task, 10)
-        if result.get('status') != TaskStatus.SUCCESS.value:
+    # I wish we had another operation in order to split these. :(
+    # A previous attempt may have deleted the NIC already.
+    operation_name = ctx.operation.name.split('.')[-1]
+    delete_tasks = get_pending_tasks(nic_ctx.instance.runtime_properties,
+                                     operation_name,
+                                     NIC_DELETE_TASKS_KEY)
+    if not delete_tasks:
+        nic = vm.get_nic_from_config(nic_config)
+        if nic:
+            delete_tasks = TaskSet()
+            delete_tasks.add(vm.delete_nic(nic['index']))
+    if delete_tasks:
+        try:
+            vm.tasks_successful(delete_tasks, wait=False)
+        except VCloudSDKRetryException as e:
             raise OperationRetry(
                 'Waiting for NIC delete to complete '
-                'before removing network from the vApp.')
+                'before removing network from the vApp: {e}'.format(e=e),
+                retry_after=e.retry_after)
+        except VcdTaskException as e:
+            raise NonRecoverableError(
+                'Failed to delete the NIC {config}: {e}'.format(
+                    config=nic_config, e=e))
+        finally:
+            store_pending_tasks(
+                nic_ctx, delete_tasks, operation_name, NIC_DELETE_TASKS_KEY)
 
     if nic_config['network_name'] in vm.vapp_networks:
         last_task = vm.remove_vapp_network(nic_config['network_name'])
@@ -0,0 +1,411 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pyvcloud.vcd.exceptions import EntityNotFoundException
+
+from cloudify.decorators import workflow
+from cloudify.exceptions import NonRecoverableError
+from cloudify.plugins import lifecycle
+
+from cloudify_common_sdk.utils import dict_override
+
+from vcd_plugin_sdk.tasks import TaskSet
+from vcd_plugin_sdk.resources.vapp import (
+    VCloudVM,
+    VCloudvApp,
+    get_recompose_unsupported)
+from .utils import (
+    get_resource_id,
+    get_client_config,
+    get_resource_config)
+from .vapp_tasks import (
+    add_vms,
+    delete_vms,
+    undeploy_vms,
+    set_bulk_created,
+    set_bulk_deleted,
+    REL_VM_VAPP,
+    REL_VM_NETWORK)
+
+VM_TYPE = 'cloudify.nodes.vcloud.VM'
+
+
+def find_target_instance(node_instance, rel_type):
+    """
+    Find the target of a relationship of a workflow node instance.
+    This is find_rel_by_type for workflows, where relationships have no
+    type hierarchy of their own.
+
+    :param node_instance: CloudifyWorkflowNodeInstance
+    :param rel_type: the relationship type.
+    :return: the target CloudifyWorkflowNodeInstance or None.
+    """
+
+    for rel in node_instance.relationships:
+        if rel_type in rel.relationship.type_hierarchy:
+            return rel.target_node_instance
+
+
+def get_vm(node_instance):
+    """
+    Collect what the VM operations of a node instance would use.
+
+    :param node_instance: CloudifyWorkflowNodeInstance of a VM.
+    :return: dict
+    """
+
+    properties = node_instance.node.properties
+    runtime_properties = node_instance.runtime_properties
+    # Like cloudify_common_sdk.utils.get_client_config, without the plugin
+    # properties, which only operations can read.
+    client_config = dict_override(
+        dict(properties.get('client_config') or {}),
+        runtime_properties.get('client_config'))
+    # The workflow has no operation to retry, so it waits for vCD instead.
+    client, vdc = get_client_config(properties,
+                                    runtime_properties=runtime_properties,
+                                    client_config=client_config,
+                                    logger=node_instance.ctx.logger,
+                                    blocking_retries=True)
+    vm_id = get_resource_id(properties, runtime_properties, node_instance.id)
+    vm_config = dict(get_resource_config(properties, runtime_properties))
+    vm_config['vm_name'] = vm_id
+
+    network = find_target_instance(node_instance, REL_VM_NETWORK)
+    if network:
+        vm_config['network'] = vm_config.get(
+            'network', network.runtime_properties.get('resource_id'))
+    vapp = find_target_instance(node_instance, REL_VM_VAPP)
+
+    return {
+        'id': vm_id,
+        'instance': node_instance,
+        'client': client,
+        'vdc': vdc,
+        'vapp': vapp.runtime_properties.get('resource_id') if vapp else None,
+        'vapp_external': vapp.node.properties.get(
+            'use_external_resource', False) if vapp else False,
+        'config': vm_config,
+        'external': properties.get('use_external_resource', False),
+    }
+
+
+def group_vms(vms):
+    """
+    Group VMs by VDC and vApp, because every vApp gets a single recompose.
+
+    :param vms: list of dicts from get_vm.
+    :return: dict of tuple of VDC and vApp name to a list of VMs.
+    """
+
+    groups = {}
+    for vm in vms:
+        groups.setdefault((vm['vdc'], vm['vapp']), []).append(vm)
+    return groups
+
+
+def get_waves(vms, max_concurrent_tasks):
+    """
+    Split VMs into waves with at most max_concurrent_tasks VMs of each VDC.
+    Each wave also has the node instances that are contained in its VMs.
+
+    :param vms: list of dicts from get_vm.
+    :param max_concurrent_tasks: the most VMs of a VDC in one wave.
+    :return: list of sets of CloudifyWorkflowNodeInstance.
+    """
+
+    max_concurrent_tasks = max(1, int(max_concurrent_tasks))
+    by_vdc = {}
+    for vm in vms:
+        by_vdc.setdefault(vm['vdc'], []).append(vm)
+    waves = []
+    for vdc_vms in by_vdc.values():
+        for index, vm in enumerate(vdc_vms):
+            wave = index // max_concurrent_tasks
+            if len(waves) <= wave:
+                waves.append(set())
+            waves[wave].update(vm['instance'].get_contained_subgraph())
+    return waves
+
+
+def run_waves(graph, waves, install, related, ignore_failure, name_prefix):
+    """
+    Run the install or uninstall lifecycle of the waves one after another.
+    Inside a wave, the node instances run at the same time.
+    """
+
+    for index, wave in enumerate(waves):
+        prefix = '{p}{i}_'.format(p=name_prefix, i=index)
+        if install:
+            lifecycle.install_node_instances(graph=graph,
+                                             node_instances=wave,
+                                             related_nodes=related,
+                                             name_prefix=prefix)
+        else:
+            lifecycle.uninstall_node_instances(graph=graph,
+                                               node_instances=wave,
+                                               ignore_failure=ignore_failure,
+                                               related_nodes=related,
+                                               name_prefix=prefix)
+        for task in graph.tasks:
+            graph.remove_task(task)
+
+
+def vapp_exists(vm):
+    vapp = VCloudvApp(vm['vapp'], vm['client'], vm['vdc'])
+    try:
+        vapp.get_vapp_resource(vm['vapp'])
+    except EntityNotFoundException:
+        return False
+    return True
+
+
+def update_runtime_properties(ctx, node_instance, update):
+    runtime_properties = node_instance.runtime_properties
+    update(runtime_properties)
+    ctx.update_node_instance(node_instance.id,
+                             force=True,
+                             runtime_properties=runtime_properties)
+
+
+def add_vm_group(ctx, vms):
+    """
+    Add the VMs of one vApp with a single recompose task, wait for it,
+    and map every node instance to its VM.
+    """
+
+    first = vms[0]
+    task = add_vms(VCloudVM,
+                   first['client'],
+                   first['vdc'],
+                   first['vapp'],
+                   {vm['id']: vm['config'] for vm in vms})
+    vapp = VCloudvApp(first['vapp'], first['client'], first['vdc'])
+    try:
+        vapp.tasks_successful(TaskSet([task.get('href')]))
+    except Exception as e:
+        # The modification is rolled back, but not what vCD did so far.
+        raise NonRecoverableError(
+            'The recompose task {t} of the vApp {a} did not succeed: {e}. '
+            'The VMs {v} may exist in vCD without node instances; delete '
+            'them before scaling out again.'.format(
+                t=task.get('href'),
+                a=first['vapp'],
+                e=str(e),
+                v=', '.join(vm['id'] for vm in vms)))
+    for vm in vms:
+        update_runtime_properties(
+            ctx,
+            vm['instance'],
+            lambda props, vm_id=vm['id']: set_bulk_created(
+                props, vm_id, task))
+
+
+def undeploy_vm_group(ctx, vms):
+    """
+    Undeploy the VMs of one vApp at the same time, and mark their node
+    instances, so that delete_vm leaves them to delete_vm_group.
+    """
+
+    first = vms[0]
+    undeploy_vms(VCloudvApp,
+                 first['client'],
+                 first['vdc'],
+                 first['vapp'],
+                 [vm['id'] for vm in vms])
+    for vm in vms:
+        update_runtime_properties(ctx, vm['instance'], set_bulk_deleted)
+
+
+def delete_vm_group(_, vms):
+    """
+    Delete the VMs of one vApp with a single recompose task, and wait for it.
+    Like delete_vm, which leaves bulk deleted VMs alone, the vApp is deleted
+    if one of the VMs created it, and so is a vApp without VMs left in it,
+    unless it is external.
+    """
+
+    first = vms[0]
+    task = delete_vms(VCloudvApp,
+                      first['client'],
+                      first['vdc'],
+                      first['vapp'],
+                      [vm['id'] for vm in vms])
+    vapp = VCloudvApp(first['vapp'], first['client'], first['vdc'])
+    if task is not None:
+        vapp.tasks_successful(TaskSet([task.get('href')]))
+    created_vapp = any(vm['instance'].runtime_properties.get(
+        '__VM_CREATE_VAPP') for vm in vms)
+    if created_vapp or \
+            (not first['vapp_external'] and not vapp.get_vm_resources()):
+        vapp.tasks_successful(TaskSet([vapp.delete().get('href')]))
+
+
+def get_lanes(groups, max_concurrent_tasks):
+    """
+    Split groups of VMs into lanes, with at most max_concurrent_tasks lanes
+    of each VDC. The groups of a lane run one after another.
+
+    :param groups: list of lists of dicts from get_vm, each of one vApp.
+    :param max_concurrent_tasks: the most groups of a VDC at the same time.
+    :return: list of lists of groups.
+    """
+
+    max_concurrent_tasks = max(1, int(max_concurrent_tasks))
+    by_vdc = {}
+    for vms in groups:
+        by_vdc.setdefault(vms[0]['vdc'], []).append(vms)
+    lanes = []
+    for vdc_groups in by_vdc.values():
+        for index in range(min(max_concurrent_tasks, len(vdc_groups))):
+            lanes.append(vdc_groups[index::max_concurrent_tasks])
+    return lanes
+
+
+def run_groups(ctx, func, groups, max_concurrent_tasks):
+    """
+    Run func for every group of VMs, with at most max_concurrent_tasks
+    groups of each VDC at the same time. Every group is a single vCD task.
+    """
+
+    lanes = get_lanes(groups, max_concurrent_tasks)
+    if not lanes:
+        return
+
+    def run_lane(lane):
+        for vms in lane:
+            func(ctx, vms)
+
+    with ThreadPoolExecutor(max_workers=len(lanes)) as executor:
+        futures = [executor.submit(run_lane, lane) for lane in lanes]
+        # Raise the first error, if any.
+        for future in futures:
+            future.result()
+
+
+def scale_out(ctx, graph, vms, related, bulk, max_concurrent_tasks, prefix):
+    if not bulk:
+        run_waves(graph,
+                  get_waves(vms, max_concurrent_tasks),
+                  True, related, False, prefix)
+        return
+
+    # Only VMs in an existing vApp can be added with a recompose.
+    # The first VM of a new vApp creates it, like in the install workflow,
+    # and so do VMs with config that a recompose does not apply.
+    first_vms = [vm for vm in vms if vm['external'] or not vm['vapp'] or
+                 get_recompose_unsupported(vm['config'])]
+    groups = []
+    for group in group_vms(
+            [vm for vm in vms if vm not in first_vms]).values():
+        if not vapp_exists(group[0]):
+            first_vms.append(group.pop(0))
+        if group:
+            groups.append(group)
+    run_waves(graph,
+              get_waves(first_vms, max_concurrent_tasks),
+              True, related, False, prefix + 'first_')
+
+    run_groups(ctx, add_vm_group, groups, max_concurrent_tasks)
+    run_waves(graph,
+              get_waves([vm for group in groups for vm in group],
+                        max_concurrent_tasks),
+              True, related, False, prefix)
+
+
+def scale_in(ctx,
+             graph,
+             vms,
+             related,
+             bulk,
+             max_concurrent_tasks,
+             ignore_failure,
+             prefix):
+    groups = []
+    if bulk:
+        groups = list(group_vms(
+            [vm for vm in vms if not vm['external'] and vm['vapp']]
+        ).values())
+        # The VMs are undeployed first, so that the relationships
+        # of a VM are unlinked from a VM that is powered off.
+        run_groups(ctx, undeploy_vm_group, groups, max_concurrent_tasks)
+    run_waves(graph,
+              get_waves(vms, max_concurrent_tasks),
+              False, related, ignore_failure, prefix)
+    run_groups(ctx, delete_vm_group, groups, max_concurrent_tasks)
+
+
+@workflow
+def scale_vms(ctx,
+              node_id,
+              delta,
+              max_concurrent_tasks=10,
+              bulk=True,
+              ignore_failure=False,
+              **_):
+    """
+    Scale a VM node out or in. At most max_concurrent_tasks VMs of each VDC
+    are created or deleted at the same time. With bulk, the VMs of a vApp
+    are added and deleted with a single recompose task per vApp.
+
+    :param ctx: the workflow context.
+    :param node_id: the ID of a cloudify.nodes.vcloud.VM node.
+    :param delta: the number of instances to add, or remove if negative.
+    :param max_concurrent_tasks: the most VMs of a VDC at the same time.
+    :param bulk: add and delete the VMs of a vApp together.
+    :param ignore_failure: ignore operation failures when scaling in.
+    :param _: Unused kwargs.
+    :return:
+    """
+
+    delta = int(delta)
+    if delta == 0:
+        ctx.logger.info('delta parameter is 0, so no scaling will take place.')
+        return
+    node = ctx.get_node(node_id)
+    if not node or VM_TYPE not in node.type_hierarchy:
+        raise ValueError(
+            'The node {n} is not a {t} node.'.format(n=node_id, t=VM_TYPE))
+    planned_instances = node.number_of_instances + delta
+    if planned_instances < 0:
+        raise ValueError(
+            'Provided delta: {d} is illegal. The current number of instances '
+            'of node {n} is {i}.'.format(
+                d=delta, n=node_id, i=node.number_of_instances))
+
+    modification = ctx.deployment.start_modification(
+        {node_id: {'instances': planned_instances}})
+    ctx.refresh_node_instances()
+    graph = ctx.graph_mode()
+    prefix = node_id + '_'
+    vms = []
+    try:
+        ctx.logger.info('Deployment modification started. '
+                        '[modification_id={0}]'.format(modification.id))
+        if delta > 0:
+            changed = modification.added.node_instances
+            modification_type = 'added'
+        else:
+            changed = modification.removed.node_instances
+            modification_type = 'removed'
+        instances = [ctx.get_node_instance(i.id) for i in changed
+                     if i.modification == modification_type]
+        related = {ctx.get_node_instance(i.id) for i in changed
+                   if i.modification != modification_type}
+        vms = [get_vm(instance) for instance in instances
+               if instance.node_id == node_id]
+        if delta > 0:
+            scale_out(ctx, graph, vms, related, bulk,
+                      max_concurrent_tasks, prefix)
+        else:
+            scale_in(ctx, graph, vms, related, bulk,
+                     max_concurrent_tasks, ignore_failure, prefix)
+    except Exception:
+        ctx.logger.warn('Rolling back deployment modification. '
+                        '[modification_id={0}]'.format(modification.id))
+        modification.rollback()
+        raise
+    else:
+        modification.finish()
+    finally:
+        for vm in vms:
+            vm['client'].logout()
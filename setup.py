@@ -44,11 +44,13 @@ if sys.version_info.major == 3 and sys.version_info.minor == 6:
     ]
     install_requires += [
         'cloudify-common>=5.1.0,<7.0',
+        'cryptography>=40.0.2,<41.0',
     ]
 else:
     packages = find_packages()
     install_requires += [
         'fusion-common',
+        'cryptography>=41.0.7,<42.0',
     ]
 
 
@@ -16,9 +16,22 @@
 import os
 import sys
 import logging
+from time import time
+from hashlib import sha256
+from threading import RLock
+from collections import OrderedDict
 
 from pyvcloud.vcd.org import Org
-from pyvcloud.vcd.client import Client, BasicLoginCredentials
+from pyvcloud.vcd.vdc import VDC
+from pyvcloud.vcd.client import (
+    Client,
+    EntityType,
+    BasicLoginCredentials,
+    _objectify_response)
+from pyvcloud.vcd.exceptions import (
+    VcdException,
+    UnauthorizedException,
+    EntityNotFoundException)
 
 
 # def default_logger(stream=sys.stdout):
@@ -146,9 +159,316 @@ class VCloudClientConfiguration(object):
         return client_configuration
 
 
+class ReauthenticatingRequest(object):
+
+    def __init__(self, client, request, credentials, logger):
+        """Wrapper for pyvcloud.vcd.client.Client._do_request that logs in
+        again and repeats the request once, if vCD rejected the session.
+
+        :param client: pyvcloud.vcd.client.Client
+        :param request: the original bound Client._do_request method.
+        :param credentials: VCloudCredentials
+        :param logger:
+        """
+        self.client = client
+        self.request = request
+        self.credentials = credentials
+        self.logger = logger
+
+    def __call__(self, *args, **kwargs):
+        return self.call(self.request, *args, **kwargs)
+
+    def call(self, request, *args, **kwargs):
+        """Make any request of the client, and repeat it once after
+        logging in again, if vCD rejected the session.
+        """
+        try:
+            return request(*args, **kwargs)
+        except UnauthorizedException:
+            self.logger.debug(
+                'The vCD session for {user}@{org} has expired, '
+                'logging in again.'.format(user=self.credentials.username,
+                                           org=self.credentials.org))
+            self.client.set_credentials(
+                BasicLoginCredentials(**self.credentials.asdict()))
+            return request(*args, **kwargs)
+
+
+def login(client_config, credentials, logger, session_token=None):
+    """Create a pyvcloud client and open a session with the credentials.
+
+    :param client_config: VCloudClientConfiguration
+    :param credentials: VCloudCredentials
+    :param logger:
+    :param session_token: a dict returned by
+        VCloudConnect.get_session_token. If the session is still valid,
+        it is reused instead of logging in.
+    :return: pyvcloud.vcd.client.Client
+    """
+    client = Client(**client_config.asdict())
+    if not session_token or not rehydrate(client, session_token, logger):
+        client.set_credentials(BasicLoginCredentials(**credentials.asdict()))
+    client._do_request = ReauthenticatingRequest(
+        client, client._do_request, credentials, logger)
+    return client
+
+
+def post_for_location(client,
+                      uri,
+                      contents,
+                      media_type=EntityType.DEFAULT_CONTENT_TYPE.value):
+    """Post a document and return the Location header of the response,
+    which Client._do_request does not return. Like Client._do_request of a
+    client from login, it logs in again if vCD rejected the session.
+
+    :param client: pyvcloud.vcd.client.Client
+    :param uri: the URL to post to.
+    :param contents: lxml element.
+    :param media_type: the content type of the document.
+    :return: str or None
+    """
+    def _post():
+        response = client._do_request_prim(
+            'POST',
+            uri,
+            client._session,
+            contents=contents,
+            media_type=media_type)
+        if response.status_code not in [200, 201, 202, 204]:
+            Client._response_code_to_exception(
+                response.status_code,
+                client._get_response_request_id(response),
+                _objectify_response(response))
+        return response.headers.get('Location')
+
+    if isinstance(client._do_request, ReauthenticatingRequest):
+        return client._do_request.call(_post)
+    return _post()
+
+
+def rehydrate(client, session_token, logger):
+    """Resume an existing session from its token.
+
+    :param client: pyvcloud.vcd.client.Client
+    :param session_token: dict with token and is_jwt_token keys.
+    :param logger:
+    :return: bool, whether the session was resumed.
+    """
+    try:
+        client.rehydrate_from_token(
+            session_token['token'], session_token.get('is_jwt_token', False))
+    except (VcdException, KeyError) as e:
+        logger.debug('Unable to reuse the stored vCD session, '
+                     'logging in again: {e}'.format(e=e))
+        return False
+    return True
+
+
+def logout(client, logger):
+    """Close the client session. Errors are logged, but not raised, because
+    the session may already be gone on the server side.
+
+    :param client: pyvcloud.vcd.client.Client
+    :param logger:
+    """
+    request = client._do_request
+    if isinstance(request, ReauthenticatingRequest):
+        # There is no point in logging in again just to log out.
+        client._do_request = request.request
+    try:
+        client.logout()
+    except VcdException as e:
+        logger.debug('Failed to log out of vCD session: {e}'.format(e=e))
+    finally:
+        # Anyone still holding the client can log in again.
+        client._do_request = request
+
+
+class PooledSession(object):
+
+    def __init__(self, client, secret):
+        self.client = client
+        self.secret = secret
+        self.created = time()
+        self.last_used = self.created
+        # The number of connections that are using the client.
+        self.users = 1
+
+
+class VCloudSessionPool(object):
+
+    def __init__(self, max_size=20, idle_timeout=600, max_age=3600):
+        """A bounded, thread-safe pool of logged in pyvcloud clients,
+        shared by all of the operations that run in the same process.
+
+        :param max_size: the maximum number of sessions to keep open.
+        :param idle_timeout: seconds after which an unused session is closed.
+        :param max_age: seconds after which a session is closed.
+
+        Sessions that are removed from the pool while a connection is
+        still using them are not closed, but left to expire in vCD.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._sessions = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def get_key(client_config, credentials):
+        # Every argument of the Client, such as verify_ssl_certs, so that a
+        # session is only reused by a client that is set up the same way.
+        client_kwargs = tuple(sorted(
+            (name, str(value))
+            for name, value in client_config.asdict().items()))
+        return (client_config.uri,
+                credentials.org,
+                credentials.username,
+                client_config.api_version) + client_kwargs
+
+    @staticmethod
+    def get_secret(credentials):
+        # Never reuse a session opened with a different password.
+        return sha256(str(credentials.password).encode('utf-8')).hexdigest()
+
+    def expired(self, session, now):
+        return now - session.last_used > self.idle_timeout or \
+            now - session.created > self.max_age
+
+    def get_client(self,
+                   client_config,
+                   credentials,
+                   logger,
+                   session_token=None):
+        """Return a logged in client for the endpoint and credentials,
+        logging in only if there is no usable session in the pool.
+
+        :param client_config: VCloudClientConfiguration
+        :param credentials: VCloudCredentials
+        :param logger:
+        :param session_token: see login.
+        :return: pyvcloud.vcd.client.Client
+        """
+        key = self.get_key(client_config, credentials)
+        secret = self.get_secret(credentials)
+        with self._lock:
+            stale = self._evict()
+            session = self._sessions.get(key)
+            if session and session.secret == secret:
+                self._sessions.move_to_end(key)
+                session.last_used = time()
+                session.users += 1
+                client = session.client
+            else:
+                client = None
+        self._logout(stale, logger)
+        if client:
+            return client
+
+        # Log in without holding the lock, so that other endpoints
+        # are not blocked by a slow login.
+        client = login(client_config, credentials, logger, session_token)
+        with self._lock:
+            replaced = self._sessions.pop(key, None)
+            self._sessions[key] = PooledSession(client, secret)
+            stale = [replaced] if replaced else []
+            while len(self._sessions) > self.max_size:
+                stale.append(self._sessions.popitem(last=False)[1])
+        self._logout(stale, logger)
+        return client
+
+    def release(self, client):
+        """Tell the pool that a connection stopped using a client,
+        so that the session can be closed once it expires.
+
+        :param client: a client returned by get_client.
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                if session.client is client:
+                    session.users = max(0, session.users - 1)
+                    session.last_used = time()
+                    break
+
+    def clear(self, logger=None):
+        with self._lock:
+            stale = list(self._sessions.values())
+            self._sessions.clear()
+        self._logout(stale, logger or logging.getLogger(__name__))
+
+    def _evict(self):
+        now = time()
+        stale = []
+        for key, session in list(self._sessions.items()):
+            if session.users and now - session.created <= self.max_age:
+                # The session is in use, so it is not idle.
+                continue
+            if self.expired(session, now):
+                stale.append(self._sessions.pop(key))
+        return stale
+
+    @staticmethod
+    def _logout(sessions, logger):
+        for session in sessions:
+            if not session.users:
+                logout(session.client, logger)
+
+
+SESSION_POOL = VCloudSessionPool()
+
+
+class ResourceCache(object):
+
+    def __init__(self, ttl=300):
+        """A cache of resolved pyvcloud objects, such as Org and VDC.
+        Every object can be stored under several keys, e.g. name and href.
+
+        :param ttl: seconds after which a cached object is resolved again.
+        """
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry:
+            value, created = entry
+            if time() - created < self.ttl:
+                return value
+            self.invalidate(key)
+
+    def set(self, value, *keys):
+        created = time()
+        for key in keys:
+            self._entries[key] = (value, created)
+        return value
+
+    def invalidate(self, key=None):
+        """Remove an object, with all of its keys, or everything if no key
+        is provided.
+        """
+        if key is None:
+            self._entries.clear()
+            return
+        entry = self._entries.get(key)
+        if entry:
+            for k, v in list(self._entries.items()):
+                if v[0] is entry[0]:
+                    del self._entries[k]
+
+
 class VCloudConnect(object):
 
-    def __init__(self, logger=None, client_config=None, credentials=None):
+    def __init__(self,
+                 logger=None,
+                 client_config=None,
+                 credentials=None,
+                 session_pool=None,
+                 session_token=None,
+                 cache_ttl=300,
+                 blocking_retries=True):
 
         client_config = client_config or \
             self.get_client_config_from_environment()
@@ -160,13 +480,61 @@ class VCloudConnect(object):
             logger=self.logger, **client_config)
         self.credentials = VCloudCredentials(
             logger=self.logger, **credentials)
+        self.session_pool = session_pool
+        self.session_token = session_token
+        self.cache = ResourceCache(cache_ttl)
+        # If False, resources raise VCloudSDKRetryException instead of
+        # sleeping while they wait for vCD to catch up.
+        self.blocking_retries = blocking_retries
+        self._client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.logout()
 
     @property
     def client(self):
-        client = Client(**self.client_config.asdict())
-        client.set_credentials(
-            BasicLoginCredentials(**self.credentials.asdict()))
-        return client
+        # We only log in the first time that the client is needed,
+        # and the same session is used for the lifetime of this object.
+        if not self._client:
+            if self.session_pool is not None:
+                self._client = self.session_pool.get_client(
+                    self.client_config,
+                    self.credentials,
+                    self.logger,
+                    self.session_token)
+            else:
+                self._client = login(self.client_config,
+                                     self.credentials,
+                                     self.logger,
+                                     self.session_token)
+        return self._client
+
+    def get_session_token(self):
+        """Return the token of the current session, so that it can be
+        resumed later, for example by another process.
+
+        :return: dict with token and is_jwt_token keys, or None.
+        """
+        if not self._client:
+            return
+        access_token = self._client.get_access_token()
+        if access_token:
+            return {'token': access_token, 'is_jwt_token': True}
+        auth_token = self._client.get_xvcloud_authorization_token()
+        if auth_token:
+            return {'token': auth_token, 'is_jwt_token': False}
+
+    def logout(self):
+        if self._client:
+            # Pooled sessions are closed by the pool when they expire.
+            if self.session_pool is None:
+                logout(self._client, self.logger)
+            else:
+                self.session_pool.release(self._client)
+            self._client = None
 
     @staticmethod
     def get_client_config_from_environment():
@@ -192,8 +560,42 @@ class VCloudConnect(object):
         return self.get_org()
 
     def get_org(self, org_name=None):
-        if org_name:
-            logged_in_org = self.client.get_org_by_name(org_name)
-        else:
-            logged_in_org = self.client.get_org()
-        return Org(self.client, resource=logged_in_org)
+        org = self.cache.get(('org', org_name))
+        if not org:
+            if org_name:
+                logged_in_org = self.client.get_org_by_name(org_name)
+            else:
+                logged_in_org = self.client.get_org()
+            org = self.cache.set(Org(self.client, resource=logged_in_org),
+                                 ('org', org_name),
+                                 ('org', logged_in_org.get('href')))
+        return org
+
+    def get_vdc(self, vdc_name, org_name=None):
+        """Return the VDC from the org, resolving it only once for all of the
+        resources that use this connection. Once resolved, the VDC is also
+        cached by its href.
+
+        :param vdc_name: the name of the VDC.
+        :param org_name: the name of the org, if not the logged in org.
+        :return: pyvcloud.vcd.vdc.VDC
+        :raises EntityNotFoundException: if there is no such VDC.
+        """
+        vdc = self.cache.get(('vdc', org_name, vdc_name))
+        if not vdc:
+            vdc_resource = self.get_org(org_name).get_vdc(vdc_name)
+            if vdc_resource is None:
+                raise EntityNotFoundException(
+                    'VDC {name} not found.'.format(name=vdc_name))
+            vdc = self.cache.set(VDC(self.client, resource=vdc_resource),
+                                 ('vdc', org_name, vdc_name),
+                                 ('vdc', org_name, vdc_resource.get('name')),
+                                 ('vdc', org_name, vdc_resource.get('href')))
+        return vdc
+
+    def invalidate(self, key=None):
+        """Forget the cached org or VDC, so it is resolved again.
+
+        :param key: e.g. ('vdc', None, vdc_name), or None for everything.
+        """
+        self.cache.invalidate(key)
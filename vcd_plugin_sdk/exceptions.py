@@ -15,3 +15,15 @@
 
 class VCloudSDKException(Exception):
     pass
+
+
+class VCloudSDKRetryException(VCloudSDKException):
+
+    def __init__(self, message='', retry_after=None):
+        """Raised instead of waiting, when the caller prefers to retry later.
+
+        :param message:
+        :param retry_after: suggested seconds to wait before retrying.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,129 @@
+# Copyright (c) 2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from urllib.parse import quote
+
+from pyvcloud.vcd.client import ResourceType, QueryResultFormat
+from pyvcloud.vcd.exceptions import (
+    EntityNotFoundException,
+    MultipleRecordsException)
+
+DEFAULT_PAGE_SIZE = 128
+
+# The query types that system administrators use to see every org.
+ADMIN_RESOURCE_TYPES = {
+    ResourceType.VAPP.value: ResourceType.ADMIN_VAPP.value,
+    ResourceType.VM.value: ResourceType.ADMIN_VM.value,
+    ResourceType.DISK.value: ResourceType.ADMIN_DISK.value,
+}
+
+# The linkType of orgVdcNetwork records, by our network_type.
+NETWORK_LINK_TYPES = {
+    'directly_connected_vdc_network': 0,
+    'routed_vdc_network': 1,
+    'isolated_vdc_network': 2,
+}
+
+
+def build_filter(**filters):
+    """ Build a vCD query filter expression, where every filter must match.
+
+    :param filters: attribute names and values. None values are skipped.
+    :return: str, e.g. name==foo;vdc==https%3A//...
+    """
+    return ';'.join(
+        '{k}=={v}'.format(k=k, v=quote(str(v)))
+        for k, v in sorted(filters.items()) if v is not None)
+
+
+class TypedQuery(object):
+
+    def __init__(self,
+                 client,
+                 resource_type,
+                 fields=None,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 **filters):
+        """A query of vCD records of one type, which only returns the
+        requested fields of the matching records.
+
+        :param client: pyvcloud Client
+        :param resource_type: a pyvcloud ResourceType value, e.g. 'vApp'.
+        :param fields: list of the record attributes to return. The href is
+            always returned.
+        :param page_size: the number of records in every response.
+        :param filters: see build_filter.
+        """
+        self.client = client
+        self.resource_type = resource_type
+        self.fields = fields
+        self.page_size = page_size
+        self.filters = filters
+
+    @property
+    def query_type(self):
+        if self.client.is_sysadmin():
+            return ADMIN_RESOURCE_TYPES.get(
+                self.resource_type, self.resource_type)
+        return self.resource_type
+
+    def execute(self):
+        """ Get the records of every page, one page at a time.
+
+        :return: generator of records
+        """
+        query = self.client.get_typed_query(
+            self.query_type,
+            query_result_format=QueryResultFormat.RECORDS,
+            page_size=self.page_size,
+            qfilter=build_filter(**self.filters) or None,
+            fields=','.join(self.fields) if self.fields else None)
+        return query.execute()
+
+    def records(self):
+        return list(self.execute())
+
+    def get_one(self):
+        """ Get the single matching record.
+
+        :return: record
+        :raises: EntityNotFoundException, MultipleRecordsException
+        """
+        records = self.records()
+        if not records:
+            raise EntityNotFoundException(
+                'No {t} matches {f}.'.format(
+                    t=self.resource_type, f=self.filters))
+        elif len(records) > 1:
+            raise MultipleRecordsException(
+                'Found {n} {t} records that match {f}.'.format(
+                    n=len(records), t=self.resource_type, f=self.filters))
+        return records[0]
+
+    def get_href(self):
+        return self.get_one().get('href')
+
+
+def get_resource_by_query(client, resource_type, **filters):
+    """ Resolve a single resource with a query that returns only its href,
+    and then get its document.
+
+    :param client: pyvcloud Client
+    :param resource_type: see TypedQuery.
+    :param filters: see build_filter.
+    :return: lxml.objectify.ObjectifiedElement
+    """
+    href = TypedQuery(
+        client, resource_type, fields=['name'], **filters).get_href()
+    return client.get_resource(href)
@@ -14,33 +14,47 @@
 
 
 # import json  # See below.
+from time import time
+from contextlib import contextmanager
 
-from pyvcloud.vcd.vdc import VDC
 from pyvcloud.vcd.vapp import VApp
-from pyvcloud.vcd.client import TaskStatus
-from pyvcloud.vcd.exceptions import EntityNotFoundException
-
+from pyvcloud.vcd.client import TaskStatus, ResourceType
+from pyvcloud.vcd.exceptions import (
+    VcdTaskException,
+    EntityNotFoundException)
+
+from ..retry import retry
+from ..query import get_resource_by_query
+from ..tasks import get_task_status, get_task_record
 from ..connection import VCloudConnect
-from ..exceptions import VCloudSDKException
+from ..exceptions import VCloudSDKException, VCloudSDKRetryException
 
 
 class VCloudResource(object):
 
+    # Minimum seconds between reloads of the same vCD object.
+    reload_interval = 5
+    # Suggested seconds to wait before checking a running task again.
+    task_retry_after = 10
+    # The most tasks of each kind that are kept in the task history.
+    task_history_depth = 10
+
     def __init__(self, connection, vdc_name, vapp_name=None, tasks=None):
 
         self._connection = connection or VCloudConnect()
         self.logger = self.connection.logger
 
-        try:
-            vdc_resource = self._connection.org.get_vdc(vdc_name)
-        except EntityNotFoundException:
-            self._vdc = None
-        else:
-            self._vdc = VDC(self._connection.client, resource=vdc_resource)
+        # The VDC is resolved the first time that it is needed,
+        # so that constructing a resource object costs no API calls.
+        self._vdc_name = vdc_name
+        self._vdc = None
+        self._vdc_resolved = False
 
         self._vapp_name = vapp_name
         self._vapp = None
-        self.tasks = tasks or {'create': [], 'delete': [], 'update': []}
+        self.tasks = self.get_task_history(tasks)
+        self._reloaded = {}
+        self._snapshot = False
 
     @property
     def client(self):
@@ -56,19 +70,137 @@ class VCloudResource(object):
         # TODO: as part of a try/except block.
         # if self._vdc:
         #     self._vdc.reload()
+        if not self._vdc_resolved:
+            try:
+                self._vdc = self._connection.get_vdc(self._vdc_name)
+            except EntityNotFoundException:
+                self._vdc = None
+            self._vdc_resolved = True
         return self._vdc
 
-    def task_successful(self, task):
-        """ Check if a VCD task succeeded.
+    def get_task_history(self, tasks=None):
+        """ Copy a task history, for example from runtime properties,
+        with compact records and at most task_history_depth of each kind.
+        """
+        if not tasks:
+            return {'create': [], 'delete': [], 'update': []}
+        elif not isinstance(tasks, dict):
+            return tasks
+        return {
+            kind: [get_task_record(task) for task in
+                   (records or [])[-self.task_history_depth:]]
+            for kind, records in tasks.items()
+        }
+
+    def add_task(self, kind, task):
+        """ Add a task to the task history, forgetting the oldest tasks
+        of the same kind once there are more than task_history_depth.
+
+        :param kind: the kind of task, such as create, delete or update.
+        :param task: the task, or another vCD object that was returned.
+        :return: the compact record of the task.
+        """
+        record = get_task_record(task)
+        records = self.tasks.setdefault(kind, [])
+        records.append(record)
+        del records[:-self.task_history_depth]
+        return record
+
+    def refresh(self):
+        """Reload all vCD objects the next time that they are accessed."""
+        self._reloaded.clear()
+
+    @contextmanager
+    def snapshot(self):
+        """While in this context, vCD objects are loaded at most once, so
+        that all of the values read come from the same document.
+        """
+        previous = self._snapshot
+        self._snapshot = True
+        try:
+            yield self
+        finally:
+            self._snapshot = previous
+
+    def needs_reload(self, key):
+        last_reload = self._reloaded.get(key)
+        if last_reload is None:
+            return True
+        elif self._snapshot:
+            return False
+        return time() - last_reload >= self.reload_interval
+
+    def mark_reloaded(self, key):
+        self._reloaded[key] = time()
+
+    def get_task_status(self, task):
+        """ Check the status of a VCD task once, without waiting for it.
 
         :param task: Element {http://www.vmware.com/vcloud/v1.5}Task object
-        :return: bool
+        :return: tuple of TaskStatus SUCCESS, ERROR or RUNNING,
+            and the current task object.
+        """
+        return get_task_status(self.client, task.get('href'))
+
+    def wait_for_task(self, task, wait=True):
+        """ Get the finished VCD task.
+
+        :param task: Element {http://www.vmware.com/vcloud/v1.5}Task object
+        :param wait: if False, raise VCloudSDKRetryException
+            instead of waiting for a running task.
+        :return: the finished task object.
         """
         # task = json.loads(task_string)  # If task contains non-JSON
         # serializable material, we will need to start encoding and decoding.
         # Leaving this commented out for now.
-        result = self.client.get_task_monitor().wait_for_success(
-            task, 10)
+        if wait:
+            return self.client.get_task_monitor().wait_for_success(task, 10)
+        status, task = self.get_task_status(task)
+        if status == TaskStatus.RUNNING:
+            raise VCloudSDKRetryException(
+                'Task {name} is still {status}.'.format(
+                    name=task.get('operationName'),
+                    status=task.get('status')),
+                retry_after=self.task_retry_after)
+        elif status == TaskStatus.ERROR:
+            raise VcdTaskException(task.get('status'), task.Error)
+        return task
+
+    def tasks_successful(self, task_set, wait=True):
+        """ Check if all of the VCD tasks in a task set succeeded.
+
+        :param task_set: vcd_plugin_sdk.tasks.TaskSet
+        :param wait: if False, raise VCloudSDKRetryException
+            instead of waiting for running tasks.
+        :return: bool
+        """
+        def _poll():
+            if task_set.poll(self.client) == TaskStatus.RUNNING:
+                raise VCloudSDKRetryException(
+                    '{n} of {t} tasks are still running.'.format(
+                        n=len(task_set.pending), t=len(task_set)),
+                    retry_after=self.task_retry_after)
+
+        if wait:
+            retry(_poll,
+                  retry_on=(VCloudSDKRetryException,),
+                  attempts=60,
+                  max_delay=self.task_retry_after)
+        else:
+            _poll()
+        task_set.raise_for_failure()
+        self.refresh()
+        return task_set.status == TaskStatus.SUCCESS
+
+    def task_successful(self, task, wait=True):
+        """ Check if a VCD task succeeded.
+
+        :param task: Element {http://www.vmware.com/vcloud/v1.5}Task object
+        :param wait: see wait_for_task.
+        :return: bool
+        """
+        result = self.wait_for_task(task, wait)
+        self.refresh()
         # Return True if the API says the task succeeded.
         return result.get('status') == TaskStatus.SUCCESS.value
 
@@ -86,11 +218,17 @@ class VCloudResource(object):
     def get_vapp(self, vapp_name=None):
         vapp_name = vapp_name or self._vapp_name
         try:
-            vapp_resource = self.vdc.get_vapp(vapp_name)
+            vapp_resource = self.get_vapp_resource(vapp_name)
         except (EntityNotFoundException, AttributeError):
             return
         return VApp(self.client, resource=vapp_resource)
 
+    def get_vapp_resource(self, vapp_name):
+        return get_resource_by_query(self.client,
+                                     ResourceType.VAPP.value,
+                                     name=vapp_name,
+                                     vdc=self.vdc.href)
+
     def get_template(self, catalog_name, item_name):
         """Return the catalog object by name
         """
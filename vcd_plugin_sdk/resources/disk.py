@@ -15,7 +15,10 @@
 import os
 from tempfile import NamedTemporaryFile
 
+from pyvcloud.vcd.client import ResourceType
+
 from .base import VCloudResource
+from ..query import get_resource_by_query
 import cloudify_common_sdk.iso9660 as iso9660
 
 
@@ -57,10 +60,9 @@ class VCloudDisk(VCloudResource):
         return self._id
 
     def _get_identifier(self, identifier):
-        if len(self.tasks['create']) > 0:
-            for pair in self.tasks['create'][0]:
-                if pair.get(identifier):
-                    return pair.get(identifier)
+        for record in self.tasks.get('create', []):
+            if record.get(identifier):
+                return record.get(identifier)
 
     @property
     def disk(self):
@@ -68,42 +70,48 @@ class VCloudDisk(VCloudResource):
 
     @property
     def exposed_data(self):
+        # Every read of self.disk is a query and a GET.
+        disk = self.disk
         return {
             'id': self.id,
             'href': self.href,
-            'size': self.disk.get('size'),
-            'status': self.disk.get('status'),
-            'iops': self.disk.get('iops'),
-            'busSubType': self.disk.get('busSubType'),
-            'busType': self.disk.get('busType'),
-            'shareable': self.disk.get('shareable'),
-            'sharingType': self.disk.get('sharingType'),
-            'name': self.disk.get('name'),
-            'sizeMb': self.disk.get('sizeMb'),
+            'size': disk.get('size'),
+            'status': disk.get('status'),
+            'iops': disk.get('iops'),
+            'busSubType': disk.get('busSubType'),
+            'busType': disk.get('busType'),
+            'shareable': disk.get('shareable'),
+            'sharingType': disk.get('sharingType'),
+            'name': disk.get('name'),
+            'sizeMb': disk.get('sizeMb'),
         }
 
     def get_disk(self, disk_id=None, disk_name=None):
         disk_id = disk_id or self.id
         if disk_id:
-            return self.vdc.get_disk(disk_id=disk_id)
-        else:
-            return self.vdc.get_disk(disk_name or self.name)
+            if not disk_id.startswith('urn:vcloud:disk:'):
+                disk_id = 'urn:vcloud:disk:' + disk_id
+            return get_resource_by_query(self.client,
+                                         ResourceType.DISK.value,
+                                         id=disk_id,
+                                         vdc=self.vdc.href)
+        return get_resource_by_query(self.client,
+                                     ResourceType.DISK.value,
+                                     name=disk_name or self.name,
+                                     vdc=self.vdc.href)
 
     def create(self):
         task = self.vdc.create_disk(self.name, **self.kwargs)
-        self.tasks['create'].append(task.items())
+        self.add_task('create', task)
         self._disk_href = task.get('href')
         self._id = task.get('id')
         self.vdc.reload()
         return task
 
     def delete(self, disk_id=None, disk_name=None):
-        disk_id = disk_id or self.id
-        if disk_id:
-            task = self.vdc.delete_disk(disk_id=disk_id)
-        else:
-            task = self.vdc.delete_disk(disk_name or self.name)
-        self.tasks['delete'].append(task.items())
+        disk = self.get_disk(disk_id, disk_name)
+        task = self.client.delete_resource(disk.get('href'))
+        self.add_task('delete', task)
         return task
 
 
@@ -12,31 +12,189 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from time import sleep
-
+from pyvcloud.vcd.client import (
+    EntityType,
+    ResourceType,
+    create_element)
 from pyvcloud.vcd.gateway import Gateway
 from pyvcloud.vcd.nat_rule import NatRule
 from pyvcloud.vcd.dhcp_pool import DhcpPool
 from pyvcloud.vcd.vdc_network import VdcNetwork
 from pyvcloud.vcd.static_route import StaticRoute
 from pyvcloud.vcd.firewall_rule import FirewallRule
+from pyvcloud.vcd.utils import build_network_url_from_gateway_url
+from pyvcloud.vcd.network_url_constants import (
+    NAT_URL_TEMPLATE,
+    DHCP_URL_TEMPLATE,
+    DHCP_POOL_URL_TEMPLATE,
+    STATIC_ROUTE_URL_TEMPLATE,
+    FIREWALL_RULE_URL_TEMPLATE,
+    FIREWALL_RULES_URL_TEMPLATE)
 from pyvcloud.vcd.exceptions import (
     EntityNotFoundException,
-    BadRequestException)
+    InvalidParameterException)
 
 from .base import VCloudResource
+from ..retry import retry
+from ..connection import post_for_location
+from ..query import NETWORK_LINK_TYPES, get_resource_by_query
 from ..exceptions import VCloudSDKException
 
 DESTINATION = 'destination'
 SOURCE = 'source'
 GROUP_OBJECT_LIST = ['securitygroup', 'ipset', 'virtualmachine', 'network']
 VNIC_GROUP_LIST = ['gatewayinterface']
+PROTOCOL_LIST = ['tcp', 'udp', 'icmp', 'any']
+LEASE_TIME = '86400'
+# The fields that identify a NAT rule, and their elements.
+NAT_RULE_FIELDS = {
+    'action': 'action',
+    'original_address': 'originalAddress',
+    'translated_address': 'translatedAddress',
+    'protocol': 'protocol',
+    'original_port': 'originalPort',
+    'translated_port': 'translatedPort',
+    'vnic': 'vnic',
+    'type': 'ruleType',
+}
+# The values that get_nat_rule_element uses for fields that are not set.
+NAT_RULE_DEFAULTS = {
+    'vnic': 0,
+    'type': 'User',
+}
 
 
 def underscore_to_camelcase(value):
     return ''.join(word.title() for word in value.split('_'))
 
 
+def nat_rule_key(nat_definition):
+    """Normalize a NAT rule definition, so that a definition and the rule
+    that was created from it have the same key. Like Gateway.add_nat_rule,
+    only DNAT rules have a protocol and ports.
+
+    :param nat_definition: dict of the arguments of Gateway.add_nat_rule.
+    :return: tuple
+    """
+    key = {}
+    for field in NAT_RULE_FIELDS:
+        value = nat_definition.get(field)
+        if value is None:
+            value = NAT_RULE_DEFAULTS.get(field, 'any')
+        key[field] = str(value).lower()
+    if key['action'] != 'dnat':
+        key.update(protocol='any', original_port='any', translated_port='any')
+    elif key['protocol'] == 'icmp':
+        key['original_port'] = 'any'
+    return tuple(key[field] for field in NAT_RULE_FIELDS)
+
+
+def get_nat_rule_info(nat_rule):
+    """The same as NatRule.get_nat_rule_info, for a natRule element that
+    was already read.
+
+    :param nat_rule: natRule element.
+    :return: dict
+    """
+    nat_rule_info = {
+        'ID': nat_rule.ruleId,
+        'OriginalAddress': getattr(nat_rule, 'originalAddress', None),
+        'OriginalPort': getattr(nat_rule, 'originalPort', None),
+        'TranslatedAddress': getattr(nat_rule, 'translatedAddress', None),
+        'TranslatedPort': getattr(nat_rule, 'translatedPort', None),
+        'Action': getattr(nat_rule, 'action', None),
+        'Protocol': getattr(nat_rule, 'protocol', None),
+        'Enabled': getattr(nat_rule, 'enabled', None),
+        'Logging': getattr(nat_rule, 'loggingEnabled', None),
+    }
+    if hasattr(nat_rule, 'description'):
+        nat_rule_info['Description'] = nat_rule.description
+    return nat_rule_info
+
+
+def get_nat_rule_element(nat_definition):
+    """Build the natRule element that Gateway.add_nat_rule would add.
+
+    :param nat_definition: dict of the arguments of Gateway.add_nat_rule.
+    :return: lxml element.
+    """
+    action = nat_definition['action']
+    protocol = nat_definition.get('protocol', 'any')
+    translated_port = nat_definition.get('translated_port', 'any')
+    nat_rule = create_element('natRule')
+    nat_rule.append(
+        create_element('ruleType', nat_definition.get('type', 'User')))
+    nat_rule.append(create_element('action', action))
+    nat_rule.append(create_element(
+        'originalAddress', nat_definition['original_address']))
+    nat_rule.append(create_element(
+        'translatedAddress', nat_definition['translated_address']))
+    nat_rule.append(create_element(
+        'loggingEnabled', nat_definition.get('logging_enabled', False)))
+    nat_rule.append(
+        create_element('enabled', nat_definition.get('enabled', True)))
+    nat_rule.append(
+        create_element('description', nat_definition.get('description')))
+    nat_rule.append(create_element('vnic', nat_definition.get('vnic', 0)))
+    if action == 'dnat' and protocol != 'icmp':
+        nat_rule.append(create_element('protocol', protocol))
+        nat_rule.append(create_element(
+            'originalPort', nat_definition.get('original_port', 'any')))
+        nat_rule.append(create_element('translatedPort', translated_port))
+    elif action == 'dnat':
+        nat_rule.append(create_element('translatedPort', translated_port))
+        nat_rule.append(create_element('protocol', protocol))
+        nat_rule.append(create_element(
+            'icmpType', nat_definition.get('icmp_type', 'any')))
+    return nat_rule
+
+
+def get_dhcp_pool_element(pool_definition):
+    """Build the ipPool element that Gateway.add_dhcp_pool would add.
+
+    :param pool_definition: dict of the arguments of Gateway.add_dhcp_pool.
+    :return: lxml element.
+    """
+    ip_pool = create_element('ipPool')
+    ip_pool.append(create_element(
+        'autoConfigureDNS', pool_definition.get('auto_config_dns', False)))
+    for field, element in [('default_gateway', 'defaultGateway'),
+                           ('domain_name', 'domainName'),
+                           ('primary_server', 'primaryNameServer'),
+                           ('secondary_server', 'secondaryNameServer')]:
+        if pool_definition.get(field) is not None:
+            ip_pool.append(create_element(element, pool_definition[field]))
+    if pool_definition.get('lease_never_expires'):
+        ip_pool.append(create_element('leaseTime', 'infinite'))
+    else:
+        ip_pool.append(create_element(
+            'leaseTime', pool_definition.get('lease_time', LEASE_TIME)))
+    if pool_definition.get('subnet_mask') is not None:
+        ip_pool.append(
+            create_element('subnetMask', pool_definition['subnet_mask']))
+    ip_pool.append(create_element('ipRange', pool_definition['ip_range']))
+    return ip_pool
+
+
+def get_static_route_element(route_definition):
+    """Build the route element that Gateway.add_static_route would add.
+
+    :param route_definition: dict of the arguments of
+        Gateway.add_static_route.
+    :return: lxml element.
+    """
+    route = create_element('route')
+    route.append(create_element('network', route_definition['network']))
+    route.append(create_element('nextHop', route_definition['next_hop']))
+    route.append(create_element('mtu', route_definition.get('mtu', 1500)))
+    route.append(
+        create_element('type', route_definition.get('type', 'User')))
+    route.append(
+        create_element('description', route_definition.get('description')))
+    route.append(create_element('vnic', route_definition.get('vnic', 0)))
+    return route
+
+
 class VCloudNetwork(VCloudResource):
 
     def __init__(self,
@@ -64,16 +222,19 @@ class VCloudNetwork(VCloudResource):
     @property
     def network(self):
         if not self._network:
-            for i in range(0, 10):
-                # This is necessary because of Vcloud API is async.
-                try:
-                    self._network = self.get_network()
-                except (ValueError, EntityNotFoundException) as e:
-                    if i == 9:
-                        raise VCloudSDKException(
-                            'Network {name} has not been initialized. '
-                            'Error: {e}'.format(name=self.name, e=str(e)))
-                    sleep(5)
+            # This is necessary because of Vcloud API is async.
+            try:
+                self._network = retry(
+                    self.get_network,
+                    retry_on=(ValueError, EntityNotFoundException),
+                    attempts=10,
+                    deadline=60,
+                    blocking=self.connection.blocking_retries,
+                    max_delay=10)
+            except (ValueError, EntityNotFoundException) as e:
+                raise VCloudSDKException(
+                    'Network {name} has not been initialized. '
+                    'Error: {e}'.format(name=self.name, e=str(e)))
         return self._network
 
     @property
@@ -110,15 +271,15 @@ class VCloudNetwork(VCloudResource):
         if not network_type:
             network_type = self.network_type
 
-        if network_type == 'routed_vdc_network':
-            network_resource = self.vdc.get_routed_orgvdc_network(
-                name=network_name)
-        elif network_type == 'isolated_vdc_network':
-            network_resource = self.vdc.get_isolated_orgvdc_network(
-                name=network_name)
-        elif network_type == 'directly_connected_vdc_network':
-            network_resource = self.vdc.get_direct_orgvdc_network(
-                name=network_name)
+        if network_type in NETWORK_LINK_TYPES:
+            # Unlike VDC.get_routed_orgvdc_network etc, this does not
+            # download every network in the VDC.
+            network_resource = get_resource_by_query(
+                self.client,
+                ResourceType.ORG_VDC_NETWORK.value,
+                name=network_name,
+                vdc=self.vdc.href,
+                linkType=NETWORK_LINK_TYPES[network_type])
         else:
             raise VCloudSDKException(
                 "The property network_type {network_type} is not one of "
@@ -130,12 +291,12 @@ class VCloudNetwork(VCloudResource):
 
     def create(self):
         task = self._create()
-        self.tasks['create'].append(task.items())
+        self.add_task('create', task)
         return task
 
     def delete(self):
         task = self._delete()
-        self.tasks['delete'].append(task.items())
+        self.add_task('delete', task)
         return task
 
     def _create(self):
@@ -164,12 +325,8 @@ class VCloudNetwork(VCloudResource):
                 "'vapp_network]".format(network_type=self.network_type))
 
     def _delete(self):
-        if self.network_type == 'routed_vdc_network':
-            return self.vdc.delete_routed_orgvdc_network(self.name)
-        elif self.network_type == 'isolated_vdc_network':
-            return self.vdc.delete_isolated_orgvdc_network(self.name)
-        elif self.network_type == 'directly_connected_vdc_network':
-            return self.vdc.delete_direct_orgvdc_network(self.name)
+        if self.network_type in NETWORK_LINK_TYPES:
+            return self.client.delete_resource(self.get_network().href)
         elif self.network_type == 'vapp_network':
             if not self.vapp:
                 raise VCloudSDKException(
@@ -196,6 +353,21 @@ class VCloudNetwork(VCloudResource):
 
 class VCloudGateway(VCloudResource):
 
+    # The sections of the edge configuration, and the Gateway methods that
+    # read each of them with a single request.
+    CONFIG_SECTIONS = {
+        'firewall': 'get_firewall_rules',
+        'nat': 'get_nat_rules',
+        'dhcp': 'get_dhcp',
+        'routing': 'get_static_routes',
+    }
+    # Where the sections that are changed in place are written.
+    CONFIG_URL_TEMPLATES = {
+        'nat': NAT_URL_TEMPLATE,
+        'dhcp': DHCP_URL_TEMPLATE,
+        'routing': STATIC_ROUTE_URL_TEMPLATE,
+    }
+
     def __init__(self,
                  gateway_name,
                  connection=None,
@@ -206,7 +378,8 @@ class VCloudGateway(VCloudResource):
         self._gateway_name = gateway_name
         self.kwargs = kwargs
         self._gateway = None
-        self._gateway_static_routes = None
+        self._config = {}
+        self._indexes = {}
 
         super().__init__(connection, vdc_name, tasks=tasks)
 
@@ -220,18 +393,57 @@ class VCloudGateway(VCloudResource):
             self._gateway = self.get_gateway()
         return self._gateway
 
+    def get_config(self, section):
+        """ Get a section of the edge configuration. Each section is read
+        once, and then only again after a change invalidates it.
+
+        :param section: one of CONFIG_SECTIONS.
+        :return: the document of the section.
+        """
+        if section not in self._config:
+            self._config[section] = getattr(
+                self.gateway, self.CONFIG_SECTIONS[section])()
+        return self._config[section]
+
+    def invalidate_config(self, *sections):
+        """Read these sections of the edge configuration again the next time
+        that they are needed, or all of them if none are provided.
+        """
+        for section in sections or list(self._config):
+            self._config.pop(section, None)
+            self._indexes.pop(section, None)
+
+    @property
+    def firewall_rule_elements(self):
+        firewall = self.get_config('firewall')
+        if hasattr(firewall.firewallRules, 'firewallRule'):
+            return list(firewall.firewallRules.firewallRule)
+        return []
+
     @property
     def firewall_rules(self):
-        return self.gateway.get_firewall_rules_list()
+        # The same as Gateway.get_firewall_rules_list.
+        return [dict(ID=firewall_rule['id'],
+                     name=firewall_rule['name'],
+                     ruleType=firewall_rule['ruleType'])
+                for firewall_rule in self.firewall_rule_elements]
 
     @property
     def firewall_objects(self):
-        firewall_objects = {DESTINATION: {}, SOURCE: {}}
-        for direction in firewall_objects.keys():
-            for group_key in GROUP_OBJECT_LIST + VNIC_GROUP_LIST:
-                firewall_objects[direction][group_key] = \
-                    self.gateway.list_firewall_objects(direction, group_key)
-        return firewall_objects
+        return {direction: {group_key: self.get_firewall_objects(
+                                direction, group_key)
+                            for group_key in GROUP_OBJECT_LIST +
+                            VNIC_GROUP_LIST}
+                for direction in [DESTINATION, SOURCE]}
+
+    def get_firewall_objects(self, direction, object_type):
+        # The object browser has no request for all of the objects,
+        # so we keep them for the lifetime of this object.
+        firewall_objects = self._config.setdefault('firewall_objects', {})
+        if (direction, object_type) not in firewall_objects:
+            firewall_objects[(direction, object_type)] = \
+                self.gateway.list_firewall_objects(direction, object_type)
+        return firewall_objects[(direction, object_type)]
 
     @property
     def default_gateway(self):
@@ -240,28 +452,74 @@ class VCloudGateway(VCloudResource):
     @property
     def static_routes(self):
         static_routes = {}
-        if hasattr(self.gateway_static_routes.staticRoutes, 'route'):
-            for route in self.gateway_static_routes.staticRoutes.route:
-                static_routes[route.network] = {
-                    #  'mtu': route.mtu,
-                    'description': route.description,
-                    'type': route.type,
-                    'vnic': route.vnic
-                }
+        for network, route in self.static_route_index.items():
+            static_routes[network] = {
+                #  'mtu': route.mtu,
+                'description': route.description,
+                'type': route.type,
+                'vnic': route.vnic
+            }
         return static_routes
 
+    @property
+    def nat_rule_elements(self):
+        nat_rules_resource = self.get_config('nat')
+        if hasattr(nat_rules_resource.natRules, 'natRule'):
+            return list(nat_rules_resource.natRules.natRule)
+        return []
+
     @property
     def nat_rules(self):
-        return self.gateway.list_nat_rules()
+        # The same as Gateway.list_nat_rules.
+        return [{'ID': nat_rule.ruleId,
+                 'Action': nat_rule.action,
+                 'Enabled': nat_rule.enabled}
+                for nat_rule in self.nat_rule_elements]
+
+    @property
+    def nat_rule_index(self):
+        """Lists of the info of the NAT rules by nat_rule_key, built once
+        per read of the NAT configuration.
+        """
+        if 'nat' not in self._indexes:
+            index = {}
+            for nat_rule in self.nat_rule_elements:
+                nat_definition = {
+                    field: getattr(nat_rule, element, None)
+                    for field, element in NAT_RULE_FIELDS.items()}
+                index.setdefault(nat_rule_key(nat_definition), []).append(
+                    get_nat_rule_info(nat_rule))
+            self._indexes['nat'] = index
+        return self._indexes['nat']
 
     @property
     def dhcp_pools(self):
-        out_list = []
-        dhcp_resource = self.gateway.get_dhcp()
+        dhcp_resource = self.get_config('dhcp')
         if hasattr(dhcp_resource.ipPools, 'ipPool'):
-            for ip_pool in dhcp_resource.ipPools.ipPool:
-                out_list.append(ip_pool)
-        return out_list
+            return list(dhcp_resource.ipPools.ipPool)
+        return []
+
+    @property
+    def dhcp_pool_index(self):
+        """The ipPool elements by IP range, built once per read of the DHCP
+        configuration.
+        """
+        if 'dhcp' not in self._indexes:
+            self._indexes['dhcp'] = {
+                str(ip_pool.ipRange): ip_pool for ip_pool in self.dhcp_pools}
+        return self._indexes['dhcp']
+
+    @property
+    def static_route_index(self):
+        """The route elements by network, built once per read of the
+        routing configuration.
+        """
+        if 'routing' not in self._indexes:
+            routes = self.gateway_static_routes.staticRoutes
+            self._indexes['routing'] = {
+                str(route.network): route
+                for route in getattr(routes, 'route', [])}
+        return self._indexes['routing']
 
     @property
     def exposed_data(self):
@@ -277,12 +535,11 @@ class VCloudGateway(VCloudResource):
 
     @property
     def gateway_static_routes(self):
-        if not self._gateway_static_routes:
-            self.update_gateway_static_routes()
-        return self._gateway_static_routes
+        return self.get_config('routing')
 
     def update_gateway_static_routes(self):
-        self._gateway_static_routes = self.gateway.get_static_routes()
+        self.invalidate_config('routing')
+        return self.gateway_static_routes
 
     def get_gateway(self, gateway_name=None):
         gateway_name = gateway_name or self.name
@@ -304,13 +561,186 @@ class VCloudGateway(VCloudResource):
         # pyvcloud actually has type,
         # but we're not putting that kind of crap in our code.
         _type = kwargs.get('type', _type)
+        # Only needed if the response has no Location, and usually cached.
         before_rules = self.get_list_of_rule_ids()
-        self.gateway.add_firewall_rule(
+        rule_id = self.add_firewall_rule(
             rule_name, action, _type, enabled, logging_enabled)
-        new_rule = self.infer_rule(rule_name, before_rules)
+        if rule_id:
+            new_rule = self.get_firewall_rule(rule_id)
+        else:
+            new_rule = self.infer_rule(rule_name, before_rules)
         new_rule.edit(source_values, destination_values, services)  # no test
+        self.invalidate_config('firewall')
         return new_rule.info_firewall_rule()  # no test
 
+    def add_firewall_rule(self,
+                          rule_name,
+                          action='accept',
+                          _type='User',
+                          enabled=True,
+                          logging_enabled=False):
+        """Append a firewall rule to the edge with a single request.
+        Unlike Gateway.add_firewall_rule, it does not read and write the
+        whole firewall configuration.
+
+        :return: the ID of the new rule, or None if the response has none.
+        """
+        firewall_rule = create_element('firewallRule')
+        firewall_rule.append(create_element('name', rule_name))
+        firewall_rule.append(create_element('ruleType', _type))
+        firewall_rule.append(create_element('enabled', enabled))
+        firewall_rule.append(
+            create_element('loggingEnabled', logging_enabled))
+        firewall_rule.append(create_element('action', action))
+        firewall_rules = create_element('firewallRules')
+        firewall_rules.append(firewall_rule)
+        location = post_for_location(
+            self.client,
+            self.network_url + FIREWALL_RULES_URL_TEMPLATE,
+            firewall_rules)
+        self.invalidate_config('firewall')
+        if location:
+            return location.rstrip('/').split('/')[-1]
+
+    @property
+    def network_url(self):
+        return build_network_url_from_gateway_url(self.gateway.href)
+
+    def get_firewall_rule(self, rule_id, resource=None):
+        """Get a firewall rule of this gateway by ID. FirewallRule would
+        otherwise query the gateway by name for every rule.
+
+        :param rule_id: the ID of the rule.
+        :param resource: the firewallRule element, if it was already read.
+        :return: pyvcloud.vcd.firewall_rule.FirewallRule
+        """
+        firewall_rule = FirewallRule(
+            self.client,
+            resource_href=(self.network_url +
+                           FIREWALL_RULE_URL_TEMPLATE).format(rule_id),
+            resource=resource)
+        # What FirewallRule._build_network_href would set.
+        firewall_rule.gateway_name = self.name
+        firewall_rule.parent = self.gateway.resource
+        firewall_rule.parent_href = self.gateway.href
+        firewall_rule.network_url = self.network_url
+        return firewall_rule
+
+    def create_firewall_rules(self, firewall_rules):
+        """Create firewall rules with a single request, instead of an add
+        and an edit for every rule, and then find all of their IDs in one
+        read of the firewall configuration.
+
+        :param firewall_rules: dict of rule name to the keyword arguments
+            of create_firewall_rule.
+        :return: dict of rule name to the info of the new rule.
+        """
+        if not firewall_rules:
+            return {}
+        before_rules = [str(rule_id) for rule_id in
+                        self.get_list_of_rule_ids()]
+        firewall_rule_elements = create_element('firewallRules')
+        for rule_name, rule_config in firewall_rules.items():
+            firewall_rule_elements.append(
+                self.get_firewall_rule_element(rule_name, **rule_config))
+        post_for_location(self.client,
+                          self.network_url + FIREWALL_RULES_URL_TEMPLATE,
+                          firewall_rule_elements)
+        self.invalidate_config('firewall')
+        new_rules = {}
+        for firewall_rule in self.firewall_rule_elements:
+            if str(firewall_rule.id) not in before_rules and \
+                    firewall_rule.name.text in firewall_rules:
+                # The text, because a name like 123 is not a string element.
+                new_rules[firewall_rule.name.text] = self.get_firewall_rule(
+                    firewall_rule.id, firewall_rule).info_firewall_rule()
+        missing = [rule_name for rule_name in firewall_rules
+                   if rule_name not in new_rules]
+        if missing:
+            raise VCloudSDKException(
+                'Firewall rules {names} not found in {rules}'.format(
+                    names=missing, rules=self.get_list_of_rule_ids()))
+        return new_rules
+
+    def get_firewall_rule_element(self,
+                                  rule_name,
+                                  _type='User',
+                                  source_values=None,
+                                  destination_values=None,
+                                  services=None,
+                                  action='accept',
+                                  enabled=True,
+                                  logging_enabled=False,
+                                  **kwargs):
+        """Build the firewallRule element that add_firewall_rule and
+        FirewallRule.edit would leave on the edge, so that many rules can
+        be posted together.
+
+        :return: lxml element.
+        """
+        _type = kwargs.get('type', _type)
+        firewall_rule = create_element('firewallRule')
+        firewall_rule.append(create_element('name', rule_name))
+        firewall_rule.append(create_element('ruleType', _type))
+        firewall_rule.append(create_element('enabled', enabled))
+        firewall_rule.append(
+            create_element('loggingEnabled', logging_enabled))
+        firewall_rule.append(create_element('action', action))
+        for direction, values in [(SOURCE, source_values),
+                                  (DESTINATION, destination_values)]:
+            # validate_types does not use the rule.
+            FirewallRule.validate_types(None, values, direction)
+            if not values:
+                continue
+            group = create_element(direction)
+            group.append(create_element('exclude', False))
+            for value in values:
+                if value.lower() != 'any':
+                    group.append(
+                        self.get_firewall_group_element(direction, value))
+            firewall_rule.append(group)
+        if services:
+            application = create_element('application')
+            for service in services:
+                protocol, ports = list(service.items())[0]
+                if protocol not in PROTOCOL_LIST:
+                    raise InvalidParameterException(
+                        '{p} is not valid. It should be from {v}'.format(
+                            p=protocol, v=', '.join(PROTOCOL_LIST)))
+                source_port, destination_port = list(ports.items())[0]
+                service_element = create_element('service')
+                service_element.append(create_element('protocol', protocol))
+                service_element.append(
+                    create_element('port', destination_port))
+                service_element.append(
+                    create_element('sourcePort', source_port))
+                if protocol == 'icmp':
+                    service_element.append(create_element('icmpType', 'any'))
+                application.append(service_element)
+            firewall_rule.append(application)
+        return firewall_rule
+
+    def get_firewall_group_element(self, direction, value):
+        """Get the element of a source or destination value, for example
+        ExtNw:gatewayinterface, from the firewall objects of the gateway.
+        """
+        object_name, object_type = value.split(':')[:2]
+        if object_type == 'ip':
+            return create_element('ipAddress', object_name)
+        if object_type in VNIC_GROUP_LIST:
+            group_type = 'vnicGroupId'
+        else:
+            group_type = 'groupingObjectId'
+        for firewall_object in self.get_firewall_objects(
+                direction, object_type):
+            if firewall_object.get('name') == object_name:
+                for prop in firewall_object.get('prop'):
+                    if prop.get('name') == group_type:
+                        return create_element(group_type, prop.get('value'))
+        raise VCloudSDKException(
+            'The {d} {v} was not found in gateway {g}.'.format(
+                d=direction, v=value, g=self.name))
+
     def delete_firewall_rule(self, rule_name, rule_id):
         firewall_rule = self.infer_rule(rule_name, [rule_id], match=True)
         try:
@@ -319,56 +749,119 @@ class VCloudGateway(VCloudResource):
             raise VCloudSDKException(
                 'Unable to find firewall rule {r} for deletion'.format(
                     r=rule_id))
+        self.invalidate_config('firewall')
 
     def get_list_of_rule_ids(self):
-        all_rules = []
-        for firewall_rules in self.gateway.get_firewall_rules():
-            for firewall_rule in firewall_rules.firewallRules.firewallRule:
-                all_rules.append(firewall_rule.id)
-        return all_rules
+        return [firewall_rule.id
+                for firewall_rule in self.firewall_rule_elements]
 
     def infer_rule(self, rule_name, rule_ids=None, match=False):
-        for firewall_rule_id in self.get_list_of_rule_ids():
-            if not match and firewall_rule_id not in rule_ids:
-                rule = FirewallRule(self.client,
-                                    self.name,
-                                    resource_id=firewall_rule_id)
-                rule._reload()
-                if rule_name == rule.resource.name:
-                    return rule
-            elif match and firewall_rule_id in rule_ids:
-                rule = FirewallRule(self.client,
-                                    self.name,
-                                    resource_id=firewall_rule_id)
-                rule._reload()
-                if rule_name == rule.resource.name:
-                    return rule
+        """Find a rule by name, among the rule_ids if match, or else among
+        the other rules. The names come from the firewall configuration,
+        so the rules are not read one by one.
+        """
+        rule_ids = [str(rule_id) for rule_id in rule_ids or []]
+        for firewall_rule in self.firewall_rule_elements:
+            if (str(firewall_rule.id) in rule_ids) == match and \
+                    firewall_rule.name.text == rule_name:
+                return self.get_firewall_rule(firewall_rule.id, firewall_rule)
         raise VCloudSDKException(
             'IDS {ids} not found in {rules}'.format(
                 ids=rule_ids, rules=self.get_list_of_rule_ids()))
 
     # NATS
-    def create_nat_rule(self, nat_definition):
-        try:
-            self.gateway.add_nat_rule(**nat_definition)
-        except BadRequestException:
-            nat_rule = self.get_nat_rule_from_definition(nat_definition)
+    def create_nat_rule(self, nat_definition, rule_ids=None):
+        return self.create_nat_rules([nat_definition], rule_ids)[0]
+
+    def create_nat_rules(self, nat_definitions, rule_ids=None):
+        """Create NAT rules with one write of the NAT configuration.
+        Rules that an earlier attempt created are not added again. Other
+        rules with the same definition are left to whoever owns them.
+
+        :param nat_definitions: list of dicts of the arguments of
+            Gateway.add_nat_rule.
+        :param rule_ids: the IDs of the rules that were created before.
+        :return: list of the info of the rules, in the same order.
+        """
+        rule_ids = [str(rule_id) for rule_id in rule_ids or []]
+        before_rules = [str(nat_rule.ruleId)
+                        for nat_rule in self.nat_rule_elements]
+        found = {}
+        for nat_definition in nat_definitions:
+            key = nat_rule_key(nat_definition)
+            if key not in found:
+                found[key] = self.find_nat_rule(key, rule_ids, True)
+        nat_rules_resource = self.get_config('nat')
+        for nat_definition in nat_definitions:
+            key = nat_rule_key(nat_definition)
+            if found[key] is None:
+                found[key] = {}
+                nat_rules_resource.natRules.append(
+                    get_nat_rule_element(nat_definition))
+        if not all(found.values()):
+            self.put_config('nat')
+            for key, nat_rule in found.items():
+                if not nat_rule:
+                    found[key] = self.find_nat_rule(key, before_rules)
+        nat_rules = []
+        for nat_definition in nat_definitions:
+            nat_rule = found[nat_rule_key(nat_definition)]
             if not nat_rule:
-                raise
-        return self.get_nat_rule_from_definition(nat_definition)
+                raise VCloudSDKException(
+                    'NAT rule {d} not found in {r}'.format(
+                        d=nat_definition, r=self.nat_rules))
+            nat_rules.append(nat_rule)
+        return nat_rules
+
+    def find_nat_rule(self, key, rule_ids, match=False):
+        """Find the info of a NAT rule by nat_rule_key, among the rule_ids
+        if match, or else among the other rules.
+        """
+        for nat_rule in self.nat_rule_index.get(key, []):
+            if (str(nat_rule['ID']) in rule_ids) == match:
+                return nat_rule
 
     def delete_nat_rule(self, nat_id):
         nat_rule = NatRule(self.client, self.name, rule_id=nat_id)
-        return nat_rule.delete_nat_rule()
+        result = nat_rule.delete_nat_rule()
+        self.invalidate_config('nat')
+        return result
+
+    def delete_nat_rules(self, nat_ids):
+        """Delete NAT rules with one write of the NAT configuration.
+
+        :param nat_ids: list of rule IDs.
+        :return: list of the IDs that were not found.
+        """
+        nat_ids = [str(nat_id) for nat_id in nat_ids]
+        nat_rules_resource = self.get_config('nat')
+        deleted = []
+        for nat_rule in self.nat_rule_elements:
+            if str(nat_rule.ruleId) in nat_ids:
+                nat_rules_resource.natRules.remove(nat_rule)
+                deleted.append(str(nat_rule.ruleId))
+        if deleted:
+            self.put_config('nat')
+        return [nat_id for nat_id in nat_ids if nat_id not in deleted]
+
+    def put_config(self, section, invalidate=True):
+        """Write a section of the edge configuration that was changed in
+        place. Unless invalidate is False, because the document is already
+        what the edge has, it is read again the next time that it is needed.
+        """
+        try:
+            self.client.put_resource(
+                self.network_url + self.CONFIG_URL_TEMPLATES[section],
+                self.get_config(section),
+                EntityType.DEFAULT_CONTENT_TYPE.value)
+        except Exception:
+            self.invalidate_config(section)
+            raise
+        if invalidate:
+            self.invalidate_config(section)
 
     def get_nat_rule_from_definition(self, nat_definition):
-        for rule in self.nat_rules:
-            nat_rule = NatRule(
-                self.client, self.name, rule_id=rule['ID'])
-            if self.compare_nat_rule(nat_rule.get_nat_rule_info(),
-                                     nat_definition):
-                return nat_rule.get_nat_rule_info()
-        return {}
+        return self.find_nat_rule(nat_rule_key(nat_definition), []) or {}
 
     @staticmethod
     def compare_nat_rule(rule_info, definition):
@@ -381,16 +874,37 @@ class VCloudGateway(VCloudResource):
 
     # DHCP POOLS
     def add_dhcp_pool(self, pool_definition):
-        try:
-            self.gateway.add_dhcp_pool(**pool_definition)
-        except BadRequestException:
+        return self.add_dhcp_pools([pool_definition])[0]
+
+    def add_dhcp_pools(self, pool_definitions):
+        """Add DHCP pools with one write of the DHCP configuration. Pools
+        whose IP range already exists are not added again.
+
+        :param pool_definitions: list of dicts of the arguments of
+            Gateway.add_dhcp_pool.
+        :return: list of the info of the pools, in the same order.
+        """
+        dhcp_resource = self.get_config('dhcp')
+        added = []
+        for pool_definition in pool_definitions:
+            ip_range = pool_definition.get('ip_range')
+            if ip_range not in self.dhcp_pool_index and ip_range not in added:
+                added.append(ip_range)
+                dhcp_resource.ipPools.append(
+                    get_dhcp_pool_element(pool_definition))
+        if added:
+            # The edge assigns the IDs of the new pools.
+            self.put_config('dhcp')
+        dhcp_pools = []
+        for pool_definition in pool_definitions:
             ip_pool = self.get_dhcp_pool_from_ip_range(
                 pool_definition.get('ip_range'))
             if not ip_pool:
-                raise
-        ip_pool = self.get_dhcp_pool_from_ip_range(
-            pool_definition.get('ip_range'))
-        return ip_pool.get_pool_info()
+                raise VCloudSDKException(
+                    'DHCP pool {d} not found in {r}'.format(
+                        d=pool_definition, r=list(self.dhcp_pool_index)))
+            dhcp_pools.append(ip_pool.get_pool_info())
+        return dhcp_pools
 
     def delete_dhcp_pool(self, pool_definition):
         ip_pool = self.get_dhcp_pool_from_ip_range(
@@ -401,35 +915,81 @@ class VCloudGateway(VCloudResource):
             raise VCloudSDKException(
                 'Unable to find dhcp pool {r} for deletion'.format(
                     r=pool_definition))
+        self.invalidate_config('dhcp')
         return ip_pool
 
+    def delete_dhcp_pools(self, pool_definitions):
+        """Delete DHCP pools with one write of the DHCP configuration.
+
+        :param pool_definitions: list of dicts with an ip_range.
+        :return: list of the definitions that were not found.
+        """
+        dhcp_resource = self.get_config('dhcp')
+        not_found = []
+        deleted = False
+        for pool_definition in pool_definitions:
+            ip_pool = self.dhcp_pool_index.pop(
+                pool_definition.get('ip_range'), None)
+            if ip_pool is None:
+                not_found.append(pool_definition)
+            else:
+                dhcp_resource.ipPools.remove(ip_pool)
+                deleted = True
+        if deleted:
+            self.put_config('dhcp', invalidate=False)
+        return not_found
+
     def get_dhcp_pool_from_ip_range(self, ip_range):
-        for dhcp_pool in self.dhcp_pools:
-            if dhcp_pool.ipRange == ip_range:
-                return DhcpPool(self.client,
-                                self.name,
-                                resource_id=dhcp_pool.poolId)
+        ip_pool = self.dhcp_pool_index.get(ip_range)
+        if ip_pool is not None:
+            # DhcpPool would otherwise query the gateway by name.
+            return DhcpPool(
+                self.client,
+                resource_href=(self.network_url +
+                               DHCP_POOL_URL_TEMPLATE).format(ip_pool.poolId),
+                resource=ip_pool)
 
     # STATIC ROUTES
     def get_static_routes(self):
-        static_routes = []
-        for network, _ in self.static_routes.items():
-            static_routes.append(
-                StaticRoute(
-                    self.client, self.gateway.name, network)
-            )
-        return static_routes
+        return [self.get_static_route_from_network(network)
+                for network in self.static_route_index]
 
     def get_static_route_from_network(self, network):
-        self.update_gateway_static_routes()
-        for route in self.get_static_routes():
-            if route.resource_id == network:
-                return route
+        if network in self.static_route_index:
+            # StaticRoute would otherwise query the gateway by name.
+            static_route = StaticRoute(
+                self.client, route_resource=self.gateway_static_routes)
+            static_route.resource_id = network
+            static_route.href = self.network_url + STATIC_ROUTE_URL_TEMPLATE
+            return static_route
 
     def add_static_route(self, route_definition):
-        self.gateway.add_static_route(**route_definition)
-        return self.get_static_route_from_network(
-            route_definition.get('network'))
+        return self.add_static_routes([route_definition])[0]
+
+    def add_static_routes(self, route_definitions):
+        """Add static routes with one write of the routing configuration.
+        Routes to a network that already has one are not added again.
+
+        :param route_definitions: list of dicts of the arguments of
+            Gateway.add_static_route.
+        :return: list of StaticRoute, in the same order.
+        """
+        routes = self.gateway_static_routes.staticRoutes
+        added = []
+        for route_definition in route_definitions:
+            network = route_definition.get('network')
+            if network not in self.static_route_index and \
+                    network not in added:
+                added.append(network)
+                routes.append(get_static_route_element(route_definition))
+        if added:
+            self.put_config('routing', invalidate=False)
+            # The routing configuration has no IDs to read back.
+            for route in routes.route[-len(added):]:
+                self.static_route_index[str(route.network)] = route
+        return [self.get_static_route_from_network(
+                    route_definition.get('network'))
+                for route_definition in route_definitions]
 
     def delete_static_route(self, route_definition):
         static_route = self.get_static_route_from_network(
@@ -440,3 +1000,25 @@ class VCloudGateway(VCloudResource):
             raise VCloudSDKException(
                 'Unable to find static route {r} for deletion'.format(
                     r=route_definition))
+        self.invalidate_config('routing')
+
+    def delete_static_routes(self, route_definitions):
+        """Delete static routes with one write of the routing configuration.
+
+        :param route_definitions: list of dicts with a network.
+        :return: list of the definitions that were not found.
+        """
+        routes = self.gateway_static_routes.staticRoutes
+        not_found = []
+        deleted = False
+        for route_definition in route_definitions:
+            route = self.static_route_index.pop(
+                route_definition.get('network'), None)
+            if route is None:
+                not_found.append(route_definition)
+            else:
+                routes.remove(route)
+                deleted = True
+        if deleted:
+            self.put_config('routing', invalidate=False)
+        return not_found
@@ -50,16 +50,16 @@ class VCloudStorageProfile(VCloudResource):
 
     def create(self):
         task = self.vdc.add_storage_profile(self.name, **self.kwargs)
-        self.tasks['create'].append(task.items())
+        self.add_task('create', task)
         return task
 
     def delete(self, profile_name=None):
         task = self.vdc.remove_storage_profile(profile_name or self.name)
-        self.tasks['delete'].append(task.items())
+        self.add_task('delete', task)
         return task
 
     def update(self, profile_name=None, **kwargs):
         task = self.vdc.update_storage_profile(
             profile_name or self.name, **kwargs)
-        self.tasks['update'].append(task.items())
+        self.add_task('update', task)
         return task
@@ -3,16 +3,25 @@ import mock
 import pytest
 from io import BytesIO
 
+from lxml import objectify
+
 from pyvcloud.vcd.vdc import VDC as pyvcloud_vdc
 from pyvcloud.vcd.vm import VM as pyvcloud_vm
 from pyvcloud.vcd.vapp import VApp as pyvcloud_vapp
 from pyvcloud.vcd.client import Client as pyvcloud_client
 from pyvcloud.vcd.gateway import Gateway as pyvcloud_gateway
+from pyvcloud.vcd.client import E
+from pyvcloud.vcd.exceptions import (
+    VcdTaskException,
+    OperationNotSupportedException)
 from pyvcloud.vcd.vdc_network import VdcNetwork as pyvcloud_network
 
 from ..vapp import (
     VCloudVM,
-    VCloudvApp)
+    VCloudvApp,
+    CATALOG_ITEMS,
+    get_vm_data,
+    get_recompose_unsupported)
 from ..network import (
     VCloudNetwork,
     VCloudGateway)
@@ -22,12 +31,43 @@ from ..disk import (
     VCloudMedia)
 from ..base import VCloudResource
 
+from ...tasks import TaskSet
 from ...connection import VCloudConnect
-from ...exceptions import VCloudSDKException
+from ...exceptions import VCloudSDKException, VCloudSDKRetryException
 from ...tests import (TEST_CONFIG, TEST_CREDENTIALS)
 
+VM_XML = '''
+<Vm xmlns="http://www.vmware.com/vcloud/v1.5" name="foo" status="4">
+    <NetworkConnectionSection>
+        <PrimaryNetworkConnectionIndex>0</PrimaryNetworkConnectionIndex>
+        <NetworkConnection network="foo">
+            <NetworkConnectionIndex>0</NetworkConnectionIndex>
+            <IpAddress>10.0.0.2</IpAddress>
+            <IsConnected>true</IsConnected>
+            <MACAddress>00:50:56:01:01:01</MACAddress>
+            <IpAddressAllocationMode>MANUAL</IpAddressAllocationMode>
+            <NetworkAdapterType>VMXNET3</NetworkAdapterType>
+        </NetworkConnection>
+        <NetworkConnection network="bar">
+            <NetworkConnectionIndex>1</NetworkConnectionIndex>
+            <IpAddress>10.0.1.2</IpAddress>
+            <IsConnected>false</IsConnected>
+            <IpAddressAllocationMode>POOL</IpAddressAllocationMode>
+            <NetworkAdapterType>E1000</NetworkAdapterType>
+        </NetworkConnection>
+    </NetworkConnectionSection>
+    <VmSpecSection>
+        <NumCpus>2</NumCpus>
+        <NumCoresPerSocket>1</NumCoresPerSocket>
+        <MemoryResourceMb>
+            <Configured>2048</Configured>
+        </MemoryResourceMb>
+    </VmSpecSection>
+</Vm>
+'''
 
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp')
+
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
 def test_vcloud_resource(*_, **__):
@@ -46,6 +86,80 @@ def test_vcloud_resource(*_, **__):
     assert resource.get_template('foo', 'bar') is not None
 
 
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_resource_task_history(*_, **__):
+    vcloud_connect = VCloudConnect(mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    # Older task histories are made compact and bounded.
+    old_history = {
+        'create': [[{'id': 'bar'}, {'href': 'foo/bar'}, {'name': 'baz'}]],
+        'update': [[('href', str(i))] for i in range(15)],
+    }
+    resource = VCloudResource(vcloud_connect, 'vdc', tasks=old_history)
+    assert resource.tasks['create'] == [{'id': 'bar', 'href': 'foo/bar'}]
+    assert [r['href'] for r in resource.tasks['update']] == \
+        [str(i) for i in range(5, 15)]
+    assert len(old_history['update']) == 15
+    resource.task_history_depth = 3
+    for i in range(5):
+        record = resource.add_task(
+            'media', E.Task(href=str(i), status='success', Owner='vm'))
+    assert record == {'href': '4', 'status': 'success'}
+    assert [r['href'] for r in resource.tasks['media']] == ['2', '3', '4']
+
+
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_resource_task_status(*_, **__):
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    resource = VCloudResource(vcloud_connect, 'vdc')
+    task = E.Task(href='foo', status='queued', operationName='bar')
+    resource.client.get_resource.return_value = E.Task(
+        href='foo', status='running', operationName='bar')
+    with pytest.raises(VCloudSDKRetryException) as e:
+        resource.task_successful(task, wait=False)
+    assert e.value.retry_after == resource.task_retry_after
+    resource.client.get_resource.assert_called_once_with('foo')
+    assert not resource.client.get_task_monitor.called
+    resource.client.get_resource.return_value = E.Task(
+        E.Error(message='baz'), href='foo', status='error')
+    with pytest.raises(VcdTaskException):
+        resource.task_successful(task, wait=False)
+    resource.client.get_resource.return_value = E.Task(
+        href='foo', status='success')
+    assert resource.task_successful(task, wait=False)
+
+    task_set = TaskSet(['foo', 'bar'])
+    resource.client.get_resource.return_value = E.Task(
+        href='foo', status='running')
+    with pytest.raises(VCloudSDKRetryException):
+        resource.tasks_successful(task_set, wait=False)
+    resource.client.get_resource.return_value = E.Task(
+        href='foo', status='success')
+    assert resource.tasks_successful(task_set, wait=False)
+
+
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_resource_lazy_vdc(client_class, org_class):
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    resource = VCloudVM('foo', 'bar', vcloud_connect, 'vdc')
+    assert not client_class.called
+    assert not org_class.called
+    assert isinstance(resource.vdc, pyvcloud_vdc)
+    assert resource.vdc is resource.vapp_object.vdc
+    assert org_class.return_value.get_vdc.call_count == 1
+
+    # Org.get_vdc returns None if there is no such VDC.
+    org_class.return_value.get_vdc.return_value = None
+    resource = VCloudResource(vcloud_connect, 'other')
+    assert resource.vdc is None
+    assert resource.vdc is None
+    assert org_class.return_value.get_vdc.call_count == 2
+
+
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp')
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
@@ -95,7 +209,7 @@ def test_vcloud_iso():
     assert not os.path.exists(path)
 
 
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_disk')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
 def test_vcloud_disk(*_, **__):
@@ -108,8 +222,12 @@ def test_vcloud_disk(*_, **__):
     assert vcloud_disk.href == 'foo/bar'
     assert vcloud_disk._get_identifier('id') == 'bar'
     assert 'id', 'href' in vcloud_disk.exposed_data
+    with mock.patch.object(VCloudDisk, 'get_disk') as get_disk:
+        vcloud_disk.exposed_data
+    # The disk is read once.
+    assert get_disk.call_count == 1
     result = vcloud_disk.disk
-    assert vcloud_disk.vdc.get_disk.called
+    vcloud_disk.client.get_resource.assert_called_with('foo')
     vcloud_disk.vdc.client.get_api_version = (lambda: '33')
     assert vcloud_disk.get_disk() == result
     vcloud_disk.create()
@@ -117,10 +235,8 @@ def test_vcloud_disk(*_, **__):
 
 
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_routed_orgvdc_network')
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_direct_orgvdc_network')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_isolated_orgvdc_network')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway', return_value={'href': 'foo'})
 @mock.patch('pyvcloud.vcd.platform.Platform.get_external_network',
             return_value={'href': 'foo'})
@@ -202,6 +318,47 @@ def test_vcloud_gateway(*_, **__):
     assert vcloud_gateway.vdc.get_gateway.called
 
 
+@mock.patch('pyvcloud.vcd.gateway.Gateway.list_firewall_objects')
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_nat_rules')
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_firewall_rules')
+@mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway', return_value={'href': 'foo'})
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_gateway_config(*args):
+    get_firewall_rules, get_nat_rules, list_firewall_objects = args[3:]
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    vcloud_gateway = VCloudGateway('foo', vcloud_connect, 'vdc', {})
+    get_firewall_rules.return_value = objectify.fromstring(
+        '<firewall><firewallRules>'
+        '<firewallRule><id>1</id><name>a</name><ruleType>user</ruleType>'
+        '</firewallRule>'
+        '<firewallRule><id>2</id><name>b</name><ruleType>user</ruleType>'
+        '</firewallRule>'
+        '</firewallRules></firewall>')
+    get_nat_rules.return_value = objectify.fromstring(
+        '<nat><natRules><natRule><ruleId>3</ruleId><action>dnat</action>'
+        '<enabled>true</enabled></natRule></natRules></nat>')
+
+    assert vcloud_gateway.get_list_of_rule_ids() == [1, 2]
+    assert [r['name'] for r in vcloud_gateway.firewall_rules] == ['a', 'b']
+    assert vcloud_gateway.nat_rules == [
+        {'ID': 3, 'Action': 'dnat', 'Enabled': True}]
+    vcloud_gateway.firewall_objects
+    vcloud_gateway.firewall_objects
+    # Every section is read once.
+    assert get_firewall_rules.call_count == 1
+    assert get_nat_rules.call_count == 1
+    assert list_firewall_objects.call_count == 10
+
+    # Changes read the section again.
+    vcloud_gateway.invalidate_config('firewall')
+    vcloud_gateway.firewall_rules
+    vcloud_gateway.nat_rules
+    assert get_firewall_rules.call_count == 2
+    assert get_nat_rules.call_count == 1
+
+
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('pyvcloud.vcd.gateway.Gateway._build_dhcp_href')
 @mock.patch('pyvcloud.vcd.gateway.Gateway.get_firewall_rules')
@@ -212,7 +369,7 @@ def test_vcloud_gateway(*_, **__):
 @mock.patch('pyvcloud.vcd.gateway.Gateway._build_firewall_rule_href')
 @mock.patch('pyvcloud.vcd.firewall_rule.FirewallRule._build_network_href')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway',
-            return_value={'href': 'foo'})
+            return_value={'href': 'https://vcd/api/edgeGateway/foo'})
 @mock.patch('pyvcloud.vcd.platform.Platform.get_external_network',
             return_value={'href': 'foo'})
 def test_vcloud_gateway_firewall_rule(*_, **__):
@@ -223,11 +380,14 @@ def test_vcloud_gateway_firewall_rule(*_, **__):
     config = {}
     vcloud_gateway = VCloudGateway('foo', vcloud_connect, 'vdc', config, tasks)
 
-    try:
+    with mock.patch('vcd_plugin_sdk.resources.network.post_for_location',
+                    return_value='https://vcd/network/edges/foo/'
+                                 'firewall/config/rules/7'):
         vcloud_gateway.create_firewall_rule('foo')
-    except VCloudSDKException:
-        assert vcloud_gateway.client.put_resource.called
-        assert vcloud_gateway.client.put_resource.call_count == 1
+        # The ID of the new rule is the one from the Location header.
+        vcloud_gateway.client.put_resource.assert_called_once()
+        assert vcloud_gateway.client.put_resource.call_args[0][0] == \
+            'https://vcd/network/edges/foo/firewall/config/rules/7'
 
     firewall_rule = mock.Mock()
 
@@ -243,32 +403,103 @@ def test_vcloud_gateway_firewall_rule(*_, **__):
 
     assert isinstance(vcloud_gateway.get_list_of_rule_ids(), list)
 
-    with mock.patch('vcd_plugin_sdk.resources.network.'
-                    'FirewallRule') as firewall_rule:
-        firewall_rule.resource = mock.Mock()
-        firewall_rule_list = ['id']
-        with mock.patch('vcd_plugin_sdk.resources.network.'
-                        'VCloudGateway.get_list_of_rule_ids',
-                        return_value=firewall_rule_list):
-            try:
-                vcloud_gateway.infer_rule(
-                    firewall_rule().resource.name, ['id'], True)
-            except VCloudSDKException:
-                pytest.fail('Infer rule failed to return a rule.')
-
-            try:
-                vcloud_gateway.infer_rule(
-                    firewall_rule().resource.name, ['no-id'])
-            except VCloudSDKException:
-                pytest.fail('Infer rule failed to return a rule.')
+    vcloud_gateway.invalidate_config()
+    with mock.patch('pyvcloud.vcd.gateway.Gateway.get_firewall_rules',
+                    return_value=objectify.fromstring(
+                        '<firewall><firewallRules>'
+                        '<firewallRule><id>1</id><name>a</name></firewallRule>'
+                        '<firewallRule><id>2</id><name>a</name></firewallRule>'
+                        '<firewallRule><id>3</id><name>true</name>'
+                        '</firewallRule>'
+                        '</firewallRules></firewall>')):
+        get_resource_calls = vcloud_gateway.client.get_resource.call_count
+        assert vcloud_gateway.infer_rule('a', ['2'], True).resource_id == '2'
+        assert vcloud_gateway.infer_rule('a', [2]).resource_id == '1'
+        assert vcloud_gateway.infer_rule('a', [1]).resource.id == 2
+        assert vcloud_gateway.infer_rule('true').resource_id == '3'
+        with pytest.raises(VCloudSDKException):
+            vcloud_gateway.infer_rule('b', [1])
+        # The rules are not read one by one.
+        assert vcloud_gateway.client.get_resource.call_count == \
+            get_resource_calls
 
 
+@mock.patch('vcd_plugin_sdk.resources.network.post_for_location')
+@mock.patch('pyvcloud.vcd.gateway.Gateway.list_firewall_objects',
+            return_value=[{'name': 'ExtNw',
+                           'prop': [{'name': 'vnicGroupId',
+                                     'value': 'vnic-0'}]}])
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_firewall_rules')
+@mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway',
+            return_value={'href': 'https://vcd/api/edgeGateway/foo'})
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
-@mock.patch('pyvcloud.vcd.gateway.Gateway._build_nat_rule_href')
+def test_vcloud_gateway_create_firewall_rules(*args):
+    get_firewall_rules, list_firewall_objects, post_for_location = args[3:]
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    vcloud_gateway = VCloudGateway('foo', vcloud_connect, 'vdc', {})
+    rule_xml = '<firewallRule><id>{0}</id><name>{1}</name>' \
+               '<ruleType>user</ruleType><enabled>true</enabled>' \
+               '<loggingEnabled>false</loggingEnabled>' \
+               '<action>accept</action></firewallRule>'
+    get_firewall_rules.side_effect = [
+        objectify.fromstring(
+            '<firewall><firewallRules>{0}</firewallRules></firewall>'.format(
+                rule_xml.format(1, 'a'))),
+        objectify.fromstring(
+            '<firewall><firewallRules>{0}{1}{2}</firewallRules>'
+            '</firewall>'.format(rule_xml.format(1, 'a'),
+                                 rule_xml.format(2, 'a'),
+                                 rule_xml.format(3, '123'))),
+    ]
+    # A name that looks like a number is still matched.
+    rules = vcloud_gateway.create_firewall_rules({
+        'a': {'source_values': ['ExtNw:gatewayinterface', '10.0.0.1:ip'],
+              'services': [{'tcp': {'any': 22}}]},
+        '123': {'action': 'deny'},
+    })
+    assert {k: v['Id'] for k, v in rules.items()} == {'a': 2, '123': 3}
+    # One post for all of the rules, and one read before and after it.
+    post_for_location.assert_called_once()
+    assert get_firewall_rules.call_count == 2
+    assert list_firewall_objects.call_count == 1
+    firewall_rules = post_for_location.call_args[0][2]
+    assert [r.findtext('name') for r in firewall_rules] == ['a', '123']
+    assert firewall_rules[0].find('source/vnicGroupId').text == 'vnic-0'
+    assert firewall_rules[0].find('source/ipAddress').text == '10.0.0.1'
+    assert firewall_rules[0].find('application/service/port').text == '22'
+    assert firewall_rules[1].findtext('action') == 'deny'
+    assert vcloud_gateway.client.put_resource.call_count == 0
+
+
+NAT_XML = '''
+<nat><version>1</version><natRules>
+<natRule><ruleId>1</ruleId><ruleType>user</ruleType><action>snat</action>
+<originalAddress>10.10.4.1</originalAddress><originalPort>any</originalPort>
+<translatedAddress>11.11.4.1</translatedAddress>
+<translatedPort>any</translatedPort><protocol>any</protocol>
+<enabled>true</enabled><loggingEnabled>false</loggingEnabled></natRule>
+{0}
+</natRules></nat>
+'''
+
+NAT_RULE_XML = '''
+<natRule><ruleId>2</ruleId><ruleType>user</ruleType><action>dnat</action>
+<originalAddress>10.10.4.2</originalAddress><originalPort>any</originalPort>
+<translatedAddress>11.11.4.2</translatedAddress>
+<translatedPort>any</translatedPort><protocol>any</protocol>
+<enabled>true</enabled><loggingEnabled>false</loggingEnabled>
+<description>Test blueprint example 1</description></natRule>
+'''
+
+
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_nat_rules')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway',
-            return_value={'href': 'foo'})
-def test_vcloud_gateway_nat_rule(*_, **__):
+            return_value={'href': 'https://vcd/api/edgeGateway/foo'})
+def test_vcloud_gateway_nat_rule(_, get_nat_rules, *__):
     logger = mock.Mock()
     tasks = {'create': [[{'id': 'bar'}, {'href': 'foo/bar'}]], 'delete': []}
     vcloud_connect = VCloudConnect(logger, TEST_CONFIG, TEST_CREDENTIALS)
@@ -279,7 +510,63 @@ def test_vcloud_gateway_nat_rule(*_, **__):
         'original_address': '10.10.4.2',
         'translated_address': '11.11.4.2',
         'description': 'Test blueprint example 1'}
-    assert isinstance(vcloud_gateway.create_nat_rule(rule_definition), dict)
+    existing_definition = {
+        'action': 'snat',
+        'original_address': '10.10.4.1',
+        'translated_address': '11.11.4.1'}
+    get_nat_rules.side_effect = [
+        objectify.fromstring(NAT_XML.format('')),
+        objectify.fromstring(NAT_XML.format(NAT_RULE_XML)),
+    ]
+    put_resource = vcloud_gateway.client.put_resource
+    # Rule 1 was created by an earlier attempt.
+    nat_rules = vcloud_gateway.create_nat_rules(
+        [rule_definition, existing_definition], ['1'])
+    assert [nat_rule['ID'] for nat_rule in nat_rules] == [2, 1]
+    # Only the new rule is added, with a single write.
+    put_resource.assert_called_once()
+    nat_config = put_resource.call_args[0][1]
+    assert put_resource.call_args[0][0] == \
+        'https://vcd/network/edges/foo/nat/config'
+    assert [str(r.originalAddress) for r in nat_config.natRules.natRule] \
+        == ['10.10.4.1', '10.10.4.2']
+    assert get_nat_rules.call_count == 2
+    # The rule is found in the index.
+    assert vcloud_gateway.create_nat_rule(rule_definition, [2])['ID'] == 2
+    assert put_resource.call_count == 1
+
+    # A rule with the same definition, that is not ours, is left alone.
+    snat_rule_xml = NAT_XML[NAT_XML.index('<natRule>'):NAT_XML.index('{0}')]
+    snat_rule_xml = snat_rule_xml.replace('<ruleId>1<', '<ruleId>3<')
+    get_nat_rules.side_effect = [
+        objectify.fromstring(NAT_XML.format('')),
+        objectify.fromstring(NAT_XML.format(snat_rule_xml)),
+    ]
+    vcloud_gateway.invalidate_config('nat')
+    assert vcloud_gateway.create_nat_rule(existing_definition)['ID'] == 3
+    assert put_resource.call_count == 2
+    nat_config = put_resource.call_args[0][1]
+    assert [str(r.originalAddress) for r in nat_config.natRules.natRule] \
+        == ['10.10.4.1', '10.10.4.1']
+    # Nor is a rule on another vNIC.
+    get_nat_rules.side_effect = [
+        objectify.fromstring(NAT_XML.format('')),
+        objectify.fromstring(NAT_XML.format(snat_rule_xml.replace(
+            '</natRule>', '<vnic>1</vnic></natRule>'))),
+    ]
+    vcloud_gateway.invalidate_config('nat')
+    assert vcloud_gateway.create_nat_rule(
+        dict(existing_definition, vnic=1), ['1'])['ID'] == 3
+    assert put_resource.call_count == 3
+
+    get_nat_rules.side_effect = None
+    get_nat_rules.return_value = objectify.fromstring(
+        NAT_XML.format(NAT_RULE_XML))
+    vcloud_gateway.invalidate_config('nat')
+    assert vcloud_gateway.delete_nat_rules([1, '3']) == ['3']
+    assert put_resource.call_count == 4
+    nat_config = put_resource.call_args[0][1]
+    assert [r.ruleId for r in nat_config.natRules.natRule] == [2]
 
     with mock.patch('vcd_plugin_sdk.resources.network.NatRule'):
         assert isinstance(vcloud_gateway.delete_nat_rule('foo'),
@@ -296,59 +583,122 @@ def test_vcloud_gateway_nat_rule(*_, **__):
     assert vcloud_gateway.compare_nat_rule(info, rule_definition)
 
 
+DHCP_XML = '''
+<dhcp><enabled>true</enabled><ipPools>
+<ipPool><poolId>pool-1</poolId><autoConfigureDNS>false</autoConfigureDNS>
+<leaseTime>86400</leaseTime><ipRange>192.170.1.2-192.170.1.100</ipRange>
+</ipPool>
+{0}
+</ipPools></dhcp>
+'''
+
+DHCP_POOL_XML = '''
+<ipPool><poolId>pool-2</poolId><autoConfigureDNS>false</autoConfigureDNS>
+<leaseTime>86400</leaseTime><ipRange>192.170.2.2-192.170.2.100</ipRange>
+</ipPool>
+'''
+
+
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
-@mock.patch('pyvcloud.vcd.gateway.Gateway._build_dhcp_href')
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_dhcp')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway',
-            return_value={'href': 'foo'})
-def test_vcloud_gateway_dhcp_pool(*_, **__):
+            return_value={'href': 'https://vcd/api/edgeGateway/foo'})
+def test_vcloud_gateway_dhcp_pool(_, get_dhcp, *__):
     logger = mock.Mock()
     tasks = {'create': [[{'id': 'bar'}, {'href': 'foo/bar'}]], 'delete': []}
     vcloud_connect = VCloudConnect(logger, TEST_CONFIG, TEST_CREDENTIALS)
     config = {}
     vcloud_gateway = VCloudGateway('foo', vcloud_connect, 'vdc', config, tasks)
+    put_resource = vcloud_gateway.client.put_resource
     pool_definition = {'ip_range': '192.170.2.2-192.170.2.100'}
-    with mock.patch('vcd_plugin_sdk.resources.network.'
-                    'VCloudGateway.get_dhcp_pool_from_ip_range'):
-        assert isinstance(vcloud_gateway.add_dhcp_pool(pool_definition),
-                          mock.MagicMock)
+    existing_definition = {'ip_range': '192.170.1.2-192.170.1.100'}
+    get_dhcp.side_effect = [
+        objectify.fromstring(DHCP_XML.format('')),
+        objectify.fromstring(DHCP_XML.format(DHCP_POOL_XML)),
+    ]
+    pools = vcloud_gateway.add_dhcp_pools(
+        [pool_definition, existing_definition])
+    assert [pool['ID'] for pool in pools] == ['pool-2', 'pool-1']
+    # Only the new pool is added, with a single write.
+    put_resource.assert_called_once()
+    assert put_resource.call_args[0][0] == \
+        'https://vcd/network/edges/foo/dhcp/config'
+    assert get_dhcp.call_count == 2
+
+    ip_pool = vcloud_gateway.get_dhcp_pool_from_ip_range(
+        pool_definition['ip_range'])
+    assert ip_pool.href == \
+        'https://vcd/network/edges/foo/dhcp/config/ippools/pool-2'
+    assert vcloud_gateway.client.get_resource.call_count == 0
+
+    assert vcloud_gateway.delete_dhcp_pools(
+        [pool_definition, {'ip_range': 'foo'}]) == [{'ip_range': 'foo'}]
+    assert put_resource.call_count == 2
+    dhcp_config = put_resource.call_args[0][1]
+    assert [str(p.ipRange) for p in dhcp_config.ipPools.ipPool] == \
+        [existing_definition['ip_range']]
+    # The index is updated, so nothing is read again.
+    assert vcloud_gateway.get_dhcp_pool_from_ip_range(
+        pool_definition['ip_range']) is None
+    assert get_dhcp.call_count == 2
+
     with mock.patch('vcd_plugin_sdk.resources.network.'
                     'VCloudGateway.get_dhcp_pool_from_ip_range'):
         assert isinstance(vcloud_gateway.delete_dhcp_pool(pool_definition),
                           mock.MagicMock)
 
-    vcloud_gateway.get_dhcp_pool_from_ip_range(pool_definition['ip_range'])
-    assert vcloud_gateway.client.get_resource.call_count == 2
+
+ROUTING_XML = '''
+<staticRouting><staticRoutes>
+<route><network>192.170.1.0/24</network><nextHop>192.168.1.1</nextHop>
+<mtu>1500</mtu><type>user</type><description/><vnic>0</vnic></route>
+</staticRoutes>
+<defaultRoute><gatewayAddress>192.168.1.1</gatewayAddress></defaultRoute>
+</staticRouting>
+'''
 
 
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
-@mock.patch('pyvcloud.vcd.gateway.Gateway._build_static_routes_href')
+@mock.patch('pyvcloud.vcd.gateway.Gateway.get_static_routes')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_gateway',
-            return_value={'href': 'foo'})
-def test_vcloud_gateway_static_route(*_, **__):
+            return_value={'href': 'https://vcd/api/edgeGateway/foo'})
+def test_vcloud_gateway_static_route(_, get_static_routes, *__):
     logger = mock.Mock()
     tasks = {'create': [[{'id': 'bar'}, {'href': 'foo/bar'}]], 'delete': []}
     vcloud_connect = VCloudConnect(logger, TEST_CONFIG, TEST_CREDENTIALS)
     config = {}
     vcloud_gateway = VCloudGateway('foo', vcloud_connect, 'vdc', config, tasks)
-    assert isinstance(vcloud_gateway.get_static_routes(), list)
-    vcloud_gateway.get_static_route_from_network('foo')
+    put_resource = vcloud_gateway.client.put_resource
+    get_static_routes.return_value = objectify.fromstring(ROUTING_XML)
+    assert [r.resource_id for r in vcloud_gateway.get_static_routes()] == \
+        ['192.170.1.0/24']
+    assert vcloud_gateway.get_static_route_from_network('foo') is None
 
-    mock_return = mock.Mock()
-    mock_return.resource_id = 'foo'
-    with mock.patch('vcd_plugin_sdk.resources.network.'
-                    'VCloudGateway.get_static_routes',
-                    return_value=[mock_return]):
-        assert vcloud_gateway.get_static_route_from_network('foo') ==\
-               mock_return
     route_definition = {
         'network': '192.170.3.0/24',
         'next_hop': '192.168.1.1',
         'description': 'Test blueprint example'
     }
-    vcloud_gateway.add_static_route(route_definition)
-    assert vcloud_gateway.client.put_resource.call_count == 1
+    routes = vcloud_gateway.add_static_routes(
+        [route_definition, {'network': '192.170.1.0/24'}])
+    assert [r.resource_id for r in routes] == \
+        ['192.170.3.0/24', '192.170.1.0/24']
+    put_resource.assert_called_once()
+    assert put_resource.call_args[0][0] == \
+        'https://vcd/network/edges/foo/routing/config/static'
+    assert set(vcloud_gateway.static_routes) == \
+        {'192.170.1.0/24', '192.170.3.0/24'}
+
+    assert vcloud_gateway.delete_static_routes(
+        [route_definition, {'network': 'foo'}]) == [{'network': 'foo'}]
+    assert put_resource.call_count == 2
+    assert set(vcloud_gateway.static_routes) == {'192.170.1.0/24'}
+    # The routing configuration is only read once.
+    assert get_static_routes.call_count == 1
+
+    mock_return = mock.Mock()
     with mock.patch('vcd_plugin_sdk.resources.network.'
                     'VCloudGateway.get_static_route_from_network',
                     return_value=mock_return):
@@ -356,7 +706,7 @@ def test_vcloud_gateway_static_route(*_, **__):
         assert mock_return.delete_static_route.called
 
 
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp_href')
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
@@ -376,6 +726,11 @@ def test_vcloud_vapp(*_, **__):
     assert 'resources', 'catalog_items' in vcloud_vapp.exposed_data
     vcloud_vapp.get_catalogs()
     assert vcloud_vapp.connection.org.list_catalogs.call_count == 1
+    CATALOG_ITEMS.invalidate()
+    vcloud_vapp.get_catalog_items()
+    assert vcloud_vapp.connection.org.list_catalogs.call_count == 2
+    assert vcloud_vapp.client.get_typed_query.call_count == 1
+    # The catalog items are cached for the org.
     vcloud_vapp.get_catalog_items()
     assert vcloud_vapp.connection.org.list_catalogs.call_count == 2
     assert isinstance(vcloud_vapp.get_vapp('foo'), pyvcloud_vapp)
@@ -392,27 +747,33 @@ def test_vcloud_vapp(*_, **__):
     assert vcloud_vapp.client.post_linked_resource.call_count == 4
     vcloud_vapp.undeploy()
     assert vcloud_vapp.client.post_linked_resource.call_count == 5
+    vcloud_vapp.client.get_resource.reset_mock()
     with mock.patch('lxml.objectify.deannotate'):
         with mock.patch('lxml.etree.cleanup_namespaces'):
             vcloud_vapp.set_lease(1, 1)
             assert vcloud_vapp.client.put_resource.call_count == 1
-            assert vcloud_vapp.client.get_resource.call_count == 6
+            # The vApp was loaded recently, so it is not reloaded.
+            assert vcloud_vapp.client.get_resource.call_count == 0
+            vcloud_vapp.refresh()
             vcloud_vapp.get_lease()
-            assert vcloud_vapp.client.get_resource.call_count == 7
+            assert vcloud_vapp.client.get_resource.call_count == 1
+            with vcloud_vapp.snapshot():
+                vcloud_vapp.reload_interval = 0
+                vcloud_vapp.get_lease()
+                assert vcloud_vapp.client.get_resource.call_count == 1
+            vcloud_vapp.get_lease()
+            assert vcloud_vapp.client.get_resource.call_count == 2
     vcloud_vapp.remove_network('bar')
     assert vcloud_vapp.vapp.disconnect_org_vdc_network.call_count == 1
 
 
 @mock.patch('pyvcloud.vcd.vapp.VApp.get_vm')
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp')
+@mock.patch('vcd_plugin_sdk.query.TypedQuery.get_href', return_value='foo')
 @mock.patch('pyvcloud.vcd.vdc.VDC.get_vapp_href')
 @mock.patch('pyvcloud.vcd.vdc.VDC.instantiate_vapp')
 @mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
 @mock.patch('pyvcloud.vcd.vapp.VApp.connect_org_vdc_network')
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_routed_orgvdc_network')
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_direct_orgvdc_network')
 @mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
-@mock.patch('pyvcloud.vcd.vdc.VDC.get_isolated_orgvdc_network')
 @mock.patch('pyvcloud.vcd.vapp.VApp.disconnect_org_vdc_network')
 def test_vcloud_vm(*_, **__):
     logger = mock.Mock()
@@ -469,12 +830,10 @@ def test_vcloud_vm(*_, **__):
     assert vcloud_vm.vdc.instantiate_vapp.called
     vcloud_vm.delete()
     assert vcloud_vm.client.delete_linked_resource.called
-    vcloud_vm.check_network('foo', 'routed_vdc_network')
-    assert vcloud_vm.vdc.get_routed_orgvdc_network.called
-    vcloud_vm.check_network('foo', 'isolated_vdc_network')
-    assert vcloud_vm.vdc.get_isolated_orgvdc_network.called
-    vcloud_vm.check_network('foo', 'directly_connected_vdc_network')
-    assert vcloud_vm.vdc.get_direct_orgvdc_network.called
+    for network_type in ['routed_vdc_network',
+                         'isolated_vdc_network',
+                         'directly_connected_vdc_network']:
+        assert vcloud_vm.check_network('foo', network_type)
     vcloud_vm.power_on()
     assert vcloud_vm.client.post_linked_resource.call_count == 1
     vcloud_vm.power_off()
@@ -510,10 +869,240 @@ def test_vcloud_vm(*_, **__):
     vcloud_vm.remove_vapp_network('bar')
     assert \
         vcloud_vm.vapp_object.vapp.disconnect_org_vdc_network.call_count == 1
-    with mock.patch('pyvcloud.vcd.vm.VM.list_nics',
-                    return_value=[
-                        {'ip_address': 'foo'},
-                        {'ip_address': 'bar'}
-                    ]):
+    with mock.patch('pyvcloud.vcd.vm.VM.get_resource',
+                    return_value=objectify.fromstring(VM_XML)):
         assert vcloud_vm.get_nic_from_config(
-            {'ip_address': 'foo'}).get('ip_address') == 'foo'
+            {'ip_address': '10.0.0.2'}).get('ip_address') == '10.0.0.2'
+        assert vcloud_vm.get_nic_from_config({'ip_address': 'foo'}) is None
+    # A VM that is still being created is retried, but not the operation.
+    vcloud_connect.blocking_retries = False
+    with mock.patch('pyvcloud.vcd.vm.VM.get_resource',
+                    return_value=objectify.fromstring(
+                        '<Vm xmlns="http://www.vmware.com/vcloud/v1.5"/>')), \
+            mock.patch('vcd_plugin_sdk.retry.sleep') as sleep:
+        assert set(vcloud_vm.exposed_data) == {'vapp'}
+        assert sleep.call_count == 4
+
+
+def test_get_vm_data():
+    vm_data = get_vm_data(objectify.fromstring(VM_XML))
+    assert vm_data['cpus'] == {'num_cpus': 2, 'num_cores_per_socket': 1}
+    assert vm_data['memory'] == 2048
+    assert vm_data['power_state'] == 4
+    assert vm_data['ip_addresses'] == ['10.0.0.2', '10.0.1.2']
+    assert vm_data['nics'] == [
+        {
+            'index': 0,
+            'connected': 'true',
+            'primary': True,
+            'adapter_type': 'VMXNET3',
+            'network': 'foo',
+            'ip_address_mode': 'MANUAL',
+            'ip_address': '10.0.0.2',
+            'mac_address': '00:50:56:01:01:01',
+        },
+        {
+            'index': 1,
+            'connected': 'false',
+            'primary': False,
+            'adapter_type': 'E1000',
+            'network': 'bar',
+            'ip_address_mode': 'POOL',
+            'ip_address': '10.0.1.2',
+        },
+    ]
+    # A VM that is still being created may have no sections yet.
+    with pytest.raises(AttributeError):
+        get_vm_data(objectify.fromstring(
+            '<Vm xmlns="http://www.vmware.com/vcloud/v1.5"/>'))
+    # But a VM can have no NICs.
+    vm_resource = objectify.fromstring(VM_XML)
+    section = vm_resource.NetworkConnectionSection
+    for connection in section.NetworkConnection:
+        section.remove(connection)
+    assert get_vm_data(vm_resource)['nics'] == []
+
+
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_vapp_catalog_items(*_, **__):
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    vcloud_vapp = VCloudvApp('foo', vcloud_connect, 'vdc')
+    vcloud_connect.org.list_catalogs.return_value = [
+        {'name': 'foo'}, {'name': 'bar'}]
+    vcloud_connect.client.get_typed_query.return_value.execute.return_value = \
+        iter([E.CatalogItemRecord(name='a', catalogName='foo'),
+              E.CatalogItemRecord(name='b', catalogName='foo'),
+              E.CatalogItemRecord(name='c', catalogName='baz')])
+    CATALOG_ITEMS.invalidate()
+    assert vcloud_vapp.get_catalog_items() == {
+        'foo': {
+            'a': [('name', 'a'), ('catalogName', 'foo')],
+            'b': [('name', 'b'), ('catalogName', 'foo')]
+        },
+        'bar': {}
+    }
+    assert not vcloud_connect.org.get_catalog.called
+    # Only the catalogs of the org, even for sysadmin.
+    assert vcloud_connect.client.get_typed_query.call_args[0][0] == \
+        'catalogItem'
+
+    # Without the query service, every catalog is read.
+    vcloud_connect.client.get_typed_query.return_value.execute.side_effect = \
+        OperationNotSupportedException('foo')
+    vcloud_connect.org.get_catalog.side_effect = lambda name: E.Catalog(
+        E.CatalogItems(E.CatalogItem(name=name + '1'),
+                       E.CatalogItem(name=name + '2')))
+    CATALOG_ITEMS.invalidate()
+    assert vcloud_vapp.get_catalog_items() == {
+        'foo': {'foo1': [('name', 'foo1')], 'foo2': [('name', 'foo2')]},
+        'bar': {'bar1': [('name', 'bar1')], 'bar2': [('name', 'bar2')]}
+    }
+
+
+@mock.patch('vcd_plugin_sdk.resources.vapp.VCloudvApp.get_catalog_items')
+@mock.patch('vcd_plugin_sdk.resources.vapp.VCloudvApp.get_lease',
+            return_value='lease')
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_vapp_exposed_data(*args):
+    get_catalog_items = args[3]
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    vcloud_vapp = VCloudvApp('foo', vcloud_connect, 'vdc')
+    assert vcloud_vapp.get_exposed_data(['lease']) == {'lease': 'lease'}
+    assert not get_catalog_items.called
+    assert set(vcloud_vapp.exposed_data) == \
+        {'lease', 'catalog_items', 'resources'}
+    assert get_catalog_items.called
+    with pytest.raises(VCloudSDKException):
+        vcloud_vapp.get_exposed_data(['foo'])
+
+
+@mock.patch('pyvcloud.vcd.vdc.VDC.get_storage_profile')
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_vm_spec(_, __, get_storage_profile):
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    template = E.VAppTemplate(E.Children(E.Vm(
+        E.NetworkConnectionSection(E.PrimaryNetworkConnectionIndex(0)),
+        name='source',
+        id='source',
+        type='vm',
+        href='source/href')))
+    vcloud_connect.client.get_resource.return_value = template
+    vcloud_connect.client.get_api_version.return_value = '33.0'
+    vcloud_connect.org.get_catalog_item.return_value = E.CatalogItem(
+        E.Entity(href='template'))
+    get_storage_profile.return_value = E.VdcStorageProfile(
+        href='storage/gold', name='gold', type='storage')
+    vm_config = {
+        'catalog': 'catalog',
+        'template': 'template',
+        'network': 'network',
+        'ip_allocation_mode': 'pool',
+        'hostname': 'bar',
+        'password': 'secret',
+        'password_auto': False,
+        'storage_profile': 'gold',
+    }
+    vcloud_vm = VCloudVM('bar', 'foo', vcloud_connect, 'vdc',
+                         vapp_kwargs=vm_config)
+    spec = vcloud_vm.get_vm_spec()
+    get_storage_profile.assert_called_once_with('gold')
+    assert 'password_auto' not in spec
+
+    # The spec makes the same VM as instantiate_vapp.
+    item = pyvcloud_vapp(vcloud_connect.client,
+                         resource=template).to_sourced_item(spec)
+    assert item.Source.get('href') == 'source/href'
+    assert item.VmGeneralParams.Name == 'bar'
+    connection = item.InstantiationParams.NetworkConnectionSection.\
+        NetworkConnection
+    assert connection.get('network') == 'network'
+    assert connection.IpAddressAllocationMode == 'POOL'
+    customization = item.InstantiationParams.GuestCustomizationSection
+    assert customization.AdminPassword == 'secret'
+    assert customization.ComputerName == 'bar'
+    assert item.StorageProfile.get('href') == 'storage/gold'
+    assert item.StorageProfile.get('name') == 'gold'
+
+    # A recompose does not apply these, so they are not silently dropped.
+    for key, value in [('memory', 4096), ('ip_address', '10.0.0.2')]:
+        vcloud_vm.vapp_object.kwargs = dict(vm_config, **{key: value})
+        assert get_recompose_unsupported(vcloud_vm.vapp_object.kwargs) == \
+            [key]
+        with pytest.raises(VCloudSDKException):
+            vcloud_vm.get_vm_spec()
+
+
+@mock.patch('pyvcloud.vcd.vapp.VApp.add_vms')
+@mock.patch('vcd_plugin_sdk.resources.base.VCloudResource.get_vapp_resource')
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_vapp_add_vms(*args):
+    add_vms = args[3]
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    template = E.VAppTemplate(E.Children(E.Vm(name='source')))
+    vcloud_connect.client.get_resource.return_value = template
+    vcloud_connect.org.get_catalog_item.return_value = E.CatalogItem(
+        E.Entity(href='template'))
+    add_vms.return_value = E.VApp(E.Tasks(E.Task(href='task')))
+    vapp_kwargs = {
+        'catalog': 'catalog',
+        'template': 'template',
+        'network': 'network',
+        'hostname': None,
+    }
+    vms = [VCloudVM(name, 'foo', vcloud_connect, 'vdc',
+                    vapp_kwargs=vapp_kwargs) for name in ['bar', 'baz']]
+    vcloud_vapp = VCloudvApp('foo', vcloud_connect, 'vdc',
+                             kwargs=vapp_kwargs)
+    task = vcloud_vapp.add_vms(vms)
+    assert task.get('href') == 'task'
+    assert vcloud_vapp.tasks['create'] == [{'href': 'task'}]
+    # One recompose request for all of the VMs.
+    add_vms.assert_called_once_with(
+        [{'vapp': template,
+          'source_vm_name': 'source',
+          'target_vm_name': 'bar',
+          'network': 'network'},
+         {'vapp': template,
+          'source_vm_name': 'source',
+          'target_vm_name': 'baz',
+          'network': 'network'}],
+        deploy=True,
+        power_on=True,
+        all_eulas_accepted=None)
+    # The template is only read once.
+    vcloud_connect.client.get_resource.assert_called_once_with('template')
+
+
+@mock.patch('pyvcloud.vcd.vm.VM.undeploy')
+@mock.patch('pyvcloud.vcd.vapp.VApp.delete_vms')
+@mock.patch('pyvcloud.vcd.vapp.VApp.get_all_vms')
+@mock.patch('vcd_plugin_sdk.resources.base.VCloudResource.get_vapp_resource')
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_vapp_delete_vms(*args):
+    get_all_vms, delete_vms, undeploy = args[3:]
+    vcloud_connect = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    vcloud_vapp = VCloudvApp('foo', vcloud_connect, 'vdc')
+    get_all_vms.return_value = [E.Vm(name='bar', deployed='true'),
+                                E.Vm(name='baz', deployed='false'),
+                                E.Vm(name='qux', deployed='true')]
+    undeploy.return_value = E.Task(href='undeploy')
+    task_set = vcloud_vapp.undeploy_vms(['bar', 'baz'])
+    # Only the deployed VMs that were requested are undeployed.
+    assert undeploy.call_count == 1
+    assert list(task_set) == ['undeploy']
+
+    delete_vms.return_value = E.VApp(E.Tasks(E.Task(href='delete')))
+    task = vcloud_vapp.delete_vms(['bar', 'baz'])
+    assert task.get('href') == 'delete'
+    delete_vms.assert_called_once_with(['bar', 'baz'])
+    assert vcloud_vapp.tasks['delete'] == [{'href': 'delete'}]
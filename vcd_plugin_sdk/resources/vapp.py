@@ -12,18 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from time import sleep
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from pyvcloud.vcd.vm import VM
 from pyvcloud.vcd.vapp import VApp
-from pyvcloud.vcd.client import TaskStatus
+from pyvcloud.vcd.client import (
+    TaskStatus,
+    ResourceType,
+    VmNicProperties,
+    QueryResultFormat)
 from pyvcloud.vcd.exceptions import (
     VcdTaskException,
-    EntityNotFoundException)
+    AccessForbiddenException,
+    EntityNotFoundException,
+    OperationNotSupportedException)
 
 from .base import VCloudResource
 from .network import VCloudNetwork
+from ..retry import retry
+from ..tasks import TaskSet
+from ..query import get_resource_by_query
 from ..exceptions import VCloudSDKException
+from ..connection import ResourceCache, VCloudSessionPool
 
 POWER_STATES = (
     (8, 'powered off'),
@@ -31,9 +42,123 @@ POWER_STATES = (
     (3, 'suspended')
 )
 
+# Catalog items of every org, shared by all of the connections in a process.
+CATALOG_ITEMS = ResourceCache(ttl=300)
+
+# The VM config that VApp.to_sourced_item applies as it is, when VMs are
+# added to a vApp with a recompose.
+RECOMPOSE_VM_KEYS = ['hostname',
+                     'password',
+                     'password_reset',
+                     'cust_script',
+                     'network',
+                     'ip_allocation_mode']
+# The VM config that VDC.instantiate_vapp applies, but a recompose does not.
+INSTANTIATE_ONLY_VM_KEYS = ['memory',
+                            'cpu',
+                            'disk_size',
+                            'ip_address',
+                            'network_adapter_type']
+
+
+def get_recompose_unsupported(vm_config):
+    """ Get the keys of a VM config that a recompose cannot apply, so that
+    such VMs are created with instantiate_vapp instead.
+
+    :param vm_config: the VM config, as for VCloudvApp.instantiate_vapp.
+    :return: list of keys.
+    """
+    return [key for key in INSTANTIATE_ONLY_VM_KEYS
+            if vm_config.get(key) is not None]
+
+
+def get_vm_data(vm_resource):
+    """Extract the CPU, memory, NIC, power state and IP data of a VM from a
+    single VM document, instead of calling VM.get_cpus, VM.get_memory and
+    VM.list_nics, which each read the VM separately.
+
+    :param vm_resource: Element {http://www.vmware.com/vcloud/v1.5}Vm
+    :return: dict
+    :raises AttributeError: if the VM has no VmSpecSection or
+        NetworkConnectionSection yet, like VM.get_cpus and VM.list_nics.
+    """
+    for section in ['VmSpecSection', 'NetworkConnectionSection']:
+        if not hasattr(vm_resource, section):
+            raise AttributeError(
+                'The VM {name} has no {section}.'.format(
+                    name=vm_resource.get('name'), section=section))
+    data = {
+        'cpus': None,
+        'memory': None,
+        'nics': [],
+        'power_state': None,
+        'ip_addresses': [],
+    }
+    status = vm_resource.get('status')
+    if status is not None:
+        data['power_state'] = int(status)
+
+    spec = vm_resource.VmSpecSection
+    data['cpus'] = {
+        'num_cpus': int(spec.NumCpus.text),
+        'num_cores_per_socket': int(spec.NumCoresPerSocket.text)
+    }
+    data['memory'] = int(spec.MemoryResourceMb.Configured.text)
+
+    section = vm_resource.NetworkConnectionSection
+    primary_index = None
+    if hasattr(section, 'PrimaryNetworkConnectionIndex'):
+        primary_index = section.PrimaryNetworkConnectionIndex.text
+    if not hasattr(section, 'NetworkConnection'):
+        return data
+    for connection in section.NetworkConnection:
+        index = connection.NetworkConnectionIndex.text
+        nic = {
+            VmNicProperties.INDEX.value: int(index),
+            VmNicProperties.CONNECTED.value: connection.IsConnected.text,
+            VmNicProperties.PRIMARY.value: primary_index == index,
+            VmNicProperties.ADAPTER_TYPE.value:
+                connection.NetworkAdapterType.text,
+            VmNicProperties.NETWORK.value:
+                connection.get(VmNicProperties.NETWORK.value),
+            VmNicProperties.IP_ADDRESS_MODE.value:
+                connection.IpAddressAllocationMode.text,
+        }
+        if hasattr(connection, 'IpAddress'):
+            nic[VmNicProperties.IP_ADDRESS.value] = connection.IpAddress.text
+            data['ip_addresses'].append(connection.IpAddress.text)
+        if hasattr(connection, 'MACAddress'):
+            nic[VmNicProperties.MAC_ADDRESS.value] = \
+                connection.MACAddress.text
+        data['nics'].append(nic)
+    return data
+
+
+def get_recompose_task(result):
+    """The recompose request returns the vApp, which holds the task.
+
+    :param result: Element {http://www.vmware.com/vcloud/v1.5}VApp
+    :return: Element {http://www.vmware.com/vcloud/v1.5}Task
+    """
+    if hasattr(result, 'Tasks'):
+        return result.Tasks.Task[0]
+    return result
+
 
 class VCloudvApp(VCloudResource):
 
+    # The fields of exposed_data, and the methods that compute them.
+    EXPOSED_FIELDS = {
+        'lease': 'get_lease',
+        'catalog_items': 'get_catalog_items',
+        'resources': 'get_resources',
+    }
+    # Fields that take several requests to compute.
+    EXPENSIVE_FIELDS = ['catalog_items', 'resources']
+    catalog_page_size = 128
+    # The most catalogs that are read at the same time.
+    catalog_workers = 8
+
     def __init__(self,
                  vapp_name,
                  connection=None,
@@ -54,10 +179,12 @@ class VCloudvApp(VCloudResource):
 
     @property
     def vapp(self):
-        if self._vapp:
-            self._vapp.reload()
-        else:
+        if not self._vapp:
             self._vapp = self.get_vapp(self.vapp_name)
+            self.mark_reloaded('vapp')
+        elif self.needs_reload('vapp'):
+            self._vapp.reload()
+            self.mark_reloaded('vapp')
         return self._vapp
 
     @property
@@ -70,40 +197,161 @@ class VCloudvApp(VCloudResource):
 
     @property
     def exposed_data(self):
-        return {
-            'lease': self.get_lease(),
-            'catalog_items': self.get_catalog_items(),
-            'resources': self.vdc.list_resources()
-        }
+        return self.get_exposed_data()
+
+    def get_exposed_data(self, fields=None):
+        """ Compute only the selected fields of exposed_data.
+
+        :param fields: names from EXPOSED_FIELDS, or None for all of them.
+        :return: dict
+        """
+        if fields is None:
+            fields = list(self.EXPOSED_FIELDS)
+        data = {}
+        for field in fields:
+            try:
+                method = self.EXPOSED_FIELDS[field]
+            except KeyError:
+                raise VCloudSDKException(
+                    'The field {f} is not one of {fields}.'.format(
+                        f=field, fields=list(self.EXPOSED_FIELDS)))
+            data[field] = getattr(self, method)()
+        return data
+
+    def get_resources(self):
+        return self.vdc.list_resources()
 
     def get_catalogs(self):
         return self.connection.org.list_catalogs()
 
     def get_catalog_items(self):
+        """ Get the items of every catalog in the org, by catalog name
+        and item name. The result is cached per org, see CATALOG_ITEMS.
+
+        :return: dict
+        """
+        key = ('catalog_items',) + VCloudSessionPool.get_key(
+            self.connection.client_config, self.connection.credentials)
+        items = CATALOG_ITEMS.get(key)
+        if items is None:
+            items = CATALOG_ITEMS.set(self._get_catalog_items(), key)
+        return {name: dict(catalog) for name, catalog in items.items()}
+
+    def _get_catalog_items(self):
+        catalog_names = [c.get('name') for c in self.get_catalogs()]
+        try:
+            return self.query_catalog_items(catalog_names)
+        except (AccessForbiddenException, OperationNotSupportedException) as e:
+            self.logger.debug(
+                'Unable to query catalog items, '
+                'reading every catalog instead: {e}'.format(e=e))
+        # Each catalog is a separate request, so we make them in parallel.
+        workers = max(1, min(self.catalog_workers, len(catalog_names)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(catalog_names,
+                            executor.map(self.read_catalog_items,
+                                         catalog_names)))
+
+    def query_catalog_items(self, catalog_names):
+        """ Get the catalog items with the query service, page by page,
+        instead of reading every catalog.
+
+        :param catalog_names: the names of the catalogs in the org.
+        :return: dict
+        """
+        items = {name: {} for name in catalog_names}
+        # Not ADMIN_CATALOG_ITEM, even for sysadmin, because that returns
+        # the items of every org, where other catalogs have the same names.
+        query = self.client.get_typed_query(
+            ResourceType.CATALOG_ITEM.value,
+            query_result_format=QueryResultFormat.RECORDS,
+            page_size=self.catalog_page_size)
+        for record in query.execute():
+            catalog_name = record.get('catalogName')
+            if catalog_name in items:
+                items[catalog_name][record.get('name')] = record.items()
+        return items
+
+    def read_catalog_items(self, catalog_name):
         items = {}
-        for catalog in self.get_catalogs():
-            catalog_name = catalog.get('name')
-            if catalog_name not in items:
-                items[catalog_name] = {}
-            c = self.connection.org.get_catalog(catalog_name)
-            if hasattr(c.CatalogItems, 'CatalogItem'):
-                items[catalog_name][
-                    c.CatalogItems.CatalogItem.get('name')] = \
-                    c.CatalogItems.CatalogItem.items()
+        catalog = self.connection.org.get_catalog(catalog_name)
+        if hasattr(catalog.CatalogItems, 'CatalogItem'):
+            for item in catalog.CatalogItems.CatalogItem:
+                items[item.get('name')] = item.items()
         return items
 
     def get_vapp(self, vapp_name=None):
-        vapp_resource = self.vdc.get_vapp(vapp_name)
+        vapp_resource = self.get_vapp_resource(vapp_name or self.name)
         return VApp(self.client, resource=vapp_resource)
 
     def instantiate_vapp(self):
         task = self.vdc.instantiate_vapp(name=self.name, **self.kwargs)
-        self.tasks['create'].append(task.items())
+        self.add_task('create', task)
+        return task
+
+    def add_vms(self, vms, deploy=True, power_on=True, accept_all_eulas=None):
+        """ Add several VMs to the vApp with a single recompose task,
+        instead of instantiating them one at a time.
+
+        :param vms: list of VCloudVM objects in this vApp.
+        :param deploy: deploy the vApp after adding the VMs.
+        :param power_on: power on the vApp after adding the VMs.
+        :param accept_all_eulas: accept the EULAs of the templates.
+        :return: the recompose task.
+        """
+        specs = [vm.get_vm_spec() for vm in vms]
+        task = get_recompose_task(
+            self.vapp.add_vms(specs,
+                              deploy=deploy,
+                              power_on=power_on,
+                              all_eulas_accepted=accept_all_eulas))
+        self.add_task('create', task)
+        self.refresh()
+        return task
+
+    def get_vm_resources(self, vm_names=None):
+        """ Get the VMs of the vApp from a single vApp document, instead of
+        resolving every VM separately.
+
+        :param vm_names: the names of the VMs, or None for all of them.
+        :return: list of Element {http://www.vmware.com/vcloud/v1.5}Vm
+        """
+        return [vm_resource for vm_resource in self.vapp.get_all_vms()
+                if vm_names is None or vm_resource.get('name') in vm_names]
+
+    def undeploy_vms(self, vm_names, action='default'):
+        """ Undeploy several VMs of the vApp without waiting between them,
+        so that vCD runs the tasks at the same time. VMs that are not
+        deployed are skipped.
+
+        :param vm_names: the names of the VMs.
+        :param action: the undeploy power action.
+        :return: TaskSet of the undeploy tasks.
+        """
+        task_set = TaskSet()
+        for vm_resource in self.get_vm_resources(vm_names):
+            if vm_resource.get('deployed') != 'true':
+                continue
+            vm = VM(self.client, resource=vm_resource)
+            task_set.add(vm.undeploy(action))
+        self.refresh()
+        return task_set
+
+    def delete_vms(self, vm_names):
+        """ Delete several undeployed VMs of the vApp with a single
+        recompose task, instead of deleting them one at a time.
+
+        :param vm_names: the names of the VMs.
+        :return: the recompose task.
+        """
+        task = get_recompose_task(self.vapp.delete_vms(vm_names))
+        self.add_task('delete', task)
+        self.refresh()
         return task
 
     def delete(self):
         task = self.vdc.delete_vapp(self.vapp_name)
-        self.tasks['delete'].append(task.items())
+        self.add_task('delete', task)
         return task
 
     def power_on(self, vapp_name=None):
@@ -141,24 +389,14 @@ class VCloudvApp(VCloudResource):
             vapp = self.vapp.get_vm(vapp_name)
             vapp.vapp.undeploy(action)
 
-    # TODO: Not Tested/Not Used
-    # def delete_vms(self, vm_names):
-    #     return self.vapp.delete_vms(vm_names)
-    #
     def add_network(self, **kwargs):
         task = self.vapp.connect_org_vdc_network(**kwargs)
-        if 'add_network' in self.tasks:
-            self.tasks['add_network'].append(task)
-        else:
-            self.tasks['add_network'] = [task]
+        self.add_task('add_network', task)
         return task
 
     def remove_network(self, network_name):
         task = self.vapp.disconnect_org_vdc_network(network_name)
-        if 'remove_network' in self.tasks:
-            self.tasks['remove_network'].append(task)
-        else:
-            self.tasks['remove_network'] = [task]
+        self.add_task('remove_network', task)
         return task
 
     def set_lease(self, deployment_lease=0, storage_lease=0):
@@ -200,19 +438,35 @@ class VCloudVM(VCloudResource):
     def vm(self):
         if not self._vm:
             self._vm = self.get_vm(self.name)
-        else:
+            self.mark_reloaded('vm')
+        elif self.needs_reload('vm'):
             self._vm.reload()
+            self.mark_reloaded('vm')
         return self._vm
 
+    def refresh(self):
+        super().refresh()
+        self.vapp_object.refresh()
+
+    @contextmanager
+    def snapshot(self):
+        with super().snapshot(), self.vapp_object.snapshot():
+            yield self
+
+    @property
+    def vm_data(self):
+        return get_vm_data(self.vm.get_resource())
+
     @property
     def nics(self):
-        return self.vm.list_nics()
+        return self.vm_data['nics']
 
     def _get_data(self):
+        vm_data = self.vm_data
         return {
-            'cpus': self.vm.get_cpus(),
-            'memory': self.vm.get_memory(),
-            'nics': self.nics,
+            'cpus': vm_data['cpus'],
+            'memory': vm_data['memory'],
+            'nics': vm_data['nics'],
         }
 
     @property
@@ -224,18 +478,80 @@ class VCloudVM(VCloudResource):
         data = {
             'vapp': self.vapp_object.name
         }
-        for n in range(0, 5):
-            try:
-                data.update(self._get_data())
-            except AttributeError:
-                sleep(1)
+
+        def _get_data():
+            with self.snapshot():
+                return self._get_data()
+
+        # A VM that is still being created may be missing some sections.
+        # This is best effort, because it runs after the operation did, so
+        # it waits, instead of asking to retry the operation.
+        try:
+            data.update(retry(_get_data,
+                              retry_on=(AttributeError,),
+                              attempts=5,
+                              deadline=15,
+                              on_retry=self.refresh))
+        except AttributeError:
+            pass
         return data
 
     def get_vm(self, vm_name):
-        vm_resource = self.vapp_object.vapp.get_vm(vm_name)
+        # This does not need to download the whole vApp.
+        vm_resource = get_resource_by_query(
+            self.client,
+            ResourceType.VM.value,
+            name=vm_name,
+            containerName=self.vapp_object.name,
+            vdc=self.vdc.href,
+            isVAppTemplate='false')
         vm = VM(self.client, resource=vm_resource)
         return vm
 
+    def get_template_resource(self, catalog_name, template_name):
+        """Get the vApp template of a catalog item, once per connection.
+        """
+        key = ('template', catalog_name, template_name)
+        template = self.connection.cache.get(key)
+        if template is None:
+            item = self.get_template(catalog_name, template_name)
+            template = self.connection.cache.set(
+                self.client.get_resource(item.Entity.get('href')), key)
+        return template
+
+    def get_vm_spec(self):
+        """ Get the specification that adds this VM to its vApp with
+        VApp.add_vms, from the same config as instantiate_vapp.
+
+        :return: dict
+        :raises VCloudSDKException: if the config has keys that a
+            recompose cannot apply, see get_recompose_unsupported.
+        """
+        config = self.vapp_object.kwargs
+        unsupported = get_recompose_unsupported(config)
+        if unsupported:
+            raise VCloudSDKException(
+                'The VM {name} cannot be added with a recompose, because '
+                'it does not apply {keys}.'.format(
+                    name=self.name, keys=unsupported))
+        template = self.get_template_resource(
+            config['catalog'], config['template'])
+        spec = {
+            'vapp': template,
+            'source_vm_name': template.Children.Vm[0].get('name'),
+            'target_vm_name': self.name,
+        }
+        for key in RECOMPOSE_VM_KEYS:
+            if config.get(key) is not None:
+                spec[key] = config[key]
+        # to_sourced_item generates a password if the key is present.
+        if config.get('password_auto'):
+            spec['password_auto'] = True
+        if config.get('storage_profile') is not None:
+            spec['storage_profile'] = self.vdc.get_storage_profile(
+                config['storage_profile'])
+        return spec
+
     def add_vm(self, new_vm_name):
         # TODO: Find the right way to get the original template.
         # Document clearly how to share a VAPP with multiple VMs.
@@ -247,20 +563,19 @@ class VCloudVM(VCloudResource):
               'source_vm_name': self.name,
               'target_vm_name': new_vm_name}]
         )
-        self.tasks['create'].append(task.items())
+        self.add_task('create', task)
         return task
 
     def instantiate_vapp(self):
         task = self.vapp_object.instantiate_vapp()
-        self.tasks['create'].append(task[-1])
+        self.add_task('create', task[-1])
         return task
 
     def delete(self, vm_name=None):
-        # TODO: This can be refactored:
-        # To support bulk delete of VMs using vapp.delete_vms([names])
+        # To delete several VMs of a vApp, use VCloudvApp.delete_vms.
         vm = self.get_vm(vm_name or self.name)
         task = vm.delete()
-        self.tasks['delete'].append(task)
+        self.add_task('delete', task)
         return task
 
     def check_network(self, name, type):
@@ -276,7 +591,7 @@ class VCloudVM(VCloudResource):
         else:
             vm = self.get_vm(vm_name)
             task = vm.power_on()
-        self.tasks['update'].append(task)
+        self.add_task('update', task)
         return task
 
     def power_off(self, vm_name=None):
@@ -285,7 +600,7 @@ class VCloudVM(VCloudResource):
         else:
             vm = self.get_vm(vm_name)
             task = vm.power_off()
-        self.tasks['update'].append(task)
+        self.add_task('update', task)
         return task
 
     def shutdown(self, vm_name=None):
@@ -294,7 +609,7 @@ class VCloudVM(VCloudResource):
         else:
             vm = self.get_vm(vm_name)
             task = vm.shutdown()
-        self.tasks['update'].append(task)
+        self.add_task('update', task)
         return task
 
     def deploy(self, vm_name=None, power_on=True, force_customization=False):
@@ -303,7 +618,7 @@ class VCloudVM(VCloudResource):
         else:
             vm = self.get_vm(vm_name)
             task = vm.deploy(power_on, force_customization)
-        self.tasks['update'].append(task)
+        self.add_task('update', task)
         return task
 
     def undeploy(self, vm_name=None, action='default'):
@@ -312,7 +627,7 @@ class VCloudVM(VCloudResource):
         else:
             vm = self.get_vm(vm_name)
             task = vm.undeploy(action)
-        self.tasks['update'].append(task)
+        self.add_task('update', task)
         return task
 
     def attach_disk_to_vm(self, disk_href, vm_name=None):
@@ -324,60 +639,45 @@ class VCloudVM(VCloudResource):
 
     def add_nic(self, **kwargs):
         task = self.vm.add_nic(**kwargs)
-        if 'add_nic' in self.tasks:
-            self.tasks['add_nic'].append(task)
-        else:
-            self.tasks['add_nic'] = [task]
+        self.refresh()
+        self.add_task('add_nic', task)
         return task
 
     def delete_nic(self, index):
         task = self.vm.delete_nic(index)
-        if 'remove_nic' in self.tasks:
-            self.tasks['remove_nic'].append(task)
-        else:
-            self.tasks['remove_nic'] = [task]
+        self.refresh()
+        self.add_task('remove_nic', task)
         return task
 
     # TODO: Untested/Unused.
     # def update_nic(self, **kwargs):
     #     task = self.vm.update_nic(**kwargs)
-    #     if 'update_nic' in self.tasks:
-    #         self.tasks['update_nic'].append(task)
-    #     else:
-    #         self.tasks['update_nic'] = [task]
+    #     self.add_task('update_nic', task)
     #     return task
 
     def attach_media(self, media_id):
         task = self.vm.insert_cd_from_catalog(media_id)
-        if 'media' in self.tasks:
-            self.tasks['media'].append(task)
-        else:
-            self.tasks['media'] = [task]
+        self.add_task('media', task)
         return task
 
     def eject_media(self, media_id):
         task = self.vm.eject_cd(media_id)
-        if 'media' in self.tasks:
-            self.tasks['media'].append(task)
-        else:
-            self.tasks['media'] = [task]
+        self.add_task('media', task)
         return task
 
-    def task_successful(self, task):
+    def task_successful(self, task, wait=True):
         """ Check if a VCD task succeeded.
 
         :param task: Element {http://www.vmware.com/vcloud/v1.5}Task object
+        :param wait: see wait_for_task.
         :return: bool
         """
-        # task = json.loads(task_string)  # If task contains non-JSON
-        # serializable material, we will need to start encoding and decoding.
-        # Leaving this commented out for now.
         try:
-            result = self.client.get_task_monitor().wait_for_success(
-                task, 10)
+            result = self.wait_for_task(task, wait)
         except VcdTaskException as e:
             self.logger.info('Failed to validate task status {e}.'.format(e=e))
             return False
+        self.refresh()
         # Return True if the API says the task succeeded.
         return self.vm.is_powered_on() and \
             result.get('status') == TaskStatus.SUCCESS.value
@@ -390,5 +690,5 @@ class VCloudVM(VCloudResource):
 
     def get_nic_from_config(self, nic_config):
         for nic in self.nics:
-            if nic['ip_address'] == nic_config['ip_address']:
+            if nic.get('ip_address') == nic_config['ip_address']:
                 return nic
@@ -0,0 +1,77 @@
+# Copyright (c) 2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from random import uniform
+from time import sleep, time
+
+from .exceptions import VCloudSDKRetryException
+
+
+def backoff(initial_delay=1, factor=2, max_delay=30, jitter=0.1):
+    """Generate exponentially growing delays, with random jitter, so that
+    concurrent callers do not retry at the same time.
+
+    :param initial_delay: seconds before the first retry.
+    :param factor: multiplier of the delay after every retry.
+    :param max_delay: the delay never grows beyond this.
+    :param jitter: fraction of the delay that is randomly added.
+    """
+    delay = initial_delay
+    while True:
+        yield delay + uniform(0, jitter * delay)
+        delay = min(delay * factor, max_delay)
+
+
+def retry(func,
+          retry_on=(Exception,),
+          predicate=None,
+          attempts=5,
+          deadline=None,
+          blocking=True,
+          on_retry=None,
+          **backoff_kwargs):
+    """Call func until it returns without raising one of the retry_on
+    exceptions, waiting between attempts with exponential backoff.
+
+    :param func: callable that takes no arguments.
+    :param retry_on: tuple of exceptions that are worth retrying.
+    :param predicate: optional callable that receives the exception and
+        returns whether it is worth retrying.
+    :param attempts: the maximum number of calls.
+    :param deadline: optional maximum seconds to spend, including waits.
+    :param blocking: if False, raise VCloudSDKRetryException with the
+        suggested delay instead of sleeping, so that the caller can
+        retry later without holding the thread.
+    :param on_retry: optional callable called before every retry.
+    :param backoff_kwargs: see backoff.
+    :return: the return value of func.
+    """
+    start = time()
+    delays = backoff(**backoff_kwargs)
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except retry_on as e:
+            if predicate and not predicate(e):
+                raise
+            delay = next(delays)
+            if attempt == attempts or \
+                    (deadline is not None and
+                     time() + delay - start > deadline):
+                raise
+            if not blocking:
+                raise VCloudSDKRetryException(str(e), retry_after=delay)
+            sleep(delay)
+            if on_retry:
+                on_retry()
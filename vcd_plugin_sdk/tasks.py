@@ -0,0 +1,127 @@
+# Copyright (c) 2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+from pyvcloud.vcd.client import TaskStatus
+from pyvcloud.vcd.exceptions import VcdTaskException
+
+TASK_FAILED = [TaskStatus.ERROR, TaskStatus.CANCELED, TaskStatus.ABORTED]
+# The task attributes that are kept in the task history of a resource.
+TASK_RECORD_FIELDS = ['href', 'id', 'status', 'operation',
+                      'startTime', 'endTime']
+
+
+def get_task_status(client, task_href):
+    """ Check the status of a VCD task once, without waiting for it.
+
+    :param client: pyvcloud Client
+    :param task_href: the href of the task
+    :return: tuple of TaskStatus SUCCESS, ERROR or RUNNING,
+        and the current task object.
+    """
+    task = client.get_resource(task_href)
+    status = task.get('status').lower()
+    if status == TaskStatus.SUCCESS.value:
+        return TaskStatus.SUCCESS, task
+    elif status in [s.value.lower() for s in TASK_FAILED]:
+        return TaskStatus.ERROR, task
+    return TaskStatus.RUNNING, task
+
+
+def get_task_record(task):
+    """ Make a compact record of a task for the task history.
+
+    :param task: a task, or any other vCD object, that was returned by a
+        vCD request, its items, or a record from an older task history,
+        which was either a list of items or of dicts with one item.
+    :return: dict of the fields in TASK_RECORD_FIELDS that the task has.
+    """
+    if hasattr(task, 'items') and not isinstance(task, dict):
+        # lxml elements, whose items are their attributes.
+        task = task.items()
+    if isinstance(task, (list, tuple)):
+        items = {}
+        for item in task:
+            if isinstance(item, dict):
+                items.update(item)
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                items[item[0]] = item[1]
+        task = items
+    if not isinstance(task, dict):
+        return {}
+    return {field: str(task[field]) for field in TASK_RECORD_FIELDS
+            if task.get(field) is not None}
+
+
+class TaskSet(object):
+
+    def __init__(self, hrefs=None):
+        """All of the VCD tasks that an operation started, so that they
+        can be polled together, instead of waiting for each in turn.
+
+        :param hrefs: hrefs of tasks that are still running.
+        """
+        self._status = OrderedDict(
+            (href, TaskStatus.RUNNING) for href in hrefs or [])
+        self._failed = OrderedDict()
+
+    def __len__(self):
+        return len(self._status)
+
+    def __iter__(self):
+        return iter(self._status)
+
+    def add(self, task):
+        """Track a task, and return it, so that calls can be wrapped.
+
+        :param task: Element {http://www.vmware.com/vcloud/v1.5}Task object
+        :return: the task
+        """
+        if task is not None:
+            self._status[task.get('href')] = TaskStatus.RUNNING
+        return task
+
+    @property
+    def pending(self):
+        return [href for href, status in self._status.items()
+                if status == TaskStatus.RUNNING]
+
+    @property
+    def status(self):
+        """ The aggregate status: ERROR if any task failed,
+        otherwise RUNNING if any task is still running, otherwise SUCCESS.
+        """
+        if self._failed:
+            return TaskStatus.ERROR
+        elif self.pending:
+            return TaskStatus.RUNNING
+        return TaskStatus.SUCCESS
+
+    def poll(self, client):
+        """ Check every task that is still running once.
+
+        :param client: pyvcloud Client
+        :return: the aggregate status.
+        """
+        for href in self.pending:
+            status, task = get_task_status(client, href)
+            self._status[href] = status
+            if status == TaskStatus.ERROR:
+                self._failed[href] = task
+        return self.status
+
+    def raise_for_failure(self):
+        for task in self._failed.values():
+            raise VcdTaskException(task.get('status'), task.Error)
@@ -1,13 +1,23 @@
 import mock
+import pytest
 
 from pyvcloud.vcd.org import Org as pyvcloud_org
+from pyvcloud.vcd.vdc import VDC as pyvcloud_vdc
 from pyvcloud.vcd.client import Client as pyvcloud_client
+from pyvcloud.vcd.exceptions import (
+    BadRequestException,
+    UnauthorizedException,
+    EntityNotFoundException)
 
 from . import TEST_CONFIG, TEST_CREDENTIALS, TEST_CLIENT_CONFIG
 from ..connection import (
     VCloudConnect,
     VCloudCredentials,
-    VCloudClientConfiguration
+    ResourceCache,
+    VCloudSessionPool,
+    ReauthenticatingRequest,
+    VCloudClientConfiguration,
+    post_for_location
 )
 
 
@@ -24,6 +34,64 @@ def test_vcloud_connect(*_, **__):
     assert isinstance(vcloud_connect.get_org('foo'), pyvcloud_org)
 
 
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_connect_reuses_session(client_class, *_):
+    logger = mock.Mock()
+    with VCloudConnect(logger, TEST_CONFIG, TEST_CREDENTIALS) as connection:
+        assert not client_class.called
+        client = connection.client
+        assert connection.client is client
+        connection.org
+        connection.get_org('foo')
+        assert client_class.call_count == 1
+        assert client.set_credentials.call_count == 1
+        assert isinstance(client._do_request, ReauthenticatingRequest)
+    assert client.logout.call_count == 1
+    assert connection._client is None
+    # Anyone still holding the client can log in again.
+    assert isinstance(client._do_request, ReauthenticatingRequest)
+
+
+def test_reauthenticating_request():
+    client = mock.Mock()
+    credentials = VCloudCredentials(mock.Mock(), **TEST_CREDENTIALS)
+    unauthorized = UnauthorizedException(401, 'foo', {})
+    request = mock.Mock(side_effect=[unauthorized, 'foo'])
+    reauthenticating_request = ReauthenticatingRequest(
+        client, request, credentials, mock.Mock())
+    assert reauthenticating_request('GET', 'bar') == 'foo'
+    assert client.set_credentials.call_count == 1
+    assert request.call_count == 2
+
+    request = mock.Mock(side_effect=unauthorized)
+    reauthenticating_request = ReauthenticatingRequest(
+        client, request, credentials, mock.Mock())
+    with pytest.raises(UnauthorizedException):
+        reauthenticating_request('GET', 'bar')
+    assert client.set_credentials.call_count == 2
+
+
+def test_post_for_location():
+    client = mock.Mock()
+    credentials = VCloudCredentials(mock.Mock(), **TEST_CREDENTIALS)
+    client._do_request = ReauthenticatingRequest(
+        client, mock.Mock(), credentials, mock.Mock())
+    expired = mock.Mock(status_code=401, content=b'')
+    created = mock.Mock(status_code=201, headers={'Location': 'foo'})
+    client._do_request_prim.side_effect = [expired, created]
+    assert post_for_location(client, 'bar', 'baz') == 'foo'
+    assert client.set_credentials.call_count == 1
+    assert client._do_request_prim.call_count == 2
+
+    client._do_request_prim.side_effect = None
+    client._do_request_prim.return_value = mock.Mock(
+        status_code=400, content=b'')
+    with pytest.raises(BadRequestException):
+        post_for_location(client, 'bar', 'baz')
+    assert client.set_credentials.call_count == 1
+
+
 def test_vcloud_client_configuration():
     logger = mock.Mock()
     vcloud_client_config = VCloudClientConfiguration(logger, **TEST_CONFIG)
@@ -34,3 +102,183 @@ def test_vcloud_credentials():
     logger = mock.Mock()
     vcloud_credentials = VCloudCredentials(logger, **TEST_CREDENTIALS)
     assert vcloud_credentials.asdict() == TEST_CREDENTIALS
+
+
+@mock.patch('vcd_plugin_sdk.connection.Client')
+def test_vcloud_session_pool_client_config(client_class):
+    client_class.side_effect = lambda **_: mock.Mock()
+    pool = VCloudSessionPool()
+    unverified = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS, session_pool=pool)
+    verified = VCloudConnect(
+        mock.Mock(),
+        dict(TEST_CONFIG, verify_ssl_certs=True),
+        TEST_CREDENTIALS,
+        session_pool=pool)
+    # A session is not shared by clients that verify certificates
+    # differently.
+    assert verified.client is not unverified.client
+    assert client_class.call_count == 2
+    assert {c[1]['verify_ssl_certs'] for c in client_class.call_args_list} \
+        == {True, False}
+
+
+@mock.patch('vcd_plugin_sdk.connection.Client')
+def test_vcloud_session_pool(client_class):
+    client_class.side_effect = lambda **_: mock.Mock()
+    pool = VCloudSessionPool(max_size=2)
+    first = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS, session_pool=pool)
+    second = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS, session_pool=pool)
+    assert first.client is second.client
+    assert client_class.call_count == 1
+    assert len(pool) == 1
+
+    # Logging out of a pooled connection leaves the session open.
+    client = first.client
+    first.logout()
+    assert not client.logout.called
+    assert first.client is client
+    first.logout()
+    second.logout()
+
+    # A different user gets a different session.
+    other_credentials = dict(TEST_CREDENTIALS, user='bar')
+    other = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, other_credentials, session_pool=pool)
+    assert other.client is not client
+    assert len(pool) == 2
+
+    # A different password never reuses a session.
+    new_password = dict(TEST_CREDENTIALS, password='bar')
+    replaced = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, new_password, session_pool=pool)
+    assert replaced.client is not client
+    assert client.logout.called
+    assert len(pool) == 2
+
+    # The least recently used session is closed when the pool is full.
+    other_client = other.client
+    other.logout()
+    third_credentials = dict(TEST_CREDENTIALS, user='baz')
+    third = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, third_credentials, session_pool=pool)
+    third_client = third.client
+    assert other_client.logout.called
+    assert len(pool) == 2
+
+    # Sessions that are still in use are only removed from the pool.
+    third.logout()
+    pool.clear()
+    assert third_client.logout.called
+    assert not replaced.client.logout.called
+    assert len(pool) == 0
+
+
+@mock.patch('vcd_plugin_sdk.connection.Client')
+@mock.patch('vcd_plugin_sdk.connection.time')
+def test_vcloud_session_pool_expiry(time, client_class):
+    client_class.side_effect = lambda **_: mock.Mock()
+    pool = VCloudSessionPool(idle_timeout=10, max_age=100)
+    credentials = VCloudCredentials(mock.Mock(), **TEST_CREDENTIALS)
+    client_config = VCloudClientConfiguration(mock.Mock(), **TEST_CONFIG)
+
+    time.return_value = 0
+    client = pool.get_client(client_config, credentials, mock.Mock())
+    pool.release(client)
+    time.return_value = 5
+    assert pool.get_client(client_config, credentials, mock.Mock()) is client
+
+    # A session that is in use is never idle.
+    time.return_value = 20
+    assert pool.get_client(client_config, credentials, mock.Mock()) is client
+    pool.release(client)
+    pool.release(client)
+
+    # Idle timeout.
+    time.return_value = 40
+    idle_client = pool.get_client(client_config, credentials, mock.Mock())
+    assert idle_client is not client
+    assert client.logout.called
+    pool.release(idle_client)
+
+    # Maximum age, even though the session is used all the time.
+    for now in range(45, 150, 5):
+        time.return_value = now
+        current = pool.get_client(client_config, credentials, mock.Mock())
+        pool.release(current)
+    assert current is not idle_client
+    assert idle_client.logout.called
+
+    # Sessions that are removed while in use are left open.
+    in_use = pool.get_client(client_config, credentials, mock.Mock())
+    time.return_value = 300
+    assert pool.get_client(
+        client_config, credentials, mock.Mock()) is not in_use
+    assert not in_use.logout.called
+
+
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_connect_session_token(client_class):
+    token = {'token': 'foo', 'is_jwt_token': True}
+    connection = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS, session_token=token)
+    client = connection.client
+    client.rehydrate_from_token.assert_called_once_with('foo', True)
+    assert not client.set_credentials.called
+    client.get_access_token.return_value = 'bar'
+    assert connection.get_session_token() == {
+        'token': 'bar', 'is_jwt_token': True}
+    client.get_access_token.return_value = None
+    client.get_xvcloud_authorization_token.return_value = 'baz'
+    assert connection.get_session_token() == {
+        'token': 'baz', 'is_jwt_token': False}
+
+    # An expired token falls back to logging in.
+    client_class.return_value.rehydrate_from_token.side_effect = \
+        UnauthorizedException(401, 'foo', {})
+    connection = VCloudConnect(
+        mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS, session_token=token)
+    assert connection.client.set_credentials.called
+
+
+@mock.patch('vcd_plugin_sdk.connection.Org', autospec=True)
+@mock.patch('vcd_plugin_sdk.connection.Client', autospec=True)
+def test_vcloud_connect_org_and_vdc_cache(client_class, org_class):
+    connection = VCloudConnect(mock.Mock(), TEST_CONFIG, TEST_CREDENTIALS)
+    org = org_class.return_value
+    org.get_vdc.return_value = {'name': 'vdc', 'href': 'vdc/href'}
+    assert connection.org is connection.org
+    assert client_class.return_value.get_org.call_count == 1
+    vdc = connection.get_vdc('vdc')
+    assert isinstance(vdc, pyvcloud_vdc)
+    assert connection.get_vdc('vdc') is vdc
+    assert org.get_vdc.call_count == 1
+    assert connection.cache.get(('vdc', None, 'vdc/href')) is vdc
+
+    connection.invalidate(('vdc', None, 'vdc/href'))
+    assert connection.cache.get(('vdc', None, 'vdc')) is None
+    assert connection.get_vdc('vdc') is not vdc
+    assert org.get_vdc.call_count == 2
+
+    connection.invalidate()
+    connection.org
+    assert client_class.return_value.get_org.call_count == 2
+
+    org.get_vdc.return_value = None
+    with pytest.raises(EntityNotFoundException):
+        connection.get_vdc('other')
+
+
+@mock.patch('vcd_plugin_sdk.connection.time')
+def test_resource_cache(time):
+    cache = ResourceCache(ttl=10)
+    time.return_value = 0
+    cache.set('foo', 'name', 'href')
+    time.return_value = 5
+    assert cache.get('name') == 'foo'
+    assert cache.get('href') == 'foo'
+    time.return_value = 10
+    assert cache.get('name') is None
+    assert cache.get('href') is None
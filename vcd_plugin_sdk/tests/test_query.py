@@ -0,0 +1,52 @@
+import mock
+import pytest
+
+from pyvcloud.vcd.client import E, QueryResultFormat
+from pyvcloud.vcd.exceptions import (
+    EntityNotFoundException,
+    MultipleRecordsException)
+
+from ..query import TypedQuery, build_filter, get_resource_by_query
+
+
+def test_build_filter():
+    assert build_filter(name='foo bar', vdc='https://vdc/1', id=None) == \
+        'name==foo%20bar;vdc==https%3A//vdc/1'
+    assert build_filter() == ''
+
+
+def test_typed_query():
+    client = mock.Mock()
+    client.is_sysadmin.return_value = False
+    query = TypedQuery(client, 'vm', fields=['name', 'status'],
+                       page_size=10, name='foo')
+    client.get_typed_query.return_value.execute.return_value = \
+        iter([E.VMRecord(href='foo')])
+    assert query.get_href() == 'foo'
+    client.get_typed_query.assert_called_once_with(
+        'vm',
+        query_result_format=QueryResultFormat.RECORDS,
+        page_size=10,
+        qfilter='name==foo',
+        fields='name,status')
+
+    client.is_sysadmin.return_value = True
+    assert query.query_type == 'adminVM'
+    client.get_typed_query.return_value.execute.return_value = iter([])
+    with pytest.raises(EntityNotFoundException):
+        query.get_one()
+    client.get_typed_query.return_value.execute.return_value = \
+        iter([E.VMRecord(href='foo'), E.VMRecord(href='bar')])
+    with pytest.raises(MultipleRecordsException):
+        query.get_one()
+
+
+def test_get_resource_by_query():
+    client = mock.Mock()
+    client.is_sysadmin.return_value = False
+    client.get_typed_query.return_value.execute.return_value = \
+        iter([E.DiskRecord(href='foo')])
+    assert get_resource_by_query(client, 'disk', name='bar') == \
+        client.get_resource.return_value
+    client.get_resource.assert_called_once_with('foo')
+    assert client.get_typed_query.call_args[1]['fields'] == 'name'
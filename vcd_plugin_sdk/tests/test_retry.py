@@ -0,0 +1,60 @@
+import mock
+import pytest
+
+from ..retry import backoff, retry
+from ..exceptions import VCloudSDKRetryException
+
+
+def test_backoff():
+    delays = backoff(initial_delay=1, factor=2, max_delay=5, jitter=0)
+    assert [next(delays) for _ in range(5)] == [1, 2, 4, 5, 5]
+    delays = backoff(initial_delay=2, jitter=0.5)
+    assert 2 <= next(delays) <= 3
+
+
+@mock.patch('vcd_plugin_sdk.retry.sleep')
+def test_retry(sleep):
+    func = mock.Mock(side_effect=[ValueError('foo'), ValueError('foo'), 'bar'])
+    on_retry = mock.Mock()
+    assert retry(func, retry_on=(ValueError,), on_retry=on_retry) == 'bar'
+    assert func.call_count == 3
+    assert sleep.call_count == 2
+    assert on_retry.call_count == 2
+
+    # We give up after the last attempt.
+    func = mock.Mock(side_effect=ValueError('foo'))
+    with pytest.raises(ValueError):
+        retry(func, retry_on=(ValueError,), attempts=3)
+    assert func.call_count == 3
+
+    # Other exceptions are not retried.
+    func = mock.Mock(side_effect=KeyError('foo'))
+    with pytest.raises(KeyError):
+        retry(func, retry_on=(ValueError,))
+    assert func.call_count == 1
+
+    # Neither are the ones that the predicate rejects.
+    func = mock.Mock(side_effect=ValueError('foo'))
+    with pytest.raises(ValueError):
+        retry(func, predicate=lambda e: 'bar' in str(e))
+    assert func.call_count == 1
+
+
+@mock.patch('vcd_plugin_sdk.retry.sleep')
+@mock.patch('vcd_plugin_sdk.retry.time', side_effect=[0, 1, 20])
+def test_retry_deadline(*_):
+    func = mock.Mock(side_effect=ValueError('foo'))
+    with pytest.raises(ValueError):
+        retry(func, attempts=10, deadline=10, jitter=0)
+    assert func.call_count == 2
+
+
+@mock.patch('vcd_plugin_sdk.retry.sleep')
+def test_retry_non_blocking(sleep):
+    func = mock.Mock(side_effect=ValueError('foo'))
+    with pytest.raises(VCloudSDKRetryException) as e:
+        retry(func, blocking=False, initial_delay=3, jitter=0)
+    assert e.value.retry_after == 3
+    assert 'foo' in str(e.value)
+    assert func.call_count == 1
+    assert not sleep.called
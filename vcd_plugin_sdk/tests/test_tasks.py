@@ -0,0 +1,52 @@
+import mock
+import pytest
+
+from pyvcloud.vcd.client import E, TaskStatus
+from pyvcloud.vcd.exceptions import VcdTaskException
+
+from ..tasks import TaskSet, get_task_status
+
+
+def get_mock_client(statuses):
+    client = mock.Mock()
+    client.get_resource.side_effect = \
+        lambda href: E.Task(E.Error(message=href),
+                            href=href,
+                            status=statuses[href])
+    return client
+
+
+def test_get_task_status():
+    client = get_mock_client(
+        {'a': 'success', 'b': 'aborted', 'c': 'preRunning'})
+    assert get_task_status(client, 'a')[0] == TaskStatus.SUCCESS
+    assert get_task_status(client, 'b')[0] == TaskStatus.ERROR
+    assert get_task_status(client, 'c')[0] == TaskStatus.RUNNING
+
+
+def test_task_set():
+    statuses = {'a': 'running', 'b': 'queued'}
+    client = get_mock_client(statuses)
+    task_set = TaskSet(['a'])
+    task = E.Task(href='b')
+    assert task_set.add(task) == task
+    assert task_set.add(None) is None
+    assert list(task_set) == ['a', 'b']
+    assert task_set.poll(client) == TaskStatus.RUNNING
+    assert task_set.pending == ['a', 'b']
+
+    # Finished tasks are not polled again.
+    statuses['a'] = 'success'
+    assert task_set.poll(client) == TaskStatus.RUNNING
+    assert task_set.pending == ['b']
+    client.get_resource.reset_mock()
+    statuses['b'] = 'success'
+    assert task_set.poll(client) == TaskStatus.SUCCESS
+    client.get_resource.assert_called_once_with('b')
+    task_set.raise_for_failure()
+
+    task_set = TaskSet(['a', 'c'])
+    statuses['c'] = 'error'
+    assert task_set.poll(client) == TaskStatus.ERROR
+    with pytest.raises(VcdTaskException):
+        task_set.raise_for_failure()